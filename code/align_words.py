@@ -1,5 +1,7 @@
 import os
+import numpy as np
 from pocketsphinx import Pocketsphinx, get_model_path
+from audio_access import open_audio
 
 def align_words(audio_file, transcript):
     model_path = get_model_path()
@@ -12,7 +14,13 @@ def align_words(audio_file, transcript):
     }
 
     ps = Pocketsphinx(**config)
-    ps.decode(audio_file=audio_file)
+
+    # Feed the decoder from the shared memory-mapped WAV in one-second blocks
+    audio = open_audio(audio_file)
+    ps.start_utt()
+    for _, window in audio.iter_windows(1.0):
+        ps.process_raw(np.ascontiguousarray(window).tobytes(), False, False)
+    ps.end_utt()
 
     hypothesis = ps.hypothesis()
     segments = ps.segments()
@@ -5,14 +5,30 @@ import os
 import subprocess
 import random
 import shutil
+import numpy as np
+from asset_bundle import AssetBundle
+from captions import CaptionTrack, load_caption_words
+from compositor import DirtyRectCompositor
+from frame_grid import frame_count, event_index_per_frame, symbol_per_frame
+from instrumentation import span, traced, count, profile_block
+from motion_layer import MotionLayer, blend_surfaces
+from timeline_store import as_timeline, load_timeline
+from encoder_profiles import get_encoder_profile, build_encode_command, build_lossless_command, build_transcode_command, open_encoder, close_encoder, x264_args
+from render_checkpoints import file_signatures, load_manifest, segment_ranges, segment_inputs_hash, render_checkpointed, concat_segments
+from render_tiers import RENDER_TIERS, prepare_tier_assets
+from viseme_smoothing import frame_blend_weights
 
 def load_viseme_data(viseme_file):
-    """Load viseme data from a JSON file."""
+    """Load viseme data from a .npz timeline or a JSON file."""
+    if not viseme_file.endswith(".json"):
+        return load_timeline(viseme_file)
     with open(viseme_file, "r", encoding="utf-8") as f:
         return json.load(f)
 
 def load_pose_data(pose_data):
-    """Load pose data from a JSON file and validate its structure."""
+    """Load pose data from a .npz timeline, or from a JSON file and validate its structure."""
+    if not pose_data.endswith(".json"):
+        return load_timeline(pose_data)
     with open(pose_data, "r", encoding="utf-8") as f:
         data = json.load(f)
         if not isinstance(data, list):
@@ -27,22 +43,57 @@ def load_pose_data(pose_data):
                     raise ValueError(f"Missing key '{key}' in pose data entry: {entry}")
         return data
 
-def render_animation_to_video(viseme_data, image_directory, output_video, fps, resolution, temp_dir, head_image_path, blink_image_path, pose_folder, pose_data, background_path):
-    """Render animation frames and encode them into a video, with blinks and random poses."""
-    # Debug: print loaded pose_data
-    print("Pose data at the start of render_animation_to_video:")
-    for entry in pose_data:
-        print(entry)  # Log the content of pose_data
+def head_position(resolution, head_image):
+    """Return the top-left position of the head/body image, moved down 25% from the center."""
+    head_x = resolution[0] // 2 - head_image.get_width() // 2
+    head_y = resolution[1] // 2 - head_image.get_height() // 2 + resolution[1] // 4  # Move down 25%
+    return head_x, head_y
+
+def centered_on_head(head_pos, head_image, image):
+    """Return the top-left position that centers an image (mouth, pose) on the head image."""
+    head_x, head_y = head_pos
+    x = head_x + head_image.get_width() // 2 - image.get_width() // 2
+    y = head_y + head_image.get_height() // 2 - image.get_height() // 2
+    return x, y
+
+def character_bounds(resolution, head_image, head_pos, images, blink_image=None):
+    """
+    Return the smallest even-sized rect of the frame that any character sprite can draw into.
+
+    Args:
+        images (iterable): Mouth and pose images, centered on the head when drawn.
+        blink_image (pygame.Surface): Drawn at the head's position, like the head.
+    """
+    rects = [head_image.get_bounding_rect().move(head_pos)]
+    if blink_image is not None:
+        rects.append(blink_image.get_bounding_rect().move(head_pos))
+    for image in images:
+        rects.append(image.get_bounding_rect().move(centered_on_head(head_pos, head_image, image)))
+    bounds = rects[0].unionall(rects[1:]).clip(pygame.Rect((0, 0), resolution))
+    # Even offsets and sizes, as yuv420p codecs require
+    left, top = bounds.left // 2 * 2, bounds.top // 2 * 2
+    width = min(resolution[0] - left, (bounds.right - left + 1) // 2 * 2)
+    height = min(resolution[1] - top, (bounds.bottom - top + 1) // 2 * 2)
+    return pygame.Rect(left, top, width, height)
+
+@traced()
+def load_render_assets(viseme_data, image_directory, head_image_path, blink_image_path, pose_folder, pose_data, background_path, resolution, alpha=False, motion=False):
+    """
+    Load every image the renderer needs and build the base frame (background + head).
+
+    With alpha, the background is never loaded: the base frame is a
+    transparent canvas cropped to the character's bounding box (the "crop"
+    rect, in full-frame coordinates), and frames are composited as RGBA.
+
+    With motion (True, or a dict overriding MOTION_STYLE), the head moves
+    with the idle cycle, so it is drawn as a "body" layer by a MotionLayer
+    instead of being part of the base frame.
+    """
+    viseme_data = as_timeline(viseme_data, "viseme")
+    pose_data = as_timeline(pose_data, "pose")
     pygame.init()
 
-    # Set up display (off-screen rendering)
-    screen = pygame.Surface(resolution)
-
     # Load images #
-    # Load Background Image
-    bg_image = pygame.image.load(background_path)
-    bg_image = pygame.transform.scale(bg_image, resolution)  # Scale background to fit the screen
-
     # Load head image
     if os.path.exists(head_image_path):
         head_image = pygame.image.load(head_image_path)
@@ -57,8 +108,7 @@ def render_animation_to_video(viseme_data, image_directory, output_video, fps, r
 
     # Load viseme images
     viseme_images = {}
-    for entry in viseme_data:
-        mouth_shape = entry["mouth_shape"]
+    for mouth_shape in viseme_data.symbols:
         if mouth_shape not in viseme_images:
             image_path = os.path.join(image_directory, mouth_shape)
             if os.path.exists(image_path):
@@ -73,15 +123,13 @@ def render_animation_to_video(viseme_data, image_directory, output_video, fps, r
 
     # Load pose images
     pose_images = {}
-    for entry in pose_data:
-        if isinstance(entry, dict) and "pose_image" in entry:
-            pose = entry["pose_image"]
-            if pose not in pose_images:
-                pose_image_path = os.path.join(pose_folder, pose)
-                if os.path.exists(pose_image_path):
-                    pose_images[pose] = pygame.image.load(pose_image_path)
-                else:
-                    print(f"Pose image not found for pose: {pose}")
+    for pose in pose_data.symbols:
+        if pose not in pose_images:
+            pose_image_path = os.path.join(pose_folder, pose)
+            if os.path.exists(pose_image_path):
+                pose_images[pose] = pygame.image.load(pose_image_path)
+            else:
+                print(f"Pose image not found for pose: {pose}")
 
     # Check for missing neutral pose image
     neutral_pose_path = os.path.join(pose_folder, "neutralpose.png")
@@ -89,136 +137,399 @@ def render_animation_to_video(viseme_data, image_directory, output_video, fps, r
         print("Warning: Neutral pose ('neutralpose.png') not found in the pose directory.")
     else:
         pose_images["neutralpose"] = pygame.image.load(neutral_pose_path)
-      
-    # Ensure temp directory exists
-    os.makedirs(temp_dir, exist_ok=True)
 
-    # Generate random blink timings
-    total_duration = viseme_data[-1]["end_time"]
+    background_image = None if alpha else pygame.image.load(background_path)
+    return build_render_assets(head_image, blink_image, viseme_images, pose_images, background_image, resolution, alpha=alpha, motion=motion)
+
+def load_bundle_assets(bundle, alpha=False, motion=False):
+    """
+    Load the renderer's assets from a compiled asset bundle (see asset_bundle.py).
+
+    The bundle was validated and pre-scaled when it was compiled, so nothing is
+    decoded or checked here. Renders at the bundle's resolution.
+    """
+    if isinstance(bundle, str):
+        bundle = AssetBundle(bundle)
+    pygame.init()
+    images = bundle.images()
+    if not alpha and images["background"] is None:
+        raise ValueError(f"{bundle.path} has no background; use an alpha encoder profile or rebuild it with one")
+    return build_render_assets(images["head"], images["blink"], images["viseme_images"], images["pose_images"],
+                               None if alpha else images["background"], bundle.resolution, alpha=alpha, motion=motion)
+
+def build_render_assets(head_image, blink_image, viseme_images, pose_images, background_image, resolution, alpha=False, motion=False):
+    """
+    Build the base frame and the asset dict the renderer uses from loaded images.
+
+    Shared by load_render_assets (loose PNGs) and asset bundles. See
+    load_render_assets for what alpha and motion do.
+    """
+    motion_layer = MotionLayer(head_image, pose_images, resolution, motion if isinstance(motion, dict) else None, blink_image=blink_image) if motion else None
+    head_x, head_y = head_position(resolution, head_image)
+    if alpha:
+        # Transparent canvas around the character only; every layer is placed relative to the head
+        crop = character_bounds(resolution, head_image, (head_x, head_y), [*viseme_images.values(), *pose_images.values()], blink_image)
+        if motion_layer is not None:
+            # Leave room for the character to rise with the idle cycle
+            lift = min(crop.top, (motion_layer.margin + 1) // 2 * 2)
+            crop = pygame.Rect(crop.left, crop.top - lift, crop.width, crop.height + lift)
+        head_x, head_y = head_x - crop.left, head_y - crop.top
+        screen = pygame.Surface(crop.size, pygame.SRCALPHA)
+        print(f"Alpha output cropped to {crop.width}x{crop.height} at ({crop.left}, {crop.top}) of the {resolution[0]}x{resolution[1]} frame")
+    else:
+        # Set up display (off-screen rendering)
+        crop = pygame.Rect((0, 0), resolution)
+        screen = pygame.Surface(resolution)
+
+        bg_image = background_image
+        if bg_image.get_size() != resolution:
+            bg_image = pygame.transform.scale(bg_image, resolution)  # Scale background to fit the screen
+        screen.blit(bg_image, (0, 0))  # Draw the background
+
+    # The background and head never change, so they form the compositor's base frame
+    if motion_layer is None:
+        screen.blit(head_image, (head_x, head_y))
+
+    assets = {
+        "base_frame": screen,
+        "crop": crop,
+        "pixel_format": "RGBA" if alpha else "RGB",
+        "head_image": head_image,
+        "head_position": (head_x, head_y),
+        "blink_image": blink_image,
+        "viseme_images": viseme_images,
+        "pose_images": pose_images,
+    }
+    if motion_layer is not None:
+        assets["motion"] = motion_layer
+    return assets
+
+def generate_blinks(total_duration, rng=random):
+    """Generate random (start, end) blink timings, 2-10 seconds apart."""
     current_time = 0.0
     blinks = []
     while current_time < total_duration:
-        blink_start = current_time + random.uniform(2, 10)
+        blink_start = current_time + rng.uniform(2, 10)
         blink_end = blink_start + 0.2
         if blink_end > total_duration:
             break
         blinks.append((blink_start, blink_end))
         current_time = blink_start
+    return blinks
+
+def blended_viseme(assets, previous, current, weight, steps=4):
+    """
+    Return a cross-fade between two mouth images.
+
+    The weight is quantized to `steps` levels and each blend is cached, so a
+    cross-fade reuses the same few surfaces (and the compositor can tell when
+    nothing changed).
+    """
+    level = min(steps - 1, int(weight * steps))
+    cache = assets.setdefault("blend_cache", {})
+    key = (previous, current, level)
+    if key not in cache:
+        old_image = assets["viseme_images"][previous]
+        new_image = assets["viseme_images"][current]
+        if old_image.get_size() != new_image.get_size():
+            cache[key] = new_image  # Only same-size sprites can be blended
+            return new_image
+        cache[key] = blend_surfaces(old_image, new_image, (level + 0.5) / steps)
+    return cache[key]
+
+def resolve_frame_states(viseme_timeline, pose_timeline, blinks, total_frames, fps, captions=None, motion=None, start_frame=0):
+    """
+    Quantize the viseme, pose and blink timelines to the frame grid, once per render.
+
+    Every event becomes an integer frame range (see frame_grid.py), so the
+    render loop only indexes these arrays instead of searching the timelines
+    for each frame. Only frames [start_frame, total_frames) are resolved, so
+    a clip rendered piece by piece pays for each frame once.
+
+    Returns:
+        dict: Per-frame arrays from start_frame on — "viseme" and "pose" (symbol
+            ID, -1 for the neutral image), "previous_viseme" and "blend_weight"
+            (cross-fade from viseme_smoothing.py, -1 and 1.0 outside one) and
+            "blink" (bool), plus "caption_line" and "caption_words" when given a
+            CaptionTrack and the MotionLayer's states (see MotionLayer.frame_states)
+            when given one, whose blends are then precomputed; and "start_frame".
+    """
+    viseme, previous_viseme, blend_weight = frame_blend_weights(viseme_timeline, total_frames, fps, start_frame)
+    blink_times = np.array(blinks, dtype=np.float64).reshape(-1, 2)
+    states = {
+        "start_frame": start_frame,
+        "viseme": viseme,
+        "previous_viseme": previous_viseme,
+        "blend_weight": blend_weight,
+        "pose": symbol_per_frame(pose_timeline, total_frames, fps, start_frame),
+        "blink": event_index_per_frame(blink_times[:, 0], blink_times[:, 1], total_frames, fps, start_frame) >= 0,
+    }
+    if captions is not None:
+        states["caption_line"], states["caption_words"] = captions.frame_states(total_frames, fps, start_frame)
+    if motion is not None:
+        # Fades that began just before start_frame need the poses they started from
+        first = max(0, start_frame - motion.history_frames(fps))
+        pose = np.concatenate((symbol_per_frame(pose_timeline, start_frame, fps, first), states["pose"]))
+        states.update({name: column[start_frame - first:] for name, column in motion.frame_states(pose, fps, first).items()})
+        with span("warm_motion_cache"):
+            motion.warm(states, pose_timeline)
+    return states
+
+def layer_order(assets):
+    """Compositor layers, bottom to top, for the optional parts the assets include."""
+    order = ["body"] if "motion" in assets else []
+    order += ["mouth", "pose", "blink"]
+    if "captions" in assets:
+        order += CaptionTrack.LAYERS
+    return order
+
+def frame_layers(frame_number, states, viseme_timeline, pose_timeline, assets):
+    """Return the compositor layers (body, mouth, pose, blink, captions) shown on a frame, from resolve_frame_states."""
+    layers = {}
+    i = frame_number - states["start_frame"]
+    head_image = assets["head_image"]
+    head_x, head_y = assets["head_position"]
+
+    # Idle motion: a precomputed breathing body, with everything on it following the bob and the rise of the face
+    breath_level = int(states["breath_level"][i]) if "breath_level" in states else None
+    if breath_level is not None:
+        body_image, top_shift = assets["motion"].body(breath_level)
+        body_position = (head_x, head_y + int(states["bob"][i]) + top_shift)
+        layers["body"] = (body_image, body_position)
+        head_y += int(states["bob"][i]) + top_shift // 2
+
+    # Determine which viseme to show
+    viseme_id = states["viseme"][i]
+    displayed_viseme = viseme_timeline.symbols[viseme_id] if viseme_id >= 0 else "neutral"  # Default to neutral viseme
+
+    # Display the selected viseme (neutral if no active viseme)
+    if displayed_viseme in assets["viseme_images"]:
+        mouth_image = assets["viseme_images"][displayed_viseme]
+
+        # Cross-fade from the previous shape when viseme_smoothing.py added blend times
+        previous_id = states["previous_viseme"][i]
+        if previous_id >= 0:
+            previous_viseme = viseme_timeline.symbols[previous_id]
+            if previous_viseme in assets["viseme_images"]:
+                mouth_image = blended_viseme(assets, previous_viseme, displayed_viseme, states["blend_weight"][i])
+
+        layers["mouth"] = (mouth_image, centered_on_head((head_x, head_y), head_image, mouth_image))
+
+    # Determine which pose to show
+    pose_id = states["pose"][i]
+    displayed_pose = pose_timeline.symbols[pose_id] if pose_id >= 0 else "neutralpose"  # Default to neutral pose
+
+    # Display the selected pose (neutral if no active viseme)
+    pose_step = states["pose_step"][i] if "pose_step" in states else -1
+    if pose_step >= 0:
+        # Precomputed cross-fade from the previous pose
+        previous_id = states["previous_pose"][i]
+        previous_pose = pose_timeline.symbols[previous_id] if previous_id >= 0 else "neutralpose"
+        pose_image, offset = assets["motion"].transition(previous_pose, displayed_pose, pose_step)
+        if pose_image is not None:
+            sprite = assets["pose_images"].get(displayed_pose, assets["pose_images"].get(previous_pose))
+            x, y = centered_on_head((head_x, head_y), head_image, sprite)
+            layers["pose"] = (pose_image, (x + offset[0], y + offset[1]))
+    elif displayed_pose in assets["pose_images"]:
+        pose_image = assets["pose_images"][displayed_pose]
+        layers["pose"] = (pose_image, centered_on_head((head_x, head_y), head_image, pose_image))
+
+    # Check if the current frame is during a blink
+    if states["blink"][i]:
+        if breath_level is not None:
+            layers["blink"] = (assets["motion"].blink(breath_level), body_position)  # Stretched with the body
+        else:
+            layers["blink"] = (assets["blink_image"], (head_x, head_y))
+
+    # Captions are pre-rasterized; only their atlas areas change from frame to frame
+    if "caption_line" in states:
+        layers.update(assets["captions"].layers(states["caption_line"][i], states["caption_words"][i]))
+
+    return layers
+
+def render_frame_range(start_frame, end_frame, fps, viseme_data, pose_data, blinks, assets, encoder, desc="Rendering Frames", states=None):
+    """
+    Render frames [start_frame, end_frame) and write them to an ffmpeg process as raw RGB.
+
+    Pass the states from resolve_frame_states when rendering several ranges of
+    one clip, so the timelines are quantized only once; they must cover the range.
+    """
+    viseme_data = as_timeline(viseme_data, "viseme")
+    pose_data = as_timeline(pose_data, "pose")
+    if states is None:
+        states = resolve_frame_states(viseme_data, pose_data, blinks, end_frame, fps, assets.get("captions"), assets.get("motion"), start_frame)
+    compositor = DirtyRectCompositor(assets["base_frame"], layer_order(assets), assets.get("pixel_format", "RGB"))
+    with span("render_frames", start_frame=start_frame, end_frame=end_frame), profile_block("render_loop"):
+        for frame_number in tqdm(range(start_frame, end_frame), desc=desc):
+            # Redraw only what changed and send the raw frame to the encoder
+            compositor.update(frame_layers(frame_number, states, viseme_data, pose_data, assets))
+            try:
+                encoder.stdin.write(compositor.raw_frame())
+            except BrokenPipeError:
+                break  # ffmpeg exited early; close_encoder reports the error
+    count("frames_rendered", compositor.frames_composited)
+    count("dirty_pixels", compositor.dirty_pixels)
+    return compositor
+
+def render_animation_to_video(viseme_data, image_directory, output_video, fps, resolution, temp_dir, head_image_path, blink_image_path, pose_folder, pose_data, background_path, audio_file=None, encoder_profile="balanced", checkpoint_dir=None, segment_frames=900, captions=None, motion=False, bundle=None):
+    """
+    Render animation frames and encode them into a video, with blinks and random poses.
+
+    Frames are piped straight into a single ffmpeg process that also muxes the
+    audio (if given). With a profile that asks for a lossless intermediate, the
+    frames are first written losslessly to temp_dir and then encoded once.
+
+    With checkpoint_dir, the clip is rendered in segments of segment_frames
+    frames, each encoded to its own file and recorded in a manifest. A rerun
+    reuses every segment whose timeline inputs did not change, so a crashed
+    render resumes from the last completed segment.
+
+    An encoder profile with alpha (e.g. "prores_alpha" or "vp9_alpha")
+    skips the background and encodes transparent frames cropped to the
+    character; where the crop sits in the full frame is saved next to the
+    video as <name>.layout.json for the editor.
+
+    With captions (a word timeline: path, Timeline or word_data records),
+    karaoke-style captions are burned in through the same compositor.
+
+    With motion, pose changes cross-fade and the character breathes and bobs
+    while idle, from blends precomputed by motion_layer.MotionLayer.
+
+    With bundle (a compiled asset bundle or its path), the sprites and
+    background come from the bundle instead of the image paths, which may be
+    None; resolution must match the bundle's.
+    """
+    viseme_data = as_timeline(viseme_data, "viseme")
+    pose_data = as_timeline(pose_data, "pose")
 
-    # Render frames
-    total_frames = int(viseme_data[-1]["end_time"] * fps)
-    frame_time = 1 / fps
-    current_time = 0.0
+    # Debug: print loaded pose_data
+    print("Pose data at the start of render_animation_to_video:")
+    for entry in pose_data.to_records():
+        print(entry)  # Log the content of pose_data
 
-    print(f"Rendering {total_frames} frames...")
-    for frame_number in tqdm(range(total_frames), desc="Rendering Frames"):
-        # Clear screen
-        screen.blit(bg_image, (0, 0))  # Draw the background
-        #screen.fill((211, 211, 211))
+    profile = get_encoder_profile(encoder_profile)
+    alpha = profile.get("alpha", False)
+    if bundle is not None:
+        bundle = AssetBundle(bundle) if isinstance(bundle, str) else bundle
+        if tuple(resolution) != bundle.resolution:
+            raise ValueError(f"{bundle.path} is built for {bundle.resolution[0]}x{bundle.resolution[1]}, not {resolution[0]}x{resolution[1]}")
+        assets = load_bundle_assets(bundle, alpha=alpha, motion=motion)
+    else:
+        assets = load_render_assets(viseme_data, image_directory, head_image_path, blink_image_path, pose_folder, pose_data, background_path, resolution, alpha=alpha, motion=motion)
+    frame_size = assets["base_frame"].get_size()
+    if captions is not None:
+        assets["captions"] = CaptionTrack(load_caption_words(captions), frame_size, full_resolution=resolution)
+    extension = profile.get("extension", ".mp4")
+    if not output_video.endswith(extension):
+        output_video = os.path.splitext(output_video)[0] + extension
+        print(f"The {encoder_profile} profile writes {extension} files; saving to {output_video}")
+    if alpha:
+        layout_path = os.path.splitext(output_video)[0] + ".layout.json"
+        crop = assets["crop"]
+        with open(layout_path, "w", encoding="utf-8") as f:
+            json.dump({"frame": list(resolution), "crop": [crop.left, crop.top, crop.width, crop.height], "fps": str(fps)}, f, indent=4)
+    total_duration = viseme_data.end_time
+    total_frames = frame_count(total_duration, fps)  # The last partial frame is kept, not truncated
+
+    if checkpoint_dir is not None:
+        manifest = load_manifest(checkpoint_dir)
+        # Reuse the blink seed so unchanged segments render identically on a rerun
+        manifest.setdefault("blink_seed", random.randrange(2 ** 32))
+        blinks = generate_blinks(total_duration, random.Random(manifest["blink_seed"]))
+        states = resolve_frame_states(viseme_data, pose_data, blinks, total_frames, fps, assets.get("captions"), assets.get("motion"))
+
+        settings = {
+            "resolution": list(resolution),
+            "profile": profile,
+            "assets": [bundle.path, bundle.index["sources"]] if bundle is not None
+                      else file_signatures([image_directory, head_image_path, blink_image_path, pose_folder, background_path]),
+            "captions": assets["captions"].style if "captions" in assets else None,
+            "motion": assets["motion"].style if "motion" in assets else None,
+        }
+        ranges = segment_ranges(total_frames, segment_frames)
+        caption_texts = [line["text"] for line in assets["captions"].lines] if "captions" in assets else None
+        hashes = [segment_inputs_hash(start, end, fps, viseme_data, pose_data, blinks, settings, states, caption_texts) for start, end in ranges]
+
+        def render_segment(start_frame, end_frame, segment_path):
+            if profile["lossless_intermediate"]:
+                ffmpeg_command = build_lossless_command(fps, frame_size, segment_path)
+            else:
+                ffmpeg_command = build_encode_command(profile, fps, frame_size, segment_path)
+            encoder = open_encoder(ffmpeg_command)
+            render_frame_range(start_frame, end_frame, fps, viseme_data, pose_data, blinks, assets, encoder,
+                               desc=f"Frames {start_frame}-{end_frame}", states=states)
+            close_encoder(encoder, ffmpeg_command)
+
+        print(f"Rendering {total_frames} frames in {len(ranges)} segments...")
+        segment_extension = ".mkv" if profile["lossless_intermediate"] else extension
+        segment_files = render_checkpointed(checkpoint_dir, manifest, ranges, hashes, render_segment, segment_extension)
+        concat_segments(segment_files, output_video, audio_file,
+                        transcode_args=x264_args(profile) if profile["lossless_intermediate"] else None,
+                        audio_codec=profile.get("audio_codec", "aac"))
+        print(f"Video saved to {output_video}")
+        return
 
-        # Render head
-        #head_x = resolution[0] // 2 - head_image.get_width() // 2
-        #head_y = resolution[1] // 2 - head_image.get_height() // 2
-        #screen.blit(head_image, (head_x, head_y))
+    # Generate random blink timings
+    blinks = generate_blinks(total_duration)
 
-         # Adjust positions
-        head_x = resolution[0] // 2 - head_image.get_width() // 2
-        head_y = resolution[1] // 2 - head_image.get_height() // 2 + resolution[1] // 4  # Move down 25%
-        screen.blit(head_image, (head_x, head_y))
+    # Ensure temp directory exists
+    os.makedirs(temp_dir, exist_ok=True)
+
+    # Start the encoder
+    if profile["lossless_intermediate"]:
+        intermediate_video = os.path.join(temp_dir, "lossless_intermediate.mkv")
+        ffmpeg_command = build_lossless_command(fps, frame_size, intermediate_video)
+    else:
+        ffmpeg_command = build_encode_command(profile, fps, frame_size, output_video, audio_file)
+    encoder = open_encoder(ffmpeg_command)
 
-        # Determine which viseme to show
-        displayed_viseme = "neutral"  # Default to neutral viseme
-        for entry in viseme_data:
-            viseme_start = entry["start_time"]
-            viseme_end = entry["end_time"]
-            mouth_shape = entry["mouth_shape"]
-
-            if viseme_start <= current_time < viseme_end:
-                displayed_viseme = mouth_shape
-                break
-
-        # Display the selected viseme (neutral if no active viseme)
-        if displayed_viseme in viseme_images:
-            mouth_image = viseme_images[displayed_viseme]
-            mouth_x = head_x + head_image.get_width() // 2 - mouth_image.get_width() // 2
-            mouth_y = head_y + head_image.get_height() // 2 - mouth_image.get_height() // 2
-            screen.blit(mouth_image, (mouth_x, mouth_y))
-
-        # Determine which pose to show
-        displayed_pose = "neutralpose"  # Default to neutral viseme
-        for entry in pose_data:
-            pose_start = entry["pose_start_time"]
-            pose_end = entry["pose_end_time"]
-            pose_image = entry["pose_image"]
-
-            if pose_start <= current_time < pose_end:
-                displayed_pose = pose_image
-                break
-
-        # Display the selected pose (neutral if no active viseme)
-        if displayed_pose in pose_images:
-            pose_image = pose_images[displayed_pose]
-            pose_x = head_x + head_image.get_width() // 2 - pose_image.get_width() // 2
-            pose_y = head_y + head_image.get_height() // 2 - pose_image.get_height() // 2
-            screen.blit(pose_image, (pose_x, pose_y))
-
-        # Check if the current frame is during a blink
-        is_blinking = any(blink_start <= current_time < blink_end for blink_start, blink_end in blinks)
-        if is_blinking:
-            screen.blit(blink_image, (head_x, head_y))
-
-        # Save the frame as an image
-        frame_path = os.path.join(temp_dir, f"frame_{frame_number:04d}.png")
-        pygame.image.save(screen, frame_path)
-
-        # Increment time
-        current_time += frame_time
-
-
-    # Encode frames to video
-    ffmpeg_command = [
-        "ffmpeg", "-y", "-framerate", str(fps), "-i", f"{temp_dir}/frame_%04d.png",
-        "-c:v", "libx264", "-pix_fmt", "yuv420p", output_video
-    ]
-    subprocess.run(ffmpeg_command, check=True)
+    # Render frames
+    print(f"Rendering {total_frames} frames...")
+    with span("resolve_frame_states", frames=total_frames):
+        states = resolve_frame_states(viseme_data, pose_data, blinks, total_frames, fps, assets.get("captions"), assets.get("motion"))
+    compositor = render_frame_range(0, total_frames, fps, viseme_data, pose_data, blinks, assets, encoder, states=states)
+    print(f"Redrew {compositor.dirty_fraction():.1%} of each frame on average.")
+    close_encoder(encoder, ffmpeg_command)
+
+    # Encode the lossless intermediate with the profile's settings
+    if profile["lossless_intermediate"]:
+        with span("transcode_intermediate"):
+            subprocess.run(build_transcode_command(profile, intermediate_video, output_video, audio_file), check=True)
     print(f"Video saved to {output_video}")
 
-    # Clean up temporary frames
+    # Clean up temporary files
     try:
         shutil.rmtree(temp_dir)
-        print(f"Temporary frames in {temp_dir} deleted.")
+        print(f"Temporary files in {temp_dir} deleted.")
     except Exception as e:
-        print(f"Error deleting temporary frames: {e}")
-
-def combine_audio_with_video(video_file, audio_file, output_file):
-    """Combine the rendered video and audio into a single file."""
-    print("Adding audio to video...")
-    ffmpeg_command = [
-        "ffmpeg", "-y", "-i", video_file, "-i", audio_file, 
-        "-c:v", "copy", "-c:a", "aac", "-b:a", "192k", "-shortest", output_file
-    ]
-    subprocess.run(ffmpeg_command, check=True)
-    print(f"Final video with audio saved to {output_file}")
+        print(f"Error deleting temporary files: {e}")
 
 if __name__ == "__main__":
-    viseme_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data.json"
+    viseme_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data_smoothed.npz"  # Written by viseme_smoothing.py
     image_directory = "/Users/nervous/Documents/GitHub/speech-aligner/assets/new_visemes"
     audio_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav"
     temp_dir = "/Users/nervous/Documents/GitHub/speech-aligner/tmp_frames/frames"
-    output_video = "/Users/nervous/Documents/GitHub/speech-aligner/output/poses_animate_output_video.mp4"
+    checkpoint_dir = None  # e.g. ".../tmp_frames/segments" to render long clips in resumable segments
+    captions = None  # e.g. ".../output/word_data.npz" to burn in karaoke-style captions
+    motion = False  # True for pose cross-fades and idle breathing
     final_output = "/Users/nervous/Documents/GitHub/speech-aligner/output/poses_animate_final_output_with_audio.mp4"
     head_image_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_body.png"
     blink_image_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_blink.png"
     pose_folder = "/Users/nervous/Documents/GitHub/speech-aligner/assets/pose/"
-    pose_data = "/Users/nervous/Documents/GitHub/speech-aligner/output/pose_data.json"
+    pose_data = "/Users/nervous/Documents/GitHub/speech-aligner/output/pose_data.npz"
+    background_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/background/background.png"
+    tier_cache_dir = "/Users/nervous/Documents/GitHub/speech-aligner/cache/tiers"
     fps = 30
-    resolution = (1320, 2868)
+    tier = "final"  # "proxy" renders quarter resolution drafts with a fast encoder preset
+    encoder_profile = RENDER_TIERS[tier]["encoder_profile"]  # Or any name from ENCODER_PROFILES
+
+    # Pre-scale assets for the tier (cached on disk after the first run)
+    assets = prepare_tier_assets(tier, tier_cache_dir, image_directory, pose_folder, head_image_path, blink_image_path, background_path)
+    resolution = assets["resolution"]
 
     # Load data
     viseme_data = load_viseme_data(viseme_file)
-    pose_data = load_pose_data(pose_data)  # Call load_pose_data to parse JSON
-    background_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/background/background.png"
-
-    render_animation_to_video(viseme_data, image_directory, output_video, fps, resolution, temp_dir, head_image_path, blink_image_path, pose_folder, pose_data, background_path)
+    pose_data = load_pose_data(pose_data)  # Call load_pose_data to parse the timeline
 
-    combine_audio_with_video(output_video, audio_file, final_output)
+    # Video and audio are encoded in one ffmpeg run (or one concat run with checkpoints), straight to the final output
+    render_animation_to_video(viseme_data, assets["image_directory"], final_output, fps, resolution, temp_dir, assets["head_image_path"], assets["blink_image_path"], assets["pose_folder"], pose_data, assets["background_path"], audio_file=audio_file, encoder_profile=encoder_profile, checkpoint_dir=checkpoint_dir, captions=captions, motion=motion)
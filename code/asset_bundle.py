@@ -0,0 +1,247 @@
+import json
+import mmap
+import os
+import struct
+
+import pygame
+
+from instrumentation import traced, count
+from render_tiers import BASE_RESOLUTION, tier_resolution, scale_image
+from viseme_mapping import mouth_shapes
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CHARACTER = os.path.join(REPO_DIR, "assets", "characters", "norris.json")
+DEFAULT_BUNDLE_DIR = os.path.join(REPO_DIR, "cache", "bundles")
+
+# File layout: header, then one RGBA pixel block per sprite, then the JSON index.
+# Blocks start on 16 KiB boundaries (the largest common page size), so every
+# process that maps the bundle shares the same page-cache pages.
+MAGIC = b"SPKBNDL1"
+HEADER = struct.Struct("<8sQQ")  # magic, index offset, index length
+BLOCK_ALIGNMENT = 16384
+BUNDLE_VERSION = 1
+
+def load_character(definition):
+    """
+    Load a character definition: a JSON path or a dict.
+
+    A definition names the "visemes" and "poses" folders, the "head" and
+    "blink" images, an optional "background" and optional "aliases" from the
+    names the viseme mapping uses to the files the character actually has
+    (e.g. {"shch.png": "chsh.png"}). Relative paths are resolved against the
+    definition file's folder.
+    """
+    base_dir = REPO_DIR
+    if isinstance(definition, str):
+        base_dir = os.path.dirname(os.path.abspath(definition))
+        with open(definition, "r", encoding="utf-8") as f:
+            definition = json.load(f)
+    character = dict(definition)
+    for key in ("visemes", "poses", "head", "blink", "background"):
+        if character.get(key):
+            character[key] = os.path.normpath(os.path.join(base_dir, character[key]))
+    character.setdefault("name", os.path.basename(character["visemes"]))
+    character.setdefault("aliases", {})
+    return character
+
+def _pngs(folder):
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(".png")) if os.path.isdir(folder) else []
+
+def _load(path, errors):
+    try:
+        return pygame.image.load(path)
+    except (pygame.error, FileNotFoundError) as e:
+        errors.append(f"Cannot read {path}: {e}")
+        return None
+
+def validate_character(character):
+    """
+    Check a character against the viseme mapping before anything renders.
+
+    Errors: a mouth shape the mapping can produce (or neutral.png) with no
+    image and no alias, an alias to a missing file, a missing head, blink,
+    background, pose folder or neutralpose.png, and unreadable images.
+    Warnings: sprites whose size differs from the head's canvas (they are
+    centred on the head, so they are usually misplaced).
+
+    Returns:
+        tuple: (errors, warnings, sprites), where sprites maps bundle keys
+            ("head", "blink", "background", "visemes/<name>", "poses/<name>")
+            to source paths, aliases included.
+    """
+    errors, warnings, sprites = [], [], {}
+    for key in ("head", "blink", "background"):
+        path = character.get(key)
+        if path is None and key == "background":
+            continue
+        if not path or not os.path.isfile(path):
+            errors.append(f"Missing {key} image: {path}")
+        else:
+            sprites[key] = path
+
+    viseme_files = _pngs(character["visemes"])
+    if not viseme_files:
+        errors.append(f"No viseme images in {character['visemes']}")
+    for name in viseme_files:
+        sprites[f"visemes/{name}"] = os.path.join(character["visemes"], name)
+    for name, target in character["aliases"].items():
+        if target not in viseme_files:
+            errors.append(f"Alias {name} -> {target}: {target} is not in {character['visemes']}")
+        elif name in viseme_files:
+            warnings.append(f"Alias {name} -> {target} hides an existing {name}")
+        else:
+            sprites[f"visemes/{name}"] = os.path.join(character["visemes"], target)
+    for name in mouth_shapes():
+        if f"visemes/{name}" not in sprites:
+            errors.append(f"The viseme mapping uses {name}, but {character['visemes']} has no such file and no alias for it")
+
+    pose_files = _pngs(character["poses"])
+    if "neutralpose.png" not in pose_files:
+        errors.append(f"Missing neutralpose.png in {character['poses']}")
+    for name in pose_files:
+        sprites[f"poses/{name}"] = os.path.join(character["poses"], name)
+
+    head = _load(sprites["head"], errors) if "head" in sprites else None
+    for key, path in sprites.items():
+        if key in ("head", "background"):
+            continue
+        image = _load(path, errors)
+        if head is not None and image is not None and image.get_size() != head.get_size():
+            warnings.append(f"{key} is {image.get_width()}x{image.get_height()}, the head canvas is {head.get_width()}x{head.get_height()}")
+    return errors, warnings, sprites
+
+def _sources(sprites):
+    """Size and modification time of every source file, to tell when a bundle is stale."""
+    return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in sorted(set(sprites.values()))}
+
+def bundle_path_for(character, tier, bundle_dir=DEFAULT_BUNDLE_DIR, base_resolution=BASE_RESOLUTION):
+    resolution = tier_resolution(tier, base_resolution)
+    return os.path.join(bundle_dir, f"{character['name']}-{tier}-{resolution[0]}x{resolution[1]}.bundle")
+
+@traced()
+def compile_bundle(definition=DEFAULT_CHARACTER, tier="final", output_path=None, base_resolution=BASE_RESOLUTION, force=False):
+    """
+    Validate a character, pre-scale its sprites for a render tier and write them to one bundle file.
+
+    Sprites are scaled by the tier's factor and the background to the tier's
+    frame size, as prepare_tier_assets does, then stored as raw RGBA blocks.
+    Aliased names point at the same block. An existing bundle built from the
+    same, unchanged source files is kept.
+
+    Raises:
+        ValueError: Listing every validation error, before anything is written.
+
+    Returns:
+        str: Path of the bundle.
+    """
+    character = load_character(definition)
+    pygame.init()
+    errors, warnings, sprites = validate_character(character)
+    for warning in warnings:
+        print(f"Warning: {warning}")
+    if errors:
+        raise ValueError(f"Character '{character['name']}' is not valid:\n  " + "\n  ".join(errors))
+
+    resolution = tier_resolution(tier, base_resolution)
+    scale = resolution[0] / base_resolution[0]
+    output_path = output_path or bundle_path_for(character, tier, base_resolution=base_resolution)
+    sources = _sources(sprites)
+    if not force and os.path.exists(output_path):
+        try:
+            index = AssetBundle(output_path).index
+            if index["version"] == BUNDLE_VERSION and index["sources"] == sources and index["resolution"] == list(resolution):
+                count("bundle_cache_hits")
+                print(f"Bundle {output_path} is up to date.")
+                return output_path
+        except ValueError:
+            pass  # Unreadable or older bundle; rebuild it
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    index = {"version": BUNDLE_VERSION, "character": character["name"], "tier": tier, "resolution": list(resolution),
+             "scale": scale, "sources": sources, "sprites": {}}
+    blocks = {}  # Source path -> block entry, so aliases share pixels
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * BLOCK_ALIGNMENT)  # Header, filled in last
+        for key, path in sprites.items():
+            if path not in blocks:
+                image = pygame.image.load(path)
+                image = scale_image(image, resolution) if key == "background" else scale_image(image, scale=scale)
+                pixels = pygame.image.tostring(image, "RGBA")
+                offset = f.tell()
+                f.write(pixels)
+                f.write(b"\0" * (-f.tell() % BLOCK_ALIGNMENT))
+                blocks[path] = {"offset": offset, "size": list(image.get_size())}
+            index["sprites"][key] = blocks[path]
+        index_offset = f.tell()
+        index_bytes = json.dumps(index).encode("utf-8")
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, index_offset, len(index_bytes)))
+    os.replace(tmp_path, output_path)
+    count("bundle_sprites", len(blocks))
+    print(f"Bundled {len(blocks)} sprites for '{character['name']}' at {resolution[0]}x{resolution[1]} into {output_path} "
+          f"({os.path.getsize(output_path) / 1e6:.1f} MB)")
+    return output_path
+
+class AssetBundle:
+    """
+    A compiled character bundle, memory-mapped read-only.
+
+    Sprites are pygame surfaces that wrap the mapped pixels directly, so
+    loading decodes nothing and worker processes rendering from the same
+    bundle share one copy in the page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not an asset bundle")
+        magic, index_offset, index_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an asset bundle")
+        self.index = json.loads(self._map[index_offset:index_offset + index_length])
+        self.resolution = tuple(self.index["resolution"])
+        self._surfaces = {}
+
+    def surface(self, key):
+        """Return a sprite as a surface over the mapped pixels (do not draw onto it)."""
+        if key not in self._surfaces:
+            entry = self.index["sprites"][key]
+            width, height = entry["size"]
+            view = memoryview(self._map)[entry["offset"]:entry["offset"] + width * height * 4]
+            self._surfaces[key] = pygame.image.frombuffer(view, (width, height), "RGBA")
+        return self._surfaces[key]
+
+    def names(self, kind):
+        """File names of the sprites of one kind ("visemes" or "poses"), aliases included."""
+        prefix = f"{kind}/"
+        return [key[len(prefix):] for key in self.index["sprites"] if key.startswith(prefix)]
+
+    def images(self):
+        """
+        Return the sprites keyed the way the renderer looks them up.
+
+        Returns:
+            dict: "head", "blink" and "background" (None without one) surfaces,
+                plus "viseme_images" and "pose_images" keyed by file name, with
+                the neutral ones under "neutral" and "neutralpose".
+        """
+        viseme_images = {("neutral" if name == "neutral.png" else name): self.surface(f"visemes/{name}") for name in self.names("visemes")}
+        pose_images = {("neutralpose" if name == "neutralpose.png" else name): self.surface(f"poses/{name}") for name in self.names("poses")}
+        return {
+            "head": self.surface("head"),
+            "blink": self.surface("blink"),
+            "background": self.surface("background") if "background" in self.index["sprites"] else None,
+            "viseme_images": viseme_images,
+            "pose_images": pose_images,
+        }
+
+if __name__ == "__main__":
+    character_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/characters/norris.json"
+
+    # One bundle per render tier; renderers load them with animate_poses.load_bundle_assets
+    for tier in ("proxy", "final"):
+        compile_bundle(character_path, tier)
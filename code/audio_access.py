@@ -0,0 +1,152 @@
+import os
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+class WavAudio:
+    """
+    Memory-mapped access to a 16-bit PCM WAV file such as output_audio.wav.
+
+    The data chunk is mapped as an int16 NumPy array, so windows are zero-copy
+    views and every stage in every process reads the same cached pages.
+    float32 conversions are cached per window in a small LRU.
+    """
+
+    def __init__(self, path, float_cache_bytes=64 * 1024 * 1024):
+        self.path = path
+        with open(path, "rb") as f:
+            riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave != b"WAVE":
+                raise ValueError(f"Not a WAV file: {path}")
+            fmt = None
+            data_offset = data_size = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = struct.unpack("<HHIIHH", f.read(16))
+                    f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    data_offset = f.tell()
+                    data_size = chunk_size
+                    break
+                else:
+                    f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)  # Chunks are word aligned
+
+        if fmt is None or data_offset is None:
+            raise ValueError(f"WAV file has no fmt or data chunk: {path}")
+        audio_format, self.channels, self.sample_rate, _, _, bits_per_sample = fmt
+        if audio_format != 1 or bits_per_sample != 16:
+            raise ValueError(f"Only 16-bit PCM WAV is supported, got format {audio_format} with {bits_per_sample} bits: {path}")
+
+        # Some writers leave the data size at 0 or past the end while streaming
+        data_size = min(data_size or os.path.getsize(path), os.path.getsize(path) - data_offset)
+        frames = data_size // (2 * self.channels)
+        samples = np.memmap(path, dtype="<i2", mode="r", offset=data_offset, shape=(frames, self.channels))
+        self.samples = samples[:, 0] if self.channels == 1 else samples
+        self.data_offset = data_offset
+        self.file_size = os.path.getsize(path)
+        self._float_cache = OrderedDict()
+        self._float_cache_bytes = 0
+        self.float_cache_limit = float_cache_bytes
+
+    def __len__(self):
+        return self.samples.shape[0]
+
+    @property
+    def duration(self):
+        """Length of the audio in seconds."""
+        return len(self) / self.sample_rate
+
+    def _sample_range(self, start_time, end_time):
+        start = max(0, int(round(start_time * self.sample_rate)))
+        end = len(self) if end_time is None else min(len(self), int(round(end_time * self.sample_rate)))
+        return start, max(start, end)
+
+    def mono(self):
+        """Return the signal as a 1-D int16 array (a view for mono files)."""
+        if self.channels == 1:
+            return self.samples
+        return self.samples.mean(axis=1).astype(np.int16)
+
+    def window(self, start_time=0.0, end_time=None):
+        """Return an int16 view of [start_time, end_time) seconds without copying."""
+        start, end = self._sample_range(start_time, end_time)
+        return self.samples[start:end]
+
+    def window_float32(self, start_time=0.0, end_time=None):
+        """Return [start_time, end_time) as mono float32 in [-1, 1], cached per window."""
+        key = self._sample_range(start_time, end_time)
+        cached = self._float_cache.get(key)
+        if cached is not None:
+            self._float_cache.move_to_end(key)
+            return cached
+
+        window = self.samples[key[0]:key[1]]
+        if self.channels > 1:
+            window = window.mean(axis=1)
+        converted = window.astype(np.float32) / 32768.0
+        converted.flags.writeable = False  # Shared between callers
+
+        self._float_cache[key] = converted
+        self._float_cache_bytes += converted.nbytes
+        while self._float_cache_bytes > self.float_cache_limit and len(self._float_cache) > 1:
+            _, evicted = self._float_cache.popitem(last=False)
+            self._float_cache_bytes -= evicted.nbytes
+        return converted
+
+    def iter_windows(self, window_seconds, hop_seconds=None):
+        """Yield (start_time, int16 view) for consecutive windows across the file."""
+        hop_seconds = hop_seconds or window_seconds
+        start_time = 0.0
+        while start_time < self.duration:
+            yield start_time, self.window(start_time, start_time + window_seconds)
+            start_time += hop_seconds
+
+    def raw_bytes(self, start_time=0.0, end_time=None):
+        """Return the little-endian PCM bytes of a window, e.g. for decoders that take raw buffers."""
+        return memoryview(np.ascontiguousarray(self.window(start_time, end_time))).cast("B")
+
+def frame_rms(audio, frame_seconds=0.02, chunk_frames=3000):
+    """Return the RMS level (0-1) of consecutive frames, converting one chunk of the mapping at a time."""
+    frame_length = max(1, int(audio.sample_rate * frame_seconds))
+    signal = audio.mono()
+    frames = len(signal) // frame_length
+    rms = np.empty(frames, dtype=np.float32)
+    for first in range(0, frames, chunk_frames):
+        last = min(frames, first + chunk_frames)
+        blocks = signal[first * frame_length:last * frame_length].reshape(last - first, frame_length).astype(np.float32) / 32768.0
+        rms[first:last] = np.sqrt(np.mean(blocks * blocks, axis=1))
+    return rms
+
+def detect_silence(audio, threshold_db=-40.0, min_silence=0.3, frame_seconds=0.02):
+    """
+    Find silent stretches in the audio.
+
+    Returns:
+        list of tuples: (start_time, end_time) of each silence lasting at least min_silence seconds.
+    """
+    rms = frame_rms(audio, frame_seconds)
+    silent = 20 * np.log10(np.maximum(rms, 1e-10)) < threshold_db
+    # Boundaries of runs of silent frames
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    return [
+        (float(start * frame_seconds), float(end * frame_seconds))
+        for start, end in zip(starts, ends)
+        if (end - start) * frame_seconds >= min_silence
+    ]
+
+_open_files = {}
+
+def open_audio(path):
+    """Return the shared WavAudio for a path, so every stage in a process uses one mapping."""
+    key = os.path.abspath(path)
+    audio = _open_files.get(key)
+    if audio is None or os.path.getsize(path) != audio.file_size:  # Reopen files that were rewritten
+        audio = _open_files[key] = WavAudio(path)
+    return audio
@@ -1,12 +1,14 @@
 import sys
 import os
-from pydub import AudioSegment
+from instrumentation import span
 
 def convert_to_wav(input_file, output_file):
+    from pydub import AudioSegment  # Imported here so the CLI starts without it
     try:
-        audio = AudioSegment.from_file(input_file)
-        audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
-        audio.export(output_file, format="wav")
+        with span("convert_to_wav", input=os.path.basename(input_file)):
+            audio = AudioSegment.from_file(input_file)
+            audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+            audio.export(output_file, format="wav")
         print(f"File converted to WAV successfully: {output_file}")
     except Exception as e:
         print(f"Error during conversion: {e}")
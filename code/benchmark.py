@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Phonemes the viseme mapping knows about, used to build the synthetic dictionary
+PHONEMES = [
+    "AA", "AE", "AH", "AO", "EH", "IH", "IY", "UH", "UW", "AY", "EY", "OW", "OY",
+    "F", "V", "B", "M", "P", "D", "G", "K", "N", "S", "T", "Y", "Z",
+    "L", "R", "W", "SH", "CH", "JH", "TH", "DH",
+]
+MOUTH_SHAPES = ["aei.png", "o.png", "ee.png", "fv.png", "bmp.png", "cdgknstxyz.png", "l.png", "r.png", "qw.png", "th.png"]
+POSES = ["curses.png", "fist.png", "left.png", "right.png"]
+STAGES = ["load_cmu_dict", "map_words_to_phonemes", "map_phonemes_to_visemes", "parse_transcript_with_poses", "compose_frames", "encode_frames"]
+
+def synthetic_cmu_dict(path, entries, seed):
+    """Write a CMU-style dictionary with random words and pronunciations."""
+    rng = random.Random(seed)
+    words = set()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(";;; synthetic dictionary for benchmarks\n")
+        while len(words) < entries:
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+            if word in words:
+                continue
+            words.add(word)
+            f.write(f"{word} {' '.join(rng.choice(PHONEMES) for _ in range(rng.randint(1, 8)))}\n")
+            if rng.random() < 0.05:
+                f.write(f"{word}(2) {' '.join(rng.choice(PHONEMES) for _ in range(rng.randint(1, 8)))}\n")
+    return sorted(words)
+
+def synthetic_word_data(duration, vocabulary, seed, oov_rate=0.02):
+    """Generate word timings at about 150 words per minute with short pauses."""
+    rng = random.Random(seed)
+    word_data = []
+    current_time = 0.0
+    while current_time < duration:
+        word = rng.choice(vocabulary) if rng.random() >= oov_rate else "zz" + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(10))
+        length = rng.uniform(0.15, 0.55)
+        word_data.append({"word": f" {word}", "start_time": current_time, "end_time": current_time + length})
+        current_time += length + (rng.uniform(0.2, 0.8) if rng.random() < 0.1 else 0.0)
+    return word_data
+
+def synthetic_phoneme_data(duration, seed):
+    """Generate back-to-back phonemes of 50-150 ms."""
+    rng = random.Random(seed)
+    phoneme_data = []
+    current_time = 0.0
+    while current_time < duration:
+        length = rng.uniform(0.05, 0.15)
+        phoneme_data.append({"phoneme": rng.choice(PHONEMES + ["SIL"]), "start_time": current_time, "end_time": current_time + length})
+        current_time += length
+    return phoneme_data
+
+def synthetic_viseme_data(duration, seed):
+    """Generate back-to-back visemes of 50-150 ms."""
+    rng = random.Random(seed)
+    viseme_data = []
+    current_time = 0.0
+    while current_time < duration:
+        length = rng.uniform(0.05, 0.15)
+        viseme_data.append({"mouth_shape": rng.choice(MOUTH_SHAPES), "start_time": current_time, "end_time": current_time + length})
+        current_time += length
+    return viseme_data
+
+def synthetic_pose_data(duration, seed):
+    """Generate a pose roughly every 10 seconds."""
+    rng = random.Random(seed)
+    pose_data = []
+    current_time = rng.uniform(2, 10)
+    while current_time < duration:
+        length = rng.uniform(0.8, 2.0)
+        pose_data.append({"pose_image": rng.choice(POSES), "pose_start_time": current_time, "pose_end_time": current_time + length})
+        current_time += length + rng.uniform(5, 15)
+    return pose_data
+
+def synthetic_transcript(word_data, seed):
+    """Join words into a transcript with a pose tag every ~25 words."""
+    rng = random.Random(seed)
+    parts = []
+    for entry in word_data:
+        if rng.random() < 0.04:
+            parts.append(f"<{rng.choice(POSES)[:-4]}>")
+        parts.append(entry["word"].strip())
+    return " ".join(parts)
+
+class NullEncoder:
+    """Stand-in for an ffmpeg process that discards (or keeps) frames, to time composition alone."""
+
+    def __init__(self, keep_frames=False):
+        self.stdin = self
+        self.keep_frames = keep_frames
+        self.frames = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        if self.keep_frames:
+            self.frames.append(bytes(data))
+
+def _peak_rss_mb():
+    """Return this process's peak resident set size in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+def _run_stage(stage, config, results):
+    """Run one stage in this (fresh) process and put its measurements on the results queue."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    duration = config["duration"]
+    seed = config["seed"]
+    workdir = config["workdir"]
+    cmu_dict_path = config["cmu_dict"] or os.path.join(workdir, "synthetic_cmudict.dict")
+    result = {}
+
+    try:
+        # Inputs are prepared before the clock starts
+        if stage == "load_cmu_dict":
+            from phoneme_mapping import load_cmu_dict
+            work = lambda: load_cmu_dict(cmu_dict_path)
+            count = lambda value: len(value)
+
+        elif stage == "map_words_to_phonemes":
+            from phoneme_mapping import load_cmu_dict, map_words_to_phonemes
+            with contextlib.redirect_stdout(io.StringIO()):
+                cmu_dict = load_cmu_dict(cmu_dict_path)
+            word_data = synthetic_word_data(duration, [w for w in cmu_dict if "(" not in w], seed)
+            work = lambda: map_words_to_phonemes(word_data, cmu_dict)
+            count = lambda value: len(word_data)
+
+        elif stage == "map_phonemes_to_visemes":
+            from viseme_mapping import map_phonemes_to_visemes
+            phoneme_data = synthetic_phoneme_data(duration, seed)
+            work = lambda: map_phonemes_to_visemes(phoneme_data)
+            count = lambda value: len(phoneme_data)
+
+        elif stage == "parse_transcript_with_poses":
+            from pose_data import parse_transcript_with_poses
+            word_data = synthetic_word_data(duration, ["word"], seed, oov_rate=0)
+            transcript = synthetic_transcript(word_data, seed)
+            work = lambda: parse_transcript_with_poses(transcript, word_data)
+            count = lambda value: len(word_data)
+
+        elif stage in ("compose_frames", "encode_frames"):
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+            with contextlib.redirect_stdout(io.StringIO()):
+                import animate_poses
+                from encoder_profiles import get_encoder_profile, build_encode_command, open_encoder, close_encoder
+                from frame_grid import frame_count
+                assets_dir = os.path.join(REPO_DIR, "assets")
+                tier_assets = animate_poses.prepare_tier_assets(
+                    config["tier"], os.path.join(workdir, "tiers"),
+                    os.path.join(assets_dir, "new_visemes"), os.path.join(assets_dir, "pose"),
+                    os.path.join(assets_dir, "other", "norris_body.png"), os.path.join(assets_dir, "other", "norris_blink.png"),
+                    os.path.join(assets_dir, "background", "background.png"),
+                )
+            render_duration = min(duration, config["render_seconds"])
+            viseme_data = synthetic_viseme_data(render_duration, seed)
+            pose_data = synthetic_pose_data(render_duration, seed)
+            blinks = animate_poses.generate_blinks(render_duration, random.Random(seed))
+            fps = config["fps"]
+            resolution = tier_assets["resolution"]
+            total_frames = frame_count(render_duration, fps)
+            assets = animate_poses.load_render_assets(
+                viseme_data, tier_assets["image_directory"], tier_assets["head_image_path"], tier_assets["blink_image_path"],
+                tier_assets["pose_folder"], pose_data, tier_assets["background_path"], resolution,
+            )
+
+            if stage == "compose_frames":
+                def work():
+                    with contextlib.redirect_stderr(io.StringIO()):
+                        animate_poses.render_frame_range(0, total_frames, fps, viseme_data, pose_data, blinks, assets, NullEncoder())
+            else:
+                # Encode a short loop of real frames so only the encoder is measured
+                sink = NullEncoder(keep_frames=True)
+                with contextlib.redirect_stderr(io.StringIO()):
+                    animate_poses.render_frame_range(0, min(total_frames, fps * 2), fps, viseme_data, pose_data, blinks, assets, sink)
+                frames = sink.frames
+                profile = get_encoder_profile(config["profile"])
+
+                def work():
+                    command = build_encode_command(profile, fps, resolution, os.path.join(workdir, "benchmark.mp4"))
+                    encoder = open_encoder(command)
+                    for frame_number in range(total_frames):
+                        encoder.stdin.write(frames[frame_number % len(frames)])
+                    close_encoder(encoder, command)
+            count = lambda value: total_frames
+            result["resolution"] = list(resolution)
+
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            value = work()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+
+        items = count(value)
+        result.update({
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "items": items,
+            "items_per_s": round(items / wall, 1) if wall > 0 else None,
+        })
+        if stage in ("compose_frames", "encode_frames"):
+            result["frames_per_s"] = result["items_per_s"]
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    results.put(result)
+
+def _collect_result(process, results, poll_seconds=1.0):
+    """Wait for a stage process's result; a process that died without one is reported as an error."""
+    while True:
+        try:
+            return results.get(timeout=poll_seconds)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The child may have put its result just before exiting
+        try:
+            return results.get(timeout=poll_seconds)
+        except queue.Empty:
+            process.join()
+            return {"error": f"stage process exited with code {process.exitcode} before reporting a result"}
+
+def run_benchmarks(duration, stages=None, seed=0, cmu_dict=None, dict_entries=130000, tier="proxy", profile="draft", fps=30, render_seconds=60, workdir=None):
+    """
+    Time each pipeline stage on synthetic timelines of the given duration (seconds).
+
+    Every stage runs in a fresh process, so its peak RSS is its own.
+
+    Returns:
+        dict: Run metadata and per-stage wall time, CPU time, peak RSS and throughput.
+    """
+    workdir = workdir or os.path.join(REPO_DIR, "cache", "benchmark")
+    os.makedirs(workdir, exist_ok=True)
+    if cmu_dict is None:
+        synthetic_cmu_dict(os.path.join(workdir, "synthetic_cmudict.dict"), dict_entries, seed)
+
+    config = {
+        "duration": duration, "seed": seed, "cmu_dict": cmu_dict, "tier": tier, "profile": profile,
+        "fps": fps, "render_seconds": render_seconds, "workdir": workdir,
+    }
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            **config,
+        },
+        "stages": {},
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for stage in stages or STAGES:
+        print(f"Benchmarking {stage} ({duration:.0f} s of synthetic audio)...")
+        results = context.Queue()
+        process = context.Process(target=_run_stage, args=(stage, config, results))
+        process.start()
+        result = _collect_result(process, results)
+        process.join()
+        report["stages"][stage] = result
+        if "error" in result:
+            print(f"  skipped: {result['error']}")
+        else:
+            print(f"  {result['wall_s']:.3f} s wall, {result['cpu_s']:.3f} s CPU, {result['peak_rss_mb']:.0f} MB peak, {result['items_per_s']} items/s")
+    return report
+
+def compare_results(baseline, current, threshold=0.10, min_seconds=0.005):
+    """
+    Print a per-stage comparison of two results files.
+
+    A stage regresses when its wall time grows by more than `threshold`
+    (a fraction) and by more than `min_seconds`, which keeps timer noise on
+    very fast stages from being reported.
+
+    Returns:
+        list: Names of stages whose wall time grew by more than the threshold.
+    """
+    regressions = []
+    print(f"{'stage':<30}{'baseline s':>12}{'current s':>12}{'change':>10}{'RSS MB':>16}")
+    for stage in sorted(set(baseline["stages"]) | set(current["stages"])):
+        old = baseline["stages"].get(stage, {})
+        new = current["stages"].get(stage, {})
+        if "wall_s" not in old or "wall_s" not in new:
+            print(f"{stage:<30}{'-':>12}{'-':>12}{'n/a':>10}")
+            continue
+        change = (new["wall_s"] - old["wall_s"]) / old["wall_s"] if old["wall_s"] else 0.0
+        flag = ""
+        if change > threshold and new["wall_s"] - old["wall_s"] > min_seconds:
+            regressions.append(stage)
+            flag = "  REGRESSION"
+        rss = f"{old['peak_rss_mb']:.0f} -> {new['peak_rss_mb']:.0f}"
+        print(f"{stage:<30}{old['wall_s']:>12.3f}{new['wall_s']:>12.3f}{change:>+10.1%}{rss:>16}{flag}")
+    if baseline["meta"].get("duration") != current["meta"].get("duration"):
+        print("Warning: the two runs used different synthetic durations.")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the speech-aligner pipeline on synthetic timelines.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Time every stage and write a JSON results file")
+    run_parser.add_argument("--duration", type=float, default=60, help="Synthetic audio length in seconds (60 to 7200)")
+    run_parser.add_argument("--stage", action="append", choices=STAGES, help="Only run these stages (repeatable)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--cmu-dict", help="Use a real CMU dictionary instead of a synthetic one")
+    run_parser.add_argument("--tier", default="proxy", help="Render tier for the frame stages")
+    run_parser.add_argument("--profile", default="draft", help="Encoder profile for the encode stage")
+    run_parser.add_argument("--render-seconds", type=float, default=60, help="Cap on the seconds of video rendered and encoded")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Diff two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed wall time increase before a stage counts as a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run_benchmarks(args.duration, stages=args.stage, seed=args.seed, cmu_dict=args.cmu_dict, tier=args.tier,
+                                profile=args.profile, render_seconds=args.render_seconds)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Benchmark results saved to {args.output}")
+    else:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
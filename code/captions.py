@@ -0,0 +1,183 @@
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+from frame_grid import first_frame_at, event_index_per_frame
+from instrumentation import count
+from texture_atlas import TextureAtlas
+from timeline_store import as_timeline, load_timeline
+
+CAPTION_STYLE = {
+    "font_path": None,  # None uses pygame's bundled font
+    "font_scale": 0.03,  # Font size as a fraction of the full frame height
+    "color": (255, 255, 255),
+    "highlight_color": (255, 214, 0),
+    "outline_color": (0, 0, 0),
+    "outline_scale": 0.08,  # Outline width as a fraction of the font size
+    "max_width": 0.9,  # Line width as a fraction of the frame width
+    "bottom_margin": 0.06,  # Space below the captions as a fraction of the frame height
+    "max_gap": 0.8,  # A pause this long (seconds) starts a new line
+    "max_line_seconds": 4.0,
+    "hold": 0.4,  # Seconds a line stays up after its last word, unless the next line starts
+}
+
+def _clean(word):
+    return word.strip()
+
+def layout_lines(words, font, max_width, max_gap, max_line_seconds):
+    """
+    Break timed words into caption lines.
+
+    A line ends when the next word would not fit in max_width pixels, after
+    a pause of max_gap seconds, after a sentence end, or once the line spans
+    max_line_seconds.
+
+    Returns:
+        list: Lines as {"text", "starts", "ends"} with one start/end per word.
+    """
+    lines = []
+    current = None
+    for word in words:
+        text = _clean(word["word"])
+        if not text:
+            continue
+        if current is not None:
+            candidate = current["text"] + " " + text
+            previous = current["text"].split(" ")[-1]
+            if (font.size(candidate)[0] > max_width
+                    or word["start_time"] - current["ends"][-1] > max_gap
+                    or word["end_time"] - current["starts"][0] > max_line_seconds
+                    or previous[-1] in ".?!"):
+                lines.append(current)
+                current = None
+        if current is None:
+            current = {"text": text, "starts": [word["start_time"]], "ends": [word["end_time"]]}
+        else:
+            current["text"] += " " + text
+            current["starts"].append(word["start_time"])
+            current["ends"].append(word["end_time"])
+    if current is not None:
+        lines.append(current)
+    return lines
+
+def render_outlined_text(font, text, color, outline_color, outline):
+    """Render text with an outline of `outline` pixels, on a transparent surface."""
+    fill = font.render(text, True, color)
+    if outline <= 0:
+        return fill
+    edge = font.render(text, True, outline_color)
+    surface = pygame.Surface((fill.get_width() + 2 * outline, fill.get_height() + 2 * outline), pygame.SRCALPHA)
+    for dx in (-outline, 0, outline):
+        for dy in (-outline, 0, outline):
+            if dx or dy:
+                surface.blit(edge, (outline + dx, outline + dy))
+    surface.blit(fill, (outline, outline))
+    return surface
+
+class CaptionTrack:
+    """
+    Karaoke-style captions built from word timings, drawn through the compositor.
+
+    Every line is rasterized once in its normal and its highlight colour and
+    packed into a texture atlas. On screen, the normal line is one layer and
+    the highlighted copy is a second layer clipped to the end of the last
+    word spoken, so a frame never renders text: the layers only change
+    area when a word starts. Lines are packed in pages of page_lines lines,
+    built when first shown and dropped when the render has moved on, so long
+    clips do not hold every line in memory.
+    """
+
+    LAYERS = ["caption", "caption_highlight"]
+
+    def __init__(self, word_timeline, frame_size, full_resolution=None, style=None, page_lines=64, cached_pages=2):
+        pygame.font.init()
+        self.style = {**CAPTION_STYLE, **(style or {})}
+        full_height = (full_resolution or frame_size)[1]
+        font_size = max(8, round(full_height * self.style["font_scale"]))
+        self.font = pygame.font.Font(self.style["font_path"], font_size)
+        self.outline = max(0, round(font_size * self.style["outline_scale"]))
+        self.frame_size = frame_size
+        self.page_lines = page_lines
+        self.cached_pages = cached_pages
+        self._pages = OrderedDict()
+
+        word_timeline = as_timeline(word_timeline, "word")
+        max_width = frame_size[0] * self.style["max_width"] - 2 * self.outline
+        self.lines = layout_lines(word_timeline.to_records(), self.font, max_width, self.style["max_gap"], self.style["max_line_seconds"])
+        for index, line in enumerate(self.lines):
+            # Right edge of each word in line pixels, for clipping the highlight
+            words = line["text"].split(" ")
+            line["word_right"] = [self.font.size(" ".join(words[:k + 1]))[0] + self.outline for k in range(len(words))]
+            next_start = self.lines[index + 1]["starts"][0] if index + 1 < len(self.lines) else float("inf")
+            line["start"] = line["starts"][0]
+            line["end"] = min(line["ends"][-1] + self.style["hold"], next_start)
+        count("caption_lines", len(self.lines))
+
+    def frame_states(self, total_frames, fps, start_frame=0):
+        """
+        Resolve the captions for frames [start_frame, total_frames).
+
+        Returns:
+            tuple: (line, words) arrays — the line shown (-1 for none) and how
+                many of its words have started (the highlighted ones).
+        """
+        if not self.lines:
+            return np.full(total_frames - start_frame, -1, dtype=np.int32), np.zeros(total_frames - start_frame, dtype=np.int32)
+        starts = np.array([line["start"] for line in self.lines], dtype=np.float64)
+        ends = np.array([line["end"] for line in self.lines], dtype=np.float64)
+        shown = event_index_per_frame(starts, ends, total_frames, fps, start_frame).astype(np.int32)
+
+        # Words are in time order across lines, so one search counts the words started by each frame
+        word_frames = first_frame_at(np.concatenate([line["starts"] for line in self.lines]), fps)
+        first_word = np.cumsum([0] + [len(line["starts"]) for line in self.lines])
+        started = np.searchsorted(word_frames, np.arange(start_frame, total_frames), side="right")
+        clamped = np.maximum(shown, 0)
+        words = np.clip(started - first_word[clamped], 0, first_word[clamped + 1] - first_word[clamped])
+        return shown, np.where(shown >= 0, words, 0).astype(np.int32)
+
+    def _page(self, page_index):
+        """Atlas page holding a block of lines, rasterized on first use."""
+        page = self._pages.get(page_index)
+        if page is not None:
+            self._pages.move_to_end(page_index)
+            return page
+        atlas = TextureAtlas()
+        first = page_index * self.page_lines
+        texts = dict.fromkeys(line["text"] for line in self.lines[first:first + self.page_lines])  # A repeated line is rasterized once
+        for text in texts:
+            for variant, color in (("normal", self.style["color"]), ("highlight", self.style["highlight_color"])):
+                atlas.add_surface((text, variant), render_outlined_text(self.font, text, color, self.style["outline_color"], self.outline))
+        atlas.pack()
+        count("caption_pages_rasterized")
+        self._pages[page_index] = atlas
+        while len(self._pages) > self.cached_pages:
+            self._pages.popitem(last=False)
+        return atlas
+
+    def layers(self, line_index, words_started):
+        """Return the compositor layers for a line with its first words_started words highlighted."""
+        if line_index < 0:
+            return {"caption": None, "caption_highlight": None}
+        line = self.lines[line_index]
+        atlas = self._page(line_index // self.page_lines)
+        normal = atlas.regions[(line["text"], "normal")]
+        highlight = atlas.regions[(line["text"], "highlight")]
+        width, height = normal["size"]
+        x = (self.frame_size[0] - width) // 2
+        y = self.frame_size[1] - height - round(self.frame_size[1] * self.style["bottom_margin"])
+
+        layers = {"caption": (atlas.surface, (x + normal["offset"][0], y + normal["offset"][1]), normal["area"]), "caption_highlight": None}
+        if words_started > 0:
+            # Show the highlighted copy up to the right edge of the last word spoken
+            area = pygame.Rect(highlight["area"])
+            area.width = min(area.width, max(0, line["word_right"][words_started - 1] - highlight["offset"][0]))
+            if area.width:
+                layers["caption_highlight"] = (atlas.surface, (x + highlight["offset"][0], y + highlight["offset"][1]), area)
+        return layers
+
+def load_caption_words(data):
+    """Accept a word timeline path (.npz or .json), a Timeline or word records."""
+    if isinstance(data, str):
+        return load_timeline(data, "word")
+    return as_timeline(data, "word")
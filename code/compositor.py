@@ -0,0 +1,138 @@
+import pygame
+
+def merge_rects(rects):
+    """Merge overlapping rectangles so no pixel is restored or redrawn twice."""
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        i = 0
+        while i < len(merged):
+            if rect.colliderect(merged[i]):
+                rect.union_ip(merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
+
+class DirtyRectCompositor:
+    """
+    Composite frames by redrawing only the layers that changed since the previous frame.
+
+    The base frame (background + body) is drawn once. Each frame, layers are
+    given as {name: (surface, position)} or None when hidden. Layers that are
+    the same surface (and area) at the same position as last frame are left alone; for
+    the rest, the union of their old and new bounding boxes is restored from
+    the base frame and every layer overlapping it is redrawn in order.
+
+    With pixel_format="RGBA" the base frame is a transparent (SRCALPHA)
+    surface and raw frames keep the alpha channel, for codecs with alpha.
+    """
+
+    def __init__(self, base_frame, layer_order, pixel_format="RGB"):
+        self.base_frame = base_frame
+        self.pixel_format = pixel_format
+        self.frame = base_frame.copy()
+        self.frame_rect = self.frame.get_rect()
+        self.layer_order = list(layer_order)
+        self.layers = {name: None for name in self.layer_order}
+        self._raw_frame = None
+        self.dirty_pixels = 0
+        self.frames_composited = 0
+
+    @staticmethod
+    def _layer_rect(layer):
+        surface, position = layer[0], layer[1]
+        size = pygame.Rect(layer[2]).size if len(layer) > 2 else surface.get_size()
+        return pygame.Rect(position, size)
+
+    @staticmethod
+    def _same_layer(old_layer, new_layer):
+        """Layers are unchanged when they draw the same area of the same surface at the same place."""
+        if old_layer is None or new_layer is None:
+            return old_layer is new_layer
+        return (
+            old_layer[0] is new_layer[0] and tuple(old_layer[1]) == tuple(new_layer[1])
+            and (tuple(old_layer[2]) if len(old_layer) > 2 else None) == (tuple(new_layer[2]) if len(new_layer) > 2 else None)
+        )
+
+    def update(self, layers):
+        """
+        Apply the layers for the next frame.
+
+        Args:
+            layers (dict): Layer name -> (surface, position), or None to hide it.
+                Layers missing from the dict are hidden.
+
+        Returns:
+            list: The pygame.Rect areas of the frame that changed.
+        """
+        return self.apply({name: layers.get(name) for name in self.layer_order})
+
+    def apply(self, changes):
+        """
+        Apply changes to some layers and leave every other layer as it is.
+
+        Args:
+            changes (dict): Layer name -> (surface, position), (surface,
+                position, area) to draw only `area` of the surface (e.g. one
+                sprite of a texture atlas), or None to hide it.
+
+        Returns:
+            list: The pygame.Rect areas of the frame that changed.
+        """
+        dirty = []
+        for name, new_layer in changes.items():
+            old_layer = self.layers[name]
+            if self._same_layer(old_layer, new_layer):
+                continue
+            if old_layer is not None:
+                dirty.append(self._layer_rect(old_layer))
+            if new_layer is not None:
+                dirty.append(self._layer_rect(new_layer))
+            self.layers[name] = new_layer
+
+        dirty = [rect.clip(self.frame_rect) for rect in merge_rects(dirty)]
+        dirty = [rect for rect in dirty if rect.width and rect.height]
+        for rect in dirty:
+            if self.pixel_format == "RGBA":
+                self.frame.fill((0, 0, 0, 0), rect)  # Blitting transparent pixels would blend, not restore
+            self.frame.blit(self.base_frame, rect.topleft, area=rect)
+            for name in self.layer_order:
+                layer = self.layers[name]
+                if layer is None:
+                    continue
+                surface, position = layer[0], layer[1]
+                overlap = self._layer_rect(layer).clip(rect)
+                if overlap.width and overlap.height:
+                    area = overlap.move(-position[0], -position[1])
+                    if len(layer) > 2:
+                        area.move_ip(layer[2][0], layer[2][1])  # Offset into the atlas
+                    self.frame.blit(surface, overlap.topleft, area=area)
+            self.dirty_pixels += rect.width * rect.height
+
+        self.frames_composited += 1
+        self._update_raw_frame(dirty)
+        return dirty
+
+    def _update_raw_frame(self, dirty):
+        """Refresh only the rows of the raw frame that the dirty rectangles touch."""
+        width, height = self.frame.get_size()
+        if self._raw_frame is None:
+            self._raw_frame = bytearray(pygame.image.tostring(self.frame, self.pixel_format))
+            return
+        row_bytes = width * len(self.pixel_format)
+        for rect in dirty:
+            rows = self.frame.subsurface((0, rect.top, width, rect.height))
+            start = rect.top * row_bytes
+            self._raw_frame[start:start + rect.height * row_bytes] = pygame.image.tostring(rows, self.pixel_format)
+
+    def raw_frame(self):
+        """Return the current frame as raw RGB (or RGBA) bytes, suitable for an ffmpeg rawvideo pipe."""
+        return self._raw_frame
+
+    def dirty_fraction(self):
+        """Return the average fraction of the frame redrawn per frame."""
+        if not self.frames_composited:
+            return 0.0
+        return self.dirty_pixels / (self.frames_composited * self.frame_rect.width * self.frame_rect.height)
@@ -1,23 +1,59 @@
-import whisper
-import json
+from instrumentation import count
+from timeline_store import Timeline, save_timeline, export_json
+from transcription_backends import DEFAULT_BACKEND, cache_model_name, transcribe_file
+from transcription_cache import transcribe_with_cache
 
-model = whisper.load_model("medium")
-result = model.transcribe("/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav", word_timestamps=True)
+def extract_word_data(result):
+    """Flatten the word timings of a Whisper result into the word_data record format."""
+    word_data = []
+    for segment in result['segments']:
+        for word in segment['words']:
+            word_data.append({
+                "word": word["word"],  # Use "word" key instead of "text"
+                "start_time": word["start"],
+                "end_time": word["end"]
+            })
+    return word_data
 
-# Print the entire result to understand its structure
-print(result)
+def create_word_data(audio_file, output_path, json_output_path=None, model_name="medium", backend=DEFAULT_BACKEND, threads=None, beam_size=None):
+    """
+    Transcribe an audio file with word timestamps and save the words as a timeline.
 
-word_data = []
-for segment in result['segments']:
-    for word in segment['words']:
-        word_data.append({
-            "word": word["word"],  # Use "word" key instead of "text"
-            "start_time": word["start"],
-            "end_time": word["end"]
-        })
+    Args:
+        audio_file (str): Path to the audio file.
+        output_path (str): Path of the word timeline (.npz).
+        json_output_path (str): Optional JSON export for debugging.
+        model_name (str): Whisper model to use.
+        backend (str): Inference backend from transcription_backends.BACKENDS,
+            e.g. "whisper-int8" or "faster-whisper" for faster CPU transcription.
+        threads (int): CPU threads for inference.
+        beam_size (int): Beam search width (None for greedy decoding).
+    """
+    def run_backend(path, _cache_name, **options):
+        return transcribe_file(path, model_name, backend, threads, **options)
 
-# Export word data to a JSON file
-output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.json"
-with open(output_path, "w", encoding="utf-8") as json_file:
-    json.dump(word_data, json_file, indent=4, ensure_ascii=False)
+    # Beam size changes the output, so it is part of the cache key (threads do not)
+    options = {"word_timestamps": True}
+    if beam_size and beam_size > 1:
+        options["beam_size"] = beam_size
+    result = transcribe_with_cache(audio_file, cache_model_name(backend, model_name), run_backend, **options)
 
+    # Print the entire result to understand its structure
+    print(result)
+
+    word_data = extract_word_data(result)
+    count("words_transcribed", len(word_data))
+
+    # Export word data as a columnar timeline (plus JSON for debugging)
+    word_timeline = Timeline.from_records(word_data, "word")
+    save_timeline(word_timeline, output_path)
+    if json_output_path:
+        export_json(word_timeline, json_output_path)
+    return word_timeline
+
+if __name__ == "__main__":
+    audio_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav"
+    output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.npz"
+    json_output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.json"  # Set to None to skip
+    backend = "whisper"  # "whisper-int8" or "faster-whisper" run much faster on CPU-only machines
+    create_word_data(audio_file, output_path, json_output_path, backend=backend)
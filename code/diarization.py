@@ -0,0 +1,253 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from audio_access import open_audio
+from instrumentation import span, traced, count
+from timeline_store import Timeline, load_timeline, save_timeline, export_json
+
+def mel_filterbank(sample_rate, n_fft, n_mels=26, low_hz=20.0, high_hz=None):
+    """Return an (n_mels, n_fft // 2 + 1) matrix of triangular mel filters."""
+    high_hz = high_hz or sample_rate / 2
+    to_mel = lambda hz: 2595.0 * np.log10(1.0 + hz / 700.0)
+    mel_points = np.linspace(to_mel(low_hz), to_mel(high_hz), n_mels + 2)
+    hz_points = 700.0 * (10.0 ** (mel_points / 2595.0) - 1.0)
+    freqs = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+    rising = (freqs - hz_points[:-2, None]) / (hz_points[1:-1] - hz_points[:-2])[:, None]
+    falling = (hz_points[2:, None] - freqs) / (hz_points[2:] - hz_points[1:-1])[:, None]
+    return np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+def dct_matrix(n_mfcc, n_mels):
+    """Return the orthonormal DCT-II matrix that turns log mel energies into cepstra."""
+    k = np.arange(n_mfcc)[:, None]
+    n = np.arange(n_mels)[None, :]
+    matrix = np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2.0 / n_mels)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+@traced()
+def compute_mfcc(audio, frame_seconds=0.025, hop_seconds=0.010, n_mfcc=13, n_mels=26, chunk_seconds=60.0):
+    """
+    Compute MFCCs over the whole file, one chunk of the memory-mapped audio at a time.
+
+    Every step (framing, windowing, FFT, mel filtering, DCT) works on a whole
+    chunk of frames at once.
+
+    Returns:
+        tuple: (mfcc, log_energy) with shapes (frames, n_mfcc) and (frames,).
+    """
+    signal = audio.mono()
+    frame_length = int(audio.sample_rate * frame_seconds)
+    hop = int(audio.sample_rate * hop_seconds)
+    n_fft = 1 << (frame_length - 1).bit_length()
+    total_frames = max(0, 1 + (len(signal) - frame_length) // hop)
+    filters = mel_filterbank(audio.sample_rate, n_fft, n_mels)
+    dct = dct_matrix(n_mfcc, n_mels)
+    window = np.hamming(frame_length).astype(np.float32)
+
+    mfcc = np.empty((total_frames, n_mfcc), dtype=np.float32)
+    log_energy = np.empty(total_frames, dtype=np.float32)
+    chunk_frames = max(1, int(chunk_seconds / hop_seconds))
+    for first in range(0, total_frames, chunk_frames):
+        last = min(total_frames, first + chunk_frames)
+        samples = signal[first * hop:(last - 1) * hop + frame_length].astype(np.float32) / 32768.0
+        samples[1:] -= 0.97 * samples[:-1].copy()  # Pre-emphasis
+        frames = sliding_window_view(samples, frame_length)[::hop] * window
+        power = np.abs(np.fft.rfft(frames, n_fft)) ** 2 / n_fft
+        mfcc[first:last] = np.log(power @ filters.T + 1e-10) @ dct.T
+        log_energy[first:last] = np.log(power.sum(axis=1) + 1e-10)
+    return mfcc, log_energy
+
+def window_embeddings(mfcc, log_energy, hop_seconds=0.010, window_seconds=1.5, window_hop_seconds=0.75, min_voiced=0.3):
+    """
+    Summarize the MFCCs of each analysis window as a speaker embedding.
+
+    The embedding is the mean and standard deviation of the cepstra (without
+    c0, so loudness does not separate speakers) over the window's voiced
+    frames, computed for all windows at once from cumulative sums.
+
+    Returns:
+        tuple: (starts, embeddings, voiced) — window start times in seconds,
+            L2-normalized embeddings and a mask of windows with enough speech.
+    """
+    frames_per_window = int(window_seconds / hop_seconds)
+    frames_per_hop = int(window_hop_seconds / hop_seconds)
+    window_count = max(0, 1 + (len(mfcc) - frames_per_window) // frames_per_hop)
+    starts = np.arange(window_count) * frames_per_hop
+
+    # Frames louder than the quietest 30% of the file count as speech
+    weights = (log_energy > np.percentile(log_energy, 30)).astype(np.float64) if len(log_energy) else np.empty(0)
+    features = mfcc[:, 1:].astype(np.float64)
+    cumulative = lambda values: np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)))
+    sum_w = cumulative(weights)
+    sum_x = cumulative(features * weights[:, None])
+    sum_xx = cumulative(features * features * weights[:, None])
+
+    ends = starts + frames_per_window
+    voiced_frames = sum_w[ends] - sum_w[starts]
+    safe = np.maximum(voiced_frames, 1.0)[:, None]
+    mean = (sum_x[ends] - sum_x[starts]) / safe
+    std = np.sqrt(np.maximum((sum_xx[ends] - sum_xx[starts]) / safe - mean * mean, 0.0))
+    embeddings = np.hstack((mean, std))
+
+    voiced = voiced_frames >= min_voiced * frames_per_window
+    if voiced.any():
+        embeddings = (embeddings - embeddings[voiced].mean(axis=0)) / (embeddings[voiced].std(axis=0) + 1e-8)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+    return starts * hop_seconds, embeddings.astype(np.float32), voiced
+
+def kmeans_cosine(embeddings, k, seed=0, iterations=50):
+    """Cluster L2-normalized embeddings by cosine similarity (k-means++ start). Returns (labels, centroids)."""
+    rng = np.random.default_rng(seed)
+    centroids = [embeddings[rng.integers(len(embeddings))]]
+    for _ in range(1, k):
+        distance = 1.0 - np.max(embeddings @ np.array(centroids).T, axis=1)
+        probabilities = np.maximum(distance, 0) ** 2
+        total = probabilities.sum()
+        centroids.append(embeddings[rng.choice(len(embeddings), p=probabilities / total) if total > 0 else rng.integers(len(embeddings))])
+    centroids = np.array(centroids)
+
+    labels = np.zeros(len(embeddings), dtype=np.int64)
+    for iteration in range(iterations):
+        new_labels = np.argmax(embeddings @ centroids.T, axis=1)
+        if iteration and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, embeddings)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-8), centroids)
+    return labels, centroids
+
+def silhouette_cosine(embeddings, labels, k):
+    """Mean silhouette score under cosine distance."""
+    distance = 1.0 - embeddings @ embeddings.T
+    one_hot = np.eye(k)[labels]
+    sizes = one_hot.sum(axis=0)
+    mean_distance = (distance @ one_hot) / np.maximum(sizes, 1)  # (n, k) mean distance to each cluster
+    own = labels
+    own_size = sizes[own]
+    a = mean_distance[np.arange(len(labels)), own] * own_size / np.maximum(own_size - 1, 1)  # Exclude the point itself
+    mean_distance[np.arange(len(labels)), own] = np.inf
+    mean_distance[:, sizes == 0] = np.inf
+    b = mean_distance.min(axis=1)
+    return float(np.mean((b - a) / np.maximum(np.maximum(a, b), 1e-8)))
+
+@traced()
+def cluster_speakers(embeddings, num_speakers=None, max_speakers=4, min_silhouette=0.3, seed=0, sample_size=2000):
+    """
+    Assign a speaker label to every embedding.
+
+    With num_speakers=None, 2..max_speakers clusters are tried on a sample of
+    windows and the best silhouette score wins; below min_silhouette the
+    audio is treated as a single speaker (single-voice recordings score
+    about 0.2, two-voice dialogue above 0.4).
+    """
+    if len(embeddings) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if num_speakers is None:
+        rng = np.random.default_rng(seed)
+        sample = embeddings[rng.choice(len(embeddings), min(sample_size, len(embeddings)), replace=False)]
+        num_speakers, best_score = 1, min_silhouette
+        for k in range(2, min(max_speakers, len(sample) - 1) + 1):
+            sample_labels, _ = kmeans_cosine(sample, k, seed)
+            score = silhouette_cosine(sample, sample_labels, k)
+            if score > best_score:
+                num_speakers, best_score = k, score
+        print(f"Estimated {num_speakers} speaker(s)")
+    if num_speakers == 1:
+        return np.zeros(len(embeddings), dtype=np.int64)
+    labels, _ = kmeans_cosine(embeddings, num_speakers, seed)
+    return labels
+
+def smooth_labels(labels, valid, num_speakers, radius=2):
+    """Majority vote over the 2 * radius + 1 neighbouring windows, ignoring windows without speech."""
+    votes = np.zeros((len(labels), num_speakers))
+    votes[np.nonzero(valid)[0], labels[valid]] = 1.0
+    cumulative = np.concatenate((np.zeros((1, num_speakers)), np.cumsum(votes, axis=0)))
+    index = np.arange(len(labels))
+    low = np.clip(index - radius, 0, len(labels))
+    high = np.clip(index + radius + 1, 0, len(labels))
+    window_votes = cumulative[high] - cumulative[low]
+    return np.where(window_votes.sum(axis=1) > 0, np.argmax(window_votes, axis=1), labels)
+
+def order_by_first_appearance(labels, valid):
+    """
+    Relabel speakers so speaker 0 is the first to talk, speaker 1 the second, and so on.
+
+    The order comes from the windows with speech; one remapping is applied to
+    every window, so windows without speech keep a label consistent with it.
+    """
+    voiced_labels = labels[valid]
+    _, first_index = np.unique(voiced_labels, return_index=True)
+    order = voiced_labels[np.sort(first_index)].tolist()
+    order += [label for label in range(labels.max() + 1 if len(labels) else 0) if label not in order]
+    mapping = np.empty(len(order), dtype=np.int64)
+    mapping[order] = np.arange(len(order))
+    return mapping[labels]
+
+def tag_words(word_timeline, window_starts, window_seconds, labels, valid, num_speakers):
+    """
+    Give each word the speaker with the most speech windows centered inside it.
+
+    Words too short to contain a window center take the nearest window's speaker.
+
+    Returns:
+        np.ndarray: int16 speaker ID per word.
+    """
+    centers = window_starts + window_seconds / 2
+    votes = np.zeros((len(labels), num_speakers))
+    votes[np.nonzero(valid)[0], labels[valid]] = 1.0
+    cumulative = np.concatenate((np.zeros((1, num_speakers)), np.cumsum(votes, axis=0)))
+    first = np.searchsorted(centers, word_timeline.start, side="left")
+    last = np.searchsorted(centers, word_timeline.end, side="right")
+    word_votes = cumulative[last] - cumulative[first]
+
+    midpoints = (word_timeline.start + word_timeline.end) / 2
+    if len(centers):
+        # searchsorted gives the first center after the midpoint; the one before it may be closer
+        after = np.minimum(np.searchsorted(centers, midpoints), len(centers) - 1)
+        before = np.maximum(after - 1, 0)
+        fallback = labels[np.where(midpoints - centers[before] <= centers[after] - midpoints, before, after)]
+    else:
+        fallback = np.zeros(len(word_timeline), dtype=np.int64)
+    return np.where(word_votes.sum(axis=1) > 0, np.argmax(word_votes, axis=1), fallback).astype(np.int16)
+
+def diarize_words(audio_path, word_timeline, num_speakers=None, max_speakers=4, window_seconds=1.5, window_hop_seconds=0.75, seed=0):
+    """
+    Tag every word with a speaker ID from one pass over the audio.
+
+    Args:
+        audio_path (str): 16-bit PCM WAV (output_audio.wav).
+        word_timeline (Timeline): Word timings from create-word-data.py.
+        num_speakers (int): Number of speakers, or None to estimate it (up to max_speakers).
+
+    Returns:
+        Timeline: The words with an extra "speaker" column.
+    """
+    audio = open_audio(audio_path)
+    with span("diarize", duration=round(audio.duration, 1)):
+        mfcc, log_energy = compute_mfcc(audio)
+        window_starts, embeddings, voiced = window_embeddings(mfcc, log_energy, window_seconds=window_seconds, window_hop_seconds=window_hop_seconds)
+        labels = np.zeros(len(embeddings), dtype=np.int64)
+        labels[voiced] = cluster_speakers(embeddings[voiced], num_speakers, max_speakers, seed=seed)
+        speakers = int(labels[voiced].max()) + 1 if voiced.any() else 1
+        labels = smooth_labels(labels, voiced, speakers)
+        labels = order_by_first_appearance(labels, voiced)
+        speaker_ids = tag_words(word_timeline, window_starts, window_seconds, labels, voiced, speakers)
+    count("speakers_found", speakers)
+    print(f"Tagged {len(word_timeline)} words with {speakers} speaker(s)")
+
+    extra = dict(word_timeline.extra, speaker=speaker_ids)
+    return Timeline("word", word_timeline.start, word_timeline.end, word_timeline.symbol_ids, word_timeline.symbols, extra)
+
+if __name__ == "__main__":
+    audio_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav"
+    word_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.npz"
+    json_output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.json"  # Set to None to skip
+    num_speakers = None  # Or the number of characters in the scene
+
+    # Tag the words in place; phoneme and viseme mapping carry the speaker column through
+    word_timeline = diarize_words(audio_file, load_timeline(word_data_path, kind="word"), num_speakers)
+    save_timeline(word_timeline, word_data_path)
+    if json_output_path:
+        export_json(word_timeline, json_output_path)
@@ -1,14 +1,22 @@
 from pyAudioAnalysis import audioSegmentation as aS
+from pyAudioAnalysis import audioTrainTest as aT
+from pyAudioAnalysis import MidTermFeatures as mtf
+from audio_access import open_audio
+import numpy as np
 import os
 
-def extract_emotions_with_pyaudioanalysis(audio_path, model_path, model_type="svm"):
+def extract_emotions_with_pyaudioanalysis(audio_path, model_path, model_type="svm", chunk_seconds=60.0):
     """
     Extract emotions and their timings from an audio file using pyAudioAnalysis.
 
+    The audio is read in chunks from the shared memory-mapped WAV instead of
+    letting pyAudioAnalysis decode the whole file again.
+
     Args:
         audio_path (str): Path to the audio file.
         model_path (str): Path to the pretrained model.
         model_type (str): Type of the model (e.g., "svm", "knn").
+        chunk_seconds (float): Length of audio classified at a time.
 
     Returns:
         list of tuples: Each tuple contains (start_time, end_time, emotion_label).
@@ -21,19 +29,40 @@ def extract_emotions_with_pyaudioanalysis(audio_path, model_path, model_type="sv
         raise FileNotFoundError(f"Model file not found: {model_path}")
 
     try:
-        # Perform mid-term segmentation and classification
-        segments, classes = aS.mid_term_file_classification(
-            audio_path,
-            model_path,
-            model_type
-        )
+        # kNN models are stored differently, as in pyAudioAnalysis' own mid_term_file_classification
+        load_model = aT.load_model_knn if model_type == "knn" else aT.load_model
+        classifier, mean, std, class_names, mid_window, mid_step, short_window, short_step, _ = load_model(model_path)
+        audio = open_audio(audio_path)
+        sampling_rate = audio.sample_rate
+
+        # Chunks hold a whole number of mid-term steps so labels line up across chunks
+        chunk_seconds = max(mid_step, round(chunk_seconds / mid_step) * mid_step)
+        labels = []
+        for start_time, _ in audio.iter_windows(chunk_seconds):
+            signal = audio.window(start_time, start_time + chunk_seconds + mid_window - mid_step)
+            if audio.channels > 1:
+                signal = signal.mean(axis=1)
+            if len(signal) < mid_window * sampling_rate:
+                break
+            # Perform mid-term feature extraction and classification on this chunk
+            mid_features, _, _ = mtf.mid_feature_extraction(
+                signal, sampling_rate,
+                mid_window * sampling_rate, mid_step * sampling_rate,
+                round(sampling_rate * short_window), round(sampling_rate * short_step),
+            )
+            steps = min(mid_features.shape[1], int(round(chunk_seconds / mid_step)))
+            for column in range(steps):
+                feature_vector = (mid_features[:, column] - mean) / std
+                label, _ = aT.classifier_wrapper(classifier, model_type, feature_vector)
+                labels.append(label)
 
         # Prepare results
+        segments, classes = aS.labels_to_segments(np.array(labels), mid_step)
         results = []
         for i, segment in enumerate(segments):
             start_time = segment[0]
             end_time = segment[1]
-            emotion_label = classes[i]
+            emotion_label = class_names[int(classes[i])]
             results.append((start_time, end_time, emotion_label))
 
         return results
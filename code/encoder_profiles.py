@@ -0,0 +1,124 @@
+import subprocess
+from instrumentation import span
+
+# x264 settings per job type. "threads": 0 lets x264 pick one per core.
+ENCODER_PROFILES = {
+    "draft": {"preset": "ultrafast", "crf": 28, "tune": "animation", "keyframe_interval": 60, "threads": 0, "lossless_intermediate": False},
+    "balanced": {"preset": "medium", "crf": 20, "tune": "animation", "keyframe_interval": 120, "threads": 0, "lossless_intermediate": False},
+    "final": {"preset": "slow", "crf": 18, "tune": "animation", "keyframe_interval": 240, "threads": 0, "lossless_intermediate": False},
+    # Render to a lossless file first (fast to write, safe to re-encode later), then encode "final" from it
+    "mastering": {"preset": "slow", "crf": 16, "tune": "animation", "keyframe_interval": 240, "threads": 0, "lossless_intermediate": True},
+    # Transparent output for compositing in an editor: no background, frames cropped to the character
+    "prores_alpha": {"codec": "prores_ks", "prores_profile": "4444", "pix_fmt": "yuva444p10le", "threads": 0,
+                     "alpha": True, "extension": ".mov", "audio_codec": "aac", "lossless_intermediate": False},
+    "vp9_alpha": {"codec": "libvpx-vp9", "crf": 30, "speed": 4, "keyframe_interval": 240, "pix_fmt": "yuva420p", "threads": 0,
+                  "alpha": True, "extension": ".webm", "audio_codec": "libopus", "lossless_intermediate": False},
+}
+
+def get_encoder_profile(profile):
+    """Return an encoder profile by name, or pass a profile dict through with defaults filled in."""
+    if isinstance(profile, str):
+        if profile not in ENCODER_PROFILES:
+            raise ValueError(f"Unknown encoder profile '{profile}'. Available: {', '.join(ENCODER_PROFILES)}")
+        return dict(ENCODER_PROFILES[profile])
+    return {**ENCODER_PROFILES["balanced"], **profile}
+
+def x264_args(profile):
+    """Return the ffmpeg video codec arguments for an encoder profile."""
+    args = ["-c:v", "libx264", "-preset", profile["preset"], "-crf", str(profile["crf"])]
+    if profile.get("tune"):
+        args += ["-tune", profile["tune"]]
+    if profile.get("keyframe_interval"):
+        args += ["-g", str(profile["keyframe_interval"])]
+    args += ["-threads", str(profile.get("threads", 0)), "-pix_fmt", "yuv420p"]
+    return args
+
+def video_codec_args(profile):
+    """Return the ffmpeg video codec arguments for any encoder profile (x264 unless it names another codec)."""
+    codec = profile.get("codec", "libx264")
+    if codec == "libx264":
+        return x264_args(profile)
+    if codec == "prores_ks":
+        # Alpha is only kept with the 4444 profiles and a yuva pixel format
+        return ["-c:v", "prores_ks", "-profile:v", profile["prores_profile"], "-pix_fmt", profile["pix_fmt"],
+                "-vendor", "apl0", "-threads", str(profile.get("threads", 0))]
+    if codec == "libvpx-vp9":
+        return ["-c:v", "libvpx-vp9", "-pix_fmt", profile["pix_fmt"], "-crf", str(profile["crf"]), "-b:v", "0",
+                "-deadline", "good", "-cpu-used", str(profile.get("speed", 4)), "-row-mt", "1",
+                "-g", str(profile.get("keyframe_interval", 240)), "-threads", str(profile.get("threads", 0))]
+    raise ValueError(f"Unsupported codec '{codec}' in encoder profile")
+
+def raw_video_input_args(fps, resolution, pix_fmt="rgb24"):
+    """Return ffmpeg input arguments for raw frames written to stdin."""
+    return ["-f", "rawvideo", "-pix_fmt", pix_fmt, "-s", f"{resolution[0]}x{resolution[1]}", "-r", str(fps), "-i", "-"]
+
+def audio_output_args(audio_codec="aac"):
+    """Return the ffmpeg audio codec arguments used for every final output (WebM needs "libopus")."""
+    return ["-c:a", audio_codec, "-b:a", "192k", "-shortest"]
+
+def build_encode_command(profile, fps, resolution, output_file, audio_file=None):
+    """
+    Build one ffmpeg command that encodes raw frames from stdin, muxing the audio if given.
+
+    Args:
+        profile (dict): Encoder profile from get_encoder_profile. Profiles
+            with "alpha" read RGBA frames instead of RGB.
+        fps (int): Frame rate of the raw frames.
+        resolution (tuple): Frame size (width, height).
+        output_file (str): Path of the encoded file.
+        audio_file (str): Optional audio track to mux into the same output.
+
+    Returns:
+        list: ffmpeg command line.
+    """
+    pix_fmt = "rgba" if profile.get("alpha") else "rgb24"
+    command = ["ffmpeg", "-y", "-loglevel", "error", *raw_video_input_args(fps, resolution, pix_fmt)]
+    if audio_file:
+        command += ["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0"]
+    command += video_codec_args(profile)
+    if audio_file:
+        command += audio_output_args(profile.get("audio_codec", "aac"))
+    command.append(output_file)
+    return command
+
+def build_lossless_command(fps, resolution, output_file, alpha=False):
+    """
+    Build an ffmpeg command that writes raw frames from stdin to a lossless intermediate.
+
+    x264 has no alpha channel, so RGBA frames go to FFV1 instead (both need an .mkv output).
+    """
+    if alpha:
+        return [
+            "ffmpeg", "-y", "-loglevel", "error", *raw_video_input_args(fps, resolution, "rgba"),
+            "-c:v", "ffv1", "-pix_fmt", "bgra", output_file,
+        ]
+    return [
+        "ffmpeg", "-y", "-loglevel", "error", *raw_video_input_args(fps, resolution),
+        "-c:v", "libx264rgb", "-preset", "ultrafast", "-qp", "0", output_file,
+    ]
+
+def build_transcode_command(profile, input_video, output_file, audio_file=None):
+    """Build an ffmpeg command that encodes an intermediate video with a profile, muxing the audio if given."""
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-i", input_video]
+    if audio_file:
+        command += ["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0"]
+    command += video_codec_args(profile)
+    if audio_file:
+        command += audio_output_args(profile.get("audio_codec", "aac"))
+    command.append(output_file)
+    return command
+
+def open_encoder(command):
+    """Start an ffmpeg process that reads raw frames from stdin."""
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+def close_encoder(process, command):
+    """Finish writing frames and raise if ffmpeg failed."""
+    with span("ffmpeg_finish"):
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
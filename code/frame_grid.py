@@ -0,0 +1,78 @@
+from fractions import Fraction
+
+import numpy as np
+
+# Event times are snapped to whole microseconds once; all frame math after that is integer
+TICKS_PER_SECOND = 1_000_000
+
+def frame_rate(fps):
+    """
+    Return a frame rate as an exact fraction.
+
+    Accepts ints (30), strings ("30000/1001") and Fractions. Floats such as
+    29.97 are converted to the nearest fraction with a denominator of at most 1001.
+    """
+    if isinstance(fps, float):
+        return Fraction(fps).limit_denominator(1001)
+    return Fraction(fps)
+
+def seconds_to_ticks(seconds):
+    """Snap times in seconds (scalar or array) to integer microsecond ticks."""
+    return np.round(np.asarray(seconds, dtype=np.float64) * TICKS_PER_SECOND).astype(np.int64)
+
+def first_frame_at(seconds, fps):
+    """
+    Return the first frame whose timestamp is at or after `seconds`.
+
+    Frame n is shown at n / fps. Both sides are compared in whole ticks, so
+    a time that lands on a frame boundary (like the float 2 / 30) maps to that
+    frame rather than the next one. In integer arithmetic this is the smallest
+    n with round(n * den * TICKS / num) >= ticks, i.e.
+    ceil((2 * ticks - 1) * num / (2 * den * TICKS)).
+    """
+    rate = frame_rate(fps)
+    ticks = seconds_to_ticks(seconds)
+    divisor = 2 * rate.denominator * TICKS_PER_SECOND
+    return -((-(2 * ticks - 1) * rate.numerator) // divisor)
+
+def frame_count(duration, fps):
+    """Number of frames needed to show `duration` seconds, including a final partial frame."""
+    return int(first_frame_at(duration, fps))
+
+def frame_times(start_frame, end_frame, fps):
+    """Timestamps in seconds of frames [start_frame, end_frame), e.g. for cross-fade progress."""
+    rate = frame_rate(fps)
+    return np.arange(start_frame, end_frame, dtype=np.float64) * rate.denominator / rate.numerator
+
+def quantize_events(start, end, fps):
+    """
+    Convert event times to frame ranges.
+
+    An event [start, end) covers the frames whose timestamps fall inside it,
+    so it becomes [first_frame, end_frame). Events shorter than a frame
+    can come out empty (first_frame == end_frame).
+    """
+    return first_frame_at(start, fps), first_frame_at(end, fps)
+
+def event_index_per_frame(start, end, total_frames, fps, start_frame=0):
+    """
+    Return, for each frame in [start_frame, total_frames), the index of the event shown on it, or -1.
+
+    Events must be sorted by start time and must not overlap (as in every
+    timeline the pipeline writes). When a later event starts on the same
+    frame an earlier one ends, the later event wins.
+    """
+    first_frames, end_frames = quantize_events(start, end, fps)
+    frames = np.arange(start_frame, total_frames, dtype=np.int64)
+    if not len(first_frames):
+        return np.full(len(frames), -1, dtype=np.int64)
+    index = np.searchsorted(first_frames, frames, side="right") - 1
+    active = (index >= 0) & (frames < end_frames[np.maximum(index, 0)])
+    return np.where(active, index, -1)
+
+def symbol_per_frame(timeline, total_frames, fps, start_frame=0):
+    """Return the symbol ID of a Timeline shown on each frame in [start_frame, total_frames) (-1 between events)."""
+    if timeline is None or not len(timeline):
+        return np.full(total_frames - start_frame, -1, dtype=np.int32)
+    index = event_index_per_frame(timeline.start, timeline.end, total_frames, fps, start_frame)
+    return np.where(index >= 0, timeline.symbol_ids[np.maximum(index, 0)], -1).astype(np.int32)
@@ -0,0 +1,171 @@
+import atexit
+import contextlib
+import functools
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Set SPEECH_ALIGNER_TRACE to a directory to record spans and counters from every stage.
+# Set SPEECH_ALIGNER_PROFILE=1 as well to run the hot render loop under cProfile.
+TRACE_DIR = os.environ.get("SPEECH_ALIGNER_TRACE")
+PROFILE_ENABLED = os.environ.get("SPEECH_ALIGNER_PROFILE") == "1"
+
+_events = []
+_counters = {}
+_lock = threading.Lock()
+
+def enabled():
+    """Return True when tracing is switched on for this process."""
+    return TRACE_DIR is not None
+
+def _now_us():
+    """Wall-clock time in microseconds, comparable across processes."""
+    return time.time_ns() // 1000
+
+def peak_rss_mb():
+    """Return this process's peak resident set size in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+@contextlib.contextmanager
+def span(name, **args):
+    """
+    Record the wall time, CPU time and peak memory of a block.
+
+    Example:
+        with span("map_words_to_phonemes", words=len(word_data)):
+            ...
+    """
+    if not enabled():
+        yield
+        return
+    start_us = _now_us()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        event = {
+            "name": name, "cat": "stage", "ph": "X", "ts": start_us, "dur": int(wall * 1e6),
+            "pid": os.getpid(), "tid": threading.get_ident(),
+            "args": {**args, "cpu_ms": round(cpu * 1000, 3), "peak_rss_mb": round(peak_rss_mb(), 1)},
+        }
+        with _lock:
+            _events.append(event)
+
+def traced(name=None):
+    """Decorator form of span(); the span is named after the function by default."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    """Add to a counter (frames rendered, cache hits, OOV words...)."""
+    if not enabled():
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+        _events.append({"name": name, "ph": "C", "ts": _now_us(), "pid": os.getpid(), "args": {name: _counters[name]}})
+
+@contextlib.contextmanager
+def profile_block(name):
+    """Run a block under cProfile when SPEECH_ALIGNER_PROFILE=1, saving the stats next to the trace."""
+    if not PROFILE_ENABLED:
+        yield
+        return
+    import cProfile  # Only needed when profiling, kept out of every stage's startup
+    import io
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        output_dir = TRACE_DIR or "."
+        os.makedirs(output_dir, exist_ok=True)
+        stats_path = os.path.join(output_dir, f"{name}_{os.getpid()}.prof")
+        profiler.dump_stats(stats_path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(20)
+        print(report.getvalue())
+        print(f"cProfile stats for {name} saved to {stats_path} (open with snakeviz or pstats)")
+
+def _write_trace():
+    """Write this process's events to the trace directory at exit."""
+    if not enabled() or not _events:
+        return
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    process_name = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+    metadata = {"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": process_name}}
+    trace_path = os.path.join(TRACE_DIR, f"trace_{os.getpid()}_{_now_us()}.json")
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump([metadata, *_events], f)
+
+atexit.register(_write_trace)
+
+def merge_traces(trace_dir, output_file=None):
+    """
+    Combine the per-process trace files of a run into one Chrome trace.
+
+    The result opens in chrome://tracing or https://ui.perfetto.dev.
+
+    Returns:
+        list: All trace events.
+    """
+    events = []
+    for trace_path in sorted(glob.glob(os.path.join(trace_dir, "trace_*.json"))):
+        with open(trace_path, "r", encoding="utf-8") as f:
+            events.extend(json.load(f))
+    if output_file:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Chrome trace saved to {output_file}")
+    return events
+
+def summary_table(events):
+    """Return a text table of total wall/CPU time per span and the final value of each counter."""
+    spans = {}
+    counters = {}
+    for event in events:
+        if event.get("ph") == "X":
+            stats = spans.setdefault(event["name"], {"calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "peak_rss_mb": 0.0})
+            stats["calls"] += 1
+            stats["wall_ms"] += event["dur"] / 1000
+            stats["cpu_ms"] += event["args"].get("cpu_ms", 0.0)
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], event["args"].get("peak_rss_mb", 0.0))
+        elif event.get("ph") == "C":
+            counters[(event["pid"], event["name"])] = event["args"][event["name"]]
+
+    lines = [f"{'span':<32}{'calls':>7}{'wall ms':>12}{'cpu ms':>12}{'peak MB':>10}"]
+    for name, stats in sorted(spans.items(), key=lambda item: -item[1]["wall_ms"]):
+        lines.append(f"{name:<32}{stats['calls']:>7}{stats['wall_ms']:>12.1f}{stats['cpu_ms']:>12.1f}{stats['peak_rss_mb']:>10.1f}")
+
+    totals = {}
+    for (pid, name), value in counters.items():
+        totals[name] = totals.get(name, 0) + value
+    if totals:
+        lines.append("")
+        lines.append(f"{'counter':<32}{'value':>12}")
+        for name, value in sorted(totals.items()):
+            lines.append(f"{name:<32}{value:>12}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # Usage: python instrumentation.py <trace_dir> [chrome_trace.json]
+    if len(sys.argv) < 2:
+        print("Usage: python instrumentation.py <trace_dir> [chrome_trace.json]")
+        sys.exit(1)
+    trace_dir = sys.argv[1]
+    output_file = sys.argv[2] if len(sys.argv) > 2 else os.path.join(trace_dir, "chrome_trace.json")
+    print(summary_table(merge_traces(trace_dir, output_file)))
@@ -0,0 +1,194 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+from frame_grid import frame_rate
+from instrumentation import count
+
+MOTION_STYLE = {
+    "transition_seconds": 0.25,  # Cross-fade length of a pose change
+    "idle_period": 4.0,  # Seconds per breath
+    "breath_scale": 0.012,  # Peak vertical stretch of the body
+    "breath_levels": 6,  # Distinct stretched bodies in the idle cycle
+    "bob_scale": 0.003,  # Peak bob as a fraction of the frame height
+    "bob_lag": 0.15,  # Bob phase behind the breath, as a fraction of the cycle
+}
+
+def blend_surfaces(old_image, new_image, weight):
+    """Alpha-correct cross-fade between two same-size sprites (weight 0 is old_image, 1 is new_image)."""
+    old_alpha = pygame.surfarray.array_alpha(old_image).astype(np.float32) / 255
+    new_alpha = pygame.surfarray.array_alpha(new_image).astype(np.float32) / 255
+    alpha = old_alpha * (1 - weight) + new_alpha * weight
+    rgb = (pygame.surfarray.array3d(old_image) * (old_alpha * (1 - weight))[..., None]
+           + pygame.surfarray.array3d(new_image) * (new_alpha * weight)[..., None]) / np.maximum(alpha, 1e-6)[..., None]
+    blended = pygame.Surface(new_image.get_size(), pygame.SRCALPHA)
+    pygame.surfarray.blit_array(blended, np.clip(rgb, 0, 255).astype(np.uint8))
+    pygame.surfarray.pixels_alpha(blended)[:] = (alpha * 255).astype(np.uint8)
+    return blended
+
+class FrameCache:
+    """
+    LRU cache of precomputed sprites, bounded by their pixel memory.
+
+    Entries are rebuilt on a miss, so the bound only trades memory for the
+    occasional rebuild; it never changes what is drawn.
+    """
+
+    def __init__(self, max_bytes=96 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _size(value):
+        surface = value[0] if isinstance(value, tuple) else value
+        return surface.get_width() * surface.get_height() * 4
+
+    def get(self, key, build):
+        """Return the cached value for key, calling build() to make it on a miss."""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            count("frame_cache_hits")
+            return value
+        value = build()
+        count("frame_cache_misses")
+        self._entries[key] = value
+        self.bytes += self._size(value)
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= self._size(evicted)
+            count("frame_cache_evictions")
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+class MotionLayer:
+    """
+    Pose cross-fades and an idle breathing cycle, precomputed once per character and resolution.
+
+    A pose change fades over transition_seconds. Each step of each pose pair
+    is blended once (over the union of the two sprites' visible areas) and
+    reused for every later switch between the same poses. The idle cycle
+    stretches the body vertically, anchored at its feet, by one of
+    breath_levels precomputed amounts and bobs the whole character by whole
+    pixels, which is only a position change. The blink overlay is stretched
+    with the body, so the eyelids stay on the eyes. Rendering a frame is then a
+    cache lookup per layer, as with static poses.
+    """
+
+    def __init__(self, head_image, pose_images, resolution, style=None, cache=None, blink_image=None):
+        self.style = {**MOTION_STYLE, **(style or {})}
+        self.head_image = head_image
+        self.blink_image = blink_image
+        self.pose_images = pose_images
+        self.cache = cache or FrameCache()
+        self.bob_pixels = round(resolution[1] * self.style["bob_scale"])
+        self.transition_frames = None  # Set by frame_states, which knows the frame rate
+
+    @property
+    def margin(self):
+        """How far above its static position the character can reach, for cropping."""
+        return self.bob_pixels + math.ceil(self.head_image.get_height() * self.style["breath_scale"])
+
+    def history_frames(self, fps):
+        """Frames of pose history frame_states needs before a range to see the fades already under way in it."""
+        return max(1, round(self.style["transition_seconds"] * frame_rate(fps))) + 1
+
+    def frame_states(self, pose, fps, start_frame=0):
+        """
+        Resolve the pose transitions and idle cycle per frame.
+
+        Args:
+            pose (np.ndarray): Pose symbol ID per frame (-1 for neutral), from resolve_frame_states.
+            start_frame (int): Frame number of pose[0]. A fade is only found
+                when the pose change lies inside `pose`.
+
+        Returns:
+            dict: "previous_pose" and "pose_step" (the pose faded from and the
+                step of the fade, -1 outside one), "breath_level" and "bob" (pixels).
+        """
+        rate = frame_rate(fps)
+        self.transition_frames = max(1, round(self.style["transition_seconds"] * rate))
+        frames = np.arange(len(pose))
+
+        # Frames since the last pose change (relative to pose[0])
+        changed = np.flatnonzero(pose[1:] != pose[:-1]) + 1
+        last_change = np.zeros(len(pose), dtype=np.int64)
+        last_change[changed] = changed
+        last_change = np.maximum.accumulate(last_change) if len(pose) else last_change
+        step = frames - last_change
+        fading = (last_change > 0) & (step < self.transition_frames)
+
+        cycle = max(1, round(self.style["idle_period"] * rate))
+        phase = ((frames + start_frame) % cycle) / cycle
+        breath = 0.5 - 0.5 * np.cos(2 * np.pi * phase)
+        bob = 0.5 - 0.5 * np.cos(2 * np.pi * (phase - self.style["bob_lag"]))
+        return {
+            "previous_pose": np.where(fading, pose[np.maximum(last_change - 1, 0)], -1).astype(np.int32),
+            "pose_step": np.where(fading, step, -1).astype(np.int32),
+            "breath_level": np.round(breath * (self.style["breath_levels"] - 1)).astype(np.int32),
+            "bob": -np.round(bob * self.bob_pixels).astype(np.int32),
+        }
+
+    def _stretched(self, name, image, level):
+        """Return image stretched vertically for a breath level, from the cache."""
+        def build():
+            width, height = image.get_size()
+            stretch = 1 + self.style["breath_scale"] * level / max(1, self.style["breath_levels"] - 1)
+            return pygame.transform.smoothscale(image, (width, round(height * stretch)))
+        return self.cache.get((name, level), build) if level else image
+
+    def body(self, level):
+        """Return the head/body image stretched for a breath level, and how far its top moved down (negative: up)."""
+        surface = self._stretched("body", self.head_image, level)
+        return surface, self.head_image.get_height() - surface.get_height()
+
+    def blink(self, level):
+        """Return the blink overlay stretched like the body for a breath level; it is drawn where the body is."""
+        return self._stretched("blink", self.blink_image, level)
+
+    def transition(self, previous, current, step):
+        """
+        Return the blend of step of a fade between two poses, as (surface, offset in the pose sprite).
+
+        A missing pose image fades from or to nothing; sprites of different
+        sizes cannot be blended and cut instead.
+        """
+        old_image = self.pose_images.get(previous)
+        new_image = self.pose_images.get(current)
+        if old_image is None and new_image is None:
+            return None, (0, 0)
+        if old_image is not None and new_image is not None and old_image.get_size() != new_image.get_size():
+            return new_image, (0, 0)
+
+        def build():
+            images = [image for image in (old_image, new_image) if image is not None]
+            area = images[0].get_bounding_rect().unionall([image.get_bounding_rect() for image in images[1:]])
+            if not area.width or not area.height:
+                return pygame.Surface((1, 1), pygame.SRCALPHA), (0, 0)
+            empty = pygame.Surface(images[0].get_size(), pygame.SRCALPHA)
+            old_part = (empty if old_image is None else old_image).subsurface(area)
+            new_part = (empty if new_image is None else new_image).subsurface(area)
+            weight = (step + 1) / (self.transition_frames + 1)
+            return blend_surfaces(old_part, new_part, weight), area.topleft
+
+        return self.cache.get(("transition", previous, current, step, self.transition_frames), build)
+
+    def warm(self, states, pose_timeline):
+        """Precompute every body, blink and transition blend the clip uses, before the render loop."""
+        for level in np.unique(states["breath_level"]):
+            self.body(int(level))
+        if self.blink_image is not None:
+            for level in np.unique(states["breath_level"][states["blink"]]):
+                self.blink(int(level))
+        fading = np.flatnonzero(states["pose_step"] >= 0)
+        pairs = set(zip(states["previous_pose"][fading].tolist(), states["pose"][fading].tolist()))
+        name = lambda pose_id: pose_timeline.symbols[pose_id] if pose_id >= 0 else "neutralpose"
+        for previous, current in pairs:
+            for step in range(self.transition_frames):
+                self.transition(name(previous), name(current), step)
+        count("pose_pairs_blended", len(pairs))
@@ -1,5 +1,7 @@
-import json
+from instrumentation import traced, count
+from timeline_store import Timeline, load_timeline, save_timeline, export_json
 
+@traced()
 def load_cmu_dict(file_path):
     """Load the CMU Pronouncing Dictionary."""
     cmu_dict = {}
@@ -16,6 +18,7 @@ def load_cmu_dict(file_path):
     print(f"Loaded {len(cmu_dict)} entries from the CMU dictionary.")
     return cmu_dict
 
+@traced()
 def map_words_to_phonemes(word_data, cmu_dict):
     phoneme_data = []
     unmatched_words = []
@@ -44,13 +47,19 @@ def map_words_to_phonemes(word_data, cmu_dict):
         current_time = start_time
 
         for phoneme in phonemes:
-            phoneme_data.append({
+            phoneme_entry = {
                 'phoneme': phoneme,
                 'start_time': current_time,
                 'end_time': current_time + phoneme_duration
-            })
+            }
+            if 'speaker' in word_entry:  # Set by the diarization stage
+                phoneme_entry['speaker'] = word_entry['speaker']
+            phoneme_data.append(phoneme_entry)
             current_time += phoneme_duration
 
+    count("words_mapped", len(word_data))
+    count("oov_words", len(unmatched_words))
+
     # Print unmatched words for debugging
     if unmatched_words:
         print("Unmatched words:", unmatched_words)
@@ -63,18 +72,20 @@ def main():
     cmu_dict_path = "/Users/nervous/Documents/GitHub/speech-aligner/.venv/lib/python3.10/site-packages/pocketsphinx/model/en-us/cmudict-en-us.dict"  # Replace with your actual path
     cmu_dict = load_cmu_dict(cmu_dict_path)
 
-    # Load the word data JSON
-    word_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.json"  # Replace with your word data JSON file path
-    with open(word_data_path, "r", encoding="utf-8") as json_file:
-        word_data = json.load(json_file)
+    # Load the word timeline (.npz, or a word_data.json from older runs)
+    word_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.npz"  # Replace with your word data file path
+    word_data = load_timeline(word_data_path, kind="word").to_records()
 
     # Map words to phonemes
     phoneme_data = map_words_to_phonemes(word_data, cmu_dict)
 
-    # Save the phoneme data to JSON
-    output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/phoneme_data.json"
-    with open(output_path, "w", encoding="utf-8") as json_file:
-        json.dump(phoneme_data, json_file, indent=4, ensure_ascii=False)
+    # Save the phoneme data as a columnar timeline (plus JSON for debugging)
+    output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/phoneme_data.npz"
+    json_output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/phoneme_data.json"  # Set to None to skip
+    phoneme_timeline = Timeline.from_records(phoneme_data, "phoneme")
+    save_timeline(phoneme_timeline, output_path)
+    if json_output_path:
+        export_json(phoneme_timeline, json_output_path)
 
     print(f"Phoneme data has been exported to {output_path}")
 
@@ -1,14 +1,17 @@
 import re
 import json
 import os
+from instrumentation import traced
+from timeline_store import Timeline, load_timeline, save_timeline
 
 def load_file(file_path):
     """
-    Load text or JSON file content.
+    Load text, JSON or word timeline file content.
     Args:
         file_path (str): Path to the file.
     Returns:
-        str or dict: File content (string for text files, dict for JSON files).
+        str or dict: File content (string for text files, dict for JSON files,
+            list of word dicts for .npz timelines).
     """
     if file_path.endswith(".txt"):
         with open(file_path, "r", encoding="utf-8") as f:
@@ -16,9 +19,12 @@ def load_file(file_path):
     elif file_path.endswith(".json"):
         with open(file_path, "r", encoding="utf-8") as f:
             return json.load(f)
+    elif file_path.endswith(".npz"):
+        return load_timeline(file_path).to_records()
     else:
         raise ValueError(f"Unsupported file format for file: {file_path}")
 
+@traced()
 def parse_transcript_with_poses(transcript, words_timing):
     """
     Parse transcript for poses and generate timing data for each pose.
@@ -56,20 +62,24 @@ def parse_transcript_with_poses(transcript, words_timing):
 
 def save_pose_data(pose_data, output_file):
     """
-    Save the pose data to a JSON file.
+    Save the pose data to a .npz timeline or a JSON file.
     Args:
         pose_data (list): Pose data to save.
-        output_file (str): Path to the output JSON file.
+        output_file (str): Path to the output .npz or JSON file.
     """
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(pose_data, f, indent=4)
+    if output_file.endswith(".npz"):
+        save_timeline(Timeline.from_records(pose_data, "pose"), output_file)
+    else:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(pose_data, f, indent=4)
     print(f"Pose data saved to: {output_file}")
 
 if __name__ == "__main__":
     # File paths
     transcript_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/transcript_poses.txt"
-    words_timing_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.json"
-    output_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/pose_data.json"
+    words_timing_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/word_data.npz"
+    output_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/pose_data.npz"
+    json_output_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/pose_data.json"  # Set to None to skip
 
     # Load input files
     transcript = load_file(transcript_file)
@@ -78,5 +88,7 @@ if __name__ == "__main__":
     # Parse poses from the transcript
     pose_data = parse_transcript_with_poses(transcript, words_timing)
 
-    # Save the pose data to a JSON file
+    # Save the pose data as a timeline (plus JSON for debugging)
     save_pose_data(pose_data, output_file)
+    if json_output_file:
+        save_pose_data(pose_data, json_output_file)
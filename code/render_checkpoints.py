@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import subprocess
+
+from encoder_profiles import audio_output_args
+from frame_grid import frame_rate
+from instrumentation import traced, count
+
+MANIFEST_NAME = "manifest.json"
+
+def load_manifest(checkpoint_dir):
+    """Load the checkpoint manifest, or return an empty one if there is none yet."""
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"Ignoring unreadable checkpoint manifest {manifest_path}: {e}")
+    return {"segments": {}}
+
+def save_manifest(checkpoint_dir, manifest):
+    """Write the manifest atomically so a crash never leaves it half written."""
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+def segment_ranges(total_frames, segment_frames):
+    """Split a clip into [start_frame, end_frame) ranges of at most segment_frames frames."""
+    return [(start, min(start + segment_frames, total_frames)) for start in range(0, total_frames, segment_frames)]
+
+def file_signatures(paths):
+    """
+    Return {path: [size, mtime]} for asset files and for every file in asset folders.
+
+    Part of the segment hash, so a sprite edited in place invalidates the
+    segments rendered with it. Missing paths (e.g. no background) map to None.
+    """
+    signatures = {}
+    for path in paths:
+        if path and os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            files = [path]
+        for file_path in files:
+            if file_path and os.path.isfile(file_path):
+                signatures[file_path] = [os.path.getsize(file_path), os.path.getmtime(file_path)]
+            elif file_path:
+                signatures[file_path] = None
+    return signatures
+
+def _timeline_slice(timeline, start_time, end_time):
+    """Return [symbol, start, end] for the timeline events overlapping a time range."""
+    return [
+        [timeline.symbols[timeline.symbol_ids[i]], float(timeline.start[i]), float(timeline.end[i])]
+        for i in timeline.overlapping(start_time, end_time)
+    ]
+
+def segment_inputs_hash(start_frame, end_frame, fps, viseme_timeline, pose_timeline, blinks, settings, states=None, caption_texts=None):
+    """
+    Hash everything that affects the frames of one segment.
+
+    Only timeline entries overlapping the segment are included, so editing one
+    part of a long clip leaves the hashes of the other segments unchanged.
+    With captions, pass the states from resolve_frame_states and the text of
+    every caption line: the segment's per-frame caption states and the lines
+    it shows are hashed the same way.
+    """
+    rate = frame_rate(fps)
+    start_time = float(start_frame / rate)
+    end_time = float(end_frame / rate)
+    inputs = {
+        "range": [start_frame, end_frame, str(rate)],
+        "visemes": _timeline_slice(viseme_timeline, start_time, end_time),
+        "poses": _timeline_slice(pose_timeline, start_time, end_time),
+        "blinks": [list(blink) for blink in blinks if blink[0] < end_time and blink[1] > start_time],
+        "settings": settings,
+    }
+    if states is not None and "caption_line" in states:
+        first, last = start_frame - states["start_frame"], end_frame - states["start_frame"]
+        line = states["caption_line"][first:last].tolist()
+        inputs["captions"] = {
+            "line": line,
+            "words": states["caption_words"][first:last].tolist(),
+            "texts": {index: caption_texts[index] for index in sorted(set(line)) if index >= 0},
+        }
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+def render_checkpointed(checkpoint_dir, manifest, ranges, segment_hashes, render_segment, extension=".mp4"):
+    """
+    Render every segment that has no valid checkpoint and record it in the manifest.
+
+    Args:
+        checkpoint_dir (str): Directory holding the encoded segments and manifest.
+        manifest (dict): Manifest from load_manifest; updated and saved in place.
+        ranges (list): (start_frame, end_frame) per segment.
+        segment_hashes (list): Input hash per segment, from segment_inputs_hash.
+        render_segment (callable): render_segment(start_frame, end_frame, output_path)
+            renders and encodes one segment.
+        extension (str): File extension of the encoded segments.
+
+    Returns:
+        list: Paths of the encoded segments, in order.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    segment_files = []
+    reused = 0
+
+    for index, ((start_frame, end_frame), segment_hash) in enumerate(zip(ranges, segment_hashes)):
+        file_name = f"segment_{index:05d}{extension}"
+        segment_path = os.path.join(checkpoint_dir, file_name)
+        entry = manifest["segments"].get(str(index))
+        if (entry and entry["hash"] == segment_hash and entry["start_frame"] == start_frame
+                and entry["end_frame"] == end_frame and os.path.exists(segment_path)):
+            reused += 1
+        else:
+            # Encode to a temporary name so an interrupted segment is never mistaken for a finished one
+            tmp_path = os.path.join(checkpoint_dir, f"segment_{index:05d}.partial{extension}")
+            render_segment(start_frame, end_frame, tmp_path)
+            os.replace(tmp_path, segment_path)
+            entry = {"start_frame": start_frame, "end_frame": end_frame, "hash": segment_hash, "file": file_name}
+        manifest["segments"][str(index)] = entry
+        save_manifest(checkpoint_dir, manifest)
+        segment_files.append(segment_path)
+
+    # Forget segments past the end of a clip that got shorter
+    manifest["segments"] = {key: entry for key, entry in manifest["segments"].items() if int(key) < len(ranges)}
+    save_manifest(checkpoint_dir, manifest)
+    count("segments_reused", reused)
+    count("segments_rendered", len(ranges) - reused)
+    print(f"Reused {reused} of {len(ranges)} checkpointed segments.")
+    return segment_files
+
+@traced()
+def concat_segments(segment_files, output_file, audio_file=None, transcode_args=None, audio_codec="aac"):
+    """
+    Join encoded segments into the final output, muxing the audio if given.
+
+    Segments are stream-copied unless transcode_args (ffmpeg video codec
+    arguments) are given, e.g. when the segments are lossless intermediates.
+    """
+    list_path = os.path.join(os.path.dirname(segment_files[0]), "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for segment_path in segment_files:
+            f.write(f"file '{os.path.abspath(segment_path)}'\n")
+
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_file:
+        command += ["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0"]
+    command += transcode_args or ["-c:v", "copy"]
+    if audio_file:
+        command += audio_output_args(audio_codec)
+    command.append(output_file)
+    subprocess.run(command, check=True)
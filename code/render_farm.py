@@ -0,0 +1,478 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+from animate_poses import load_viseme_data, load_pose_data, load_render_assets, load_bundle_assets, generate_blinks, resolve_frame_states, render_frame_range
+from captions import CaptionTrack, load_caption_words
+from encoder_profiles import get_encoder_profile, build_lossless_command, open_encoder, close_encoder, video_codec_args
+from frame_grid import frame_count
+from instrumentation import span, count
+from render_checkpoints import segment_ranges, concat_segments, file_signatures
+from timeline_store import as_timeline
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FARM_DIR = os.path.join(REPO_DIR, "farm")
+QUEUE_NAME = "queue.sqlite"
+LEASE_SECONDS = 120.0
+MAX_ATTEMPTS = 3
+
+class JobQueue:
+    """
+    Render jobs and their frame-range tasks in one SQLite file on shared storage.
+
+    A worker claims a task by taking a lease on it inside a write transaction,
+    so two workers never hold the same task. The lease is renewed while the
+    task renders; when a worker crashes its lease runs out and the task goes
+    back to the next claimant. A task that fails max_attempts times is marked
+    failed and fails its job: the job's other tasks are no longer handed out
+    until it is submitted again. Jobs are served in the order they were
+    first submitted.
+
+    The database uses SQLite's default rollback journal rather than WAL,
+    which only works when every process is on the same host. The shared
+    storage needs working file locks, and the nodes' clocks must agree to
+    well within the lease time.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode, so each write below controls its own transaction
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.executescript(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                spec TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                job_id TEXT NOT NULL,
+                task_index INTEGER NOT NULL,
+                start_frame INTEGER NOT NULL,
+                end_frame INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (job_id, task_index)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, lease_expires);"""
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def submit(self, job_id, spec, ranges):
+        """
+        Add a job and one task per frame range.
+
+        Submitting a job that is already queued keeps its tasks (and its
+        finished segments), so a restarted coordinator resumes the job. A
+        failed job is queued again with its failed tasks reset, so rerunning
+        the coordinator retries it.
+
+        Returns:
+            bool: True if the job is new.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                if row[0] == "failed":
+                    self.connection.execute(
+                        "UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL, attempts = 0, error = NULL "
+                        "WHERE job_id = ? AND status = 'failed'",
+                        (job_id,),
+                    )
+                    self.connection.execute("UPDATE jobs SET status = 'queued' WHERE job_id = ?", (job_id,))
+                return False
+            self.connection.execute("INSERT INTO jobs VALUES (?, ?, 'queued', ?)", (job_id, json.dumps(spec), time.time()))
+            self.connection.executemany(
+                "INSERT INTO tasks (job_id, task_index, start_frame, end_frame, status) VALUES (?, ?, ?, ?, 'pending')",
+                [(job_id, index, start, end) for index, (start, end) in enumerate(ranges)],
+            )
+        return True
+
+    def spec(self, job_id):
+        """Return the render settings a job was submitted with."""
+        return json.loads(self.connection.execute("SELECT spec FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0])
+
+    def claim(self, worker, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        """
+        Lease the next runnable task: a pending one, or one whose lease ran out.
+
+        Returns:
+            dict: The task ({"job_id", "task_index", "start_frame", "end_frame", "attempts"}), or None.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            # Tasks whose worker died too often are given up on, and with them their jobs
+            self.connection.execute(
+                "UPDATE tasks SET status = 'failed', worker = NULL, error = COALESCE(error, 'lease expired') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, max_attempts),
+            )
+            self._fail_jobs()
+            row = self.connection.execute(
+                "SELECT tasks.job_id, task_index, start_frame, end_frame, attempts FROM tasks JOIN jobs USING (job_id) "
+                "WHERE jobs.status = 'queued' AND (tasks.status = 'pending' OR (tasks.status = 'leased' AND lease_expires < ?)) "
+                "ORDER BY jobs.created, task_index LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND task_index = ?",
+                (worker, now + lease_seconds, row[0], row[1]),
+            )
+        return {"job_id": row[0], "task_index": row[1], "start_frame": row[2], "end_frame": row[3], "attempts": row[4] + 1}
+
+    def renew(self, task, worker, lease_seconds=LEASE_SECONDS):
+        """Extend a lease. Returns False if the worker no longer holds it."""
+        cursor = self.connection.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE job_id = ? AND task_index = ? AND worker = ? AND status = 'leased'",
+            (time.time() + lease_seconds, task["job_id"], task["task_index"], worker),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, task, worker, publish):
+        """
+        Mark a task done if the worker still holds its lease.
+
+        publish() moves the finished segment into place; it runs inside the
+        same transaction, so a segment is only published by the lease holder.
+
+        Returns:
+            bool: False if the lease was lost to another worker.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            cursor = self.connection.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = NULL, error = NULL "
+                "WHERE job_id = ? AND task_index = ? AND worker = ? AND status = 'leased'",
+                (task["job_id"], task["task_index"], worker),
+            )
+            if cursor.rowcount != 1:
+                return False
+            publish()
+        return True
+
+    def fail(self, task, worker, error, max_attempts=MAX_ATTEMPTS):
+        """Give a task back after an error, or mark it (and its job) failed once it is out of attempts."""
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_expires = NULL, error = ? "
+                "WHERE job_id = ? AND task_index = ? AND worker = ? AND status = 'leased'",
+                (max_attempts, error, task["job_id"], task["task_index"], worker),
+            )
+            self._fail_jobs()
+
+    def _fail_jobs(self):
+        """Mark queued jobs with a failed task as failed (inside the caller's transaction)."""
+        self.connection.execute(
+            "UPDATE jobs SET status = 'failed' WHERE status = 'queued' "
+            "AND job_id IN (SELECT job_id FROM tasks WHERE status = 'failed')"
+        )
+
+    def progress(self, job_id):
+        """Return {status: task count} for a job."""
+        rows = self.connection.execute("SELECT status, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY status", (job_id,))
+        return dict(rows.fetchall())
+
+    def errors(self, job_id):
+        """Return (task_index, error) for the failed tasks of a job."""
+        return self.connection.execute(
+            "SELECT task_index, error FROM tasks WHERE job_id = ? AND status = 'failed' ORDER BY task_index", (job_id,)
+        ).fetchall()
+
+    def unfinished(self):
+        """Number of tasks of queued jobs that are still pending or leased."""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM tasks JOIN jobs USING (job_id) WHERE jobs.status = 'queued' AND tasks.status IN ('pending', 'leased')"
+        ).fetchone()[0]
+
+    def set_job_status(self, job_id, status):
+        self.connection.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+
+def _file_signature(path):
+    """Size and modification time of an input file, so a job is resubmitted when its inputs change."""
+    if not isinstance(path, str) or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def job_id_for(spec):
+    """Derive a job ID from its settings and the state of its input files."""
+    inputs = {key: value for key, value in spec.items() if key != "blink_seed"}
+    inputs["files"] = {key: _file_signature(spec.get(key)) for key in ("viseme_data", "pose_data", "captions", "bundle")}
+    inputs["files"]["assets"] = file_signatures([spec.get(key) for key in ("image_directory", "head_image_path", "blink_image_path",
+                                                                           "pose_folder", "background_path")])
+    digest = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{os.path.splitext(os.path.basename(spec['output_video']))[0]}-{digest}"
+
+def job_dir(spec, job_id):
+    """Directory on shared storage holding a job's segments."""
+    return os.path.join(spec["farm_dir"], "jobs", job_id)
+
+def segment_path(spec, job_id, task_index):
+    return os.path.join(job_dir(spec, job_id), f"segment_{task_index:05d}.mkv")
+
+def make_job_spec(viseme_data, image_directory, output_video, fps, resolution, head_image_path, blink_image_path, pose_folder,
+                  pose_data, background_path, audio_file=None, encoder_profile="balanced", captions=None,
+                  motion=False, bundle=None, segment_frames=300, farm_dir=DEFAULT_FARM_DIR):
+    """
+    Collect everything a worker needs to render part of a clip.
+
+    Every path must be reachable from every node (shared storage), and the
+    viseme and pose data must be files (.npz or .json) rather than in-memory
+    timelines. The blink seed is part of the job so all workers draw the same blinks.
+    With bundle (a compiled asset bundle), workers map its sprites instead of
+    decoding the images, and those on one node share its pages.
+    """
+    return {
+        "viseme_data": os.path.abspath(viseme_data),
+        "pose_data": os.path.abspath(pose_data),
+        "image_directory": image_directory,
+        "head_image_path": head_image_path,
+        "blink_image_path": blink_image_path,
+        "pose_folder": pose_folder,
+        "background_path": background_path,
+        "resolution": list(resolution),
+        "fps": fps,
+        "encoder_profile": encoder_profile,
+        "audio_file": audio_file,
+        "captions": os.path.abspath(captions) if captions else None,
+        "motion": motion,
+        "bundle": os.path.abspath(bundle) if bundle else None,
+        "output_video": os.path.abspath(output_video),
+        "segment_frames": segment_frames,
+        "farm_dir": os.path.abspath(farm_dir),
+        "blink_seed": random.randrange(2 ** 32),
+    }
+
+def submit_job(queue, spec):
+    """Split a clip into frame-range tasks and queue them. Returns the job ID."""
+    viseme_data = as_timeline(load_viseme_data(spec["viseme_data"]), "viseme")
+    total_frames = frame_count(viseme_data.end_time, spec["fps"])
+    ranges = segment_ranges(total_frames, spec["segment_frames"])
+    job_id = job_id_for(spec)
+    os.makedirs(job_dir(spec, job_id), exist_ok=True)
+    if queue.submit(job_id, spec, ranges):
+        print(f"Queued job {job_id}: {total_frames} frames in {len(ranges)} tasks.")
+    else:
+        print(f"Job {job_id} is already queued; resuming it.")
+    return job_id
+
+def wait_for_job(queue, job_id, poll_seconds=2.0):
+    """Block until every task of a job is done. Raises if any task failed for good."""
+    last = None
+    while True:
+        progress = queue.progress(job_id)
+        if progress.get("failed"):
+            queue.set_job_status(job_id, "failed")
+            # The last line of each traceback names the error
+            details = "; ".join(f"task {index}: {(error or 'unknown error').strip().splitlines()[-1]}" for index, error in queue.errors(job_id))
+            raise RuntimeError(f"Render job {job_id} failed ({details})")
+        if progress != last:
+            print(f"Job {job_id}: " + ", ".join(f"{count_} {status}" for status, count_ in sorted(progress.items())))
+            last = progress
+        if set(progress) == {"done"}:
+            return
+        time.sleep(poll_seconds)
+
+def finalize_job(queue, job_id):
+    """Concatenate a finished job's lossless segments into the output, encoding it once with the job's profile."""
+    spec = queue.spec(job_id)
+    profile = get_encoder_profile(spec["encoder_profile"])
+    output_video = spec["output_video"]
+    extension = profile.get("extension", ".mp4")
+    if not output_video.endswith(extension):
+        output_video = os.path.splitext(output_video)[0] + extension
+    segment_files = [segment_path(spec, job_id, index) for index in range(sum(queue.progress(job_id).values()))]
+    with span("farm_concat", job=job_id, segments=len(segment_files)):
+        concat_segments(segment_files, output_video, spec["audio_file"], transcode_args=video_codec_args(profile),
+                        audio_codec=profile.get("audio_codec", "aac"))
+    queue.set_job_status(job_id, "done")
+    print(f"Video saved to {output_video}")
+    return output_video
+
+def load_job_context(spec):
+    """Load the timelines and assets of a job and resolve its per-frame states once per worker."""
+    viseme_data = as_timeline(load_viseme_data(spec["viseme_data"]), "viseme")
+    pose_data = as_timeline(load_pose_data(spec["pose_data"]), "pose")
+    profile = get_encoder_profile(spec["encoder_profile"])
+    alpha = profile.get("alpha", False)
+    resolution = tuple(spec["resolution"])
+    if spec.get("bundle"):
+        assets = load_bundle_assets(spec["bundle"], alpha=alpha, motion=spec.get("motion", False))
+    else:
+        assets = load_render_assets(viseme_data, spec["image_directory"], spec["head_image_path"], spec["blink_image_path"],
+                                    spec["pose_folder"], pose_data, None if alpha else spec["background_path"], resolution, alpha=alpha,
+                                    motion=spec.get("motion", False))
+    frame_size = assets["base_frame"].get_size()
+    if spec.get("captions"):
+        assets["captions"] = CaptionTrack(load_caption_words(spec["captions"]), frame_size, full_resolution=resolution)
+    total_duration = viseme_data.end_time
+    total_frames = frame_count(total_duration, spec["fps"])
+    blinks = generate_blinks(total_duration, random.Random(spec["blink_seed"]))
+    states = resolve_frame_states(viseme_data, pose_data, blinks, total_frames, spec["fps"], assets.get("captions"), assets.get("motion"))
+    return {"visemes": viseme_data, "poses": pose_data, "blinks": blinks, "assets": assets, "states": states,
+            "frame_size": frame_size, "alpha": alpha}
+
+def _keep_lease(queue_path, task, worker, lease_seconds, stop, lost):
+    """Heartbeat thread: renew a lease until the task finishes. Uses its own connection, as SQLite requires."""
+    queue = JobQueue(queue_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not queue.renew(task, worker, lease_seconds):
+                lost.set()
+                return
+    finally:
+        queue.close()
+
+def render_task(queue_path, task, worker, context, spec, lease_seconds):
+    """Render and losslessly encode one frame range to a partial file, holding the lease meanwhile. Returns the partial path."""
+    final_path = segment_path(spec, task["job_id"], task["task_index"])
+    partial_path = f"{os.path.splitext(final_path)[0]}.{worker.replace(':', '-')}.partial.mkv"
+    stop, lost = threading.Event(), threading.Event()
+    heartbeat = threading.Thread(target=_keep_lease, args=(queue_path, task, worker, lease_seconds, stop, lost), daemon=True)
+    heartbeat.start()
+    try:
+        command = build_lossless_command(spec["fps"], context["frame_size"], partial_path, alpha=context["alpha"])
+        encoder = open_encoder(command)
+        with span("farm_task", job=task["job_id"], task=task["task_index"]):
+            render_frame_range(task["start_frame"], task["end_frame"], spec["fps"], context["visemes"], context["poses"],
+                               context["blinks"], context["assets"], encoder, states=context["states"],
+                               desc=f"{worker} task {task['task_index']}")
+        close_encoder(encoder, command)
+    finally:
+        stop.set()
+        heartbeat.join()
+    if lost.is_set():
+        print(f"{worker} lost the lease on task {task['task_index']} of {task['job_id']}")
+    return partial_path
+
+def run_worker(queue_path, worker=None, lease_seconds=LEASE_SECONDS, poll_seconds=2.0, exit_when_idle=False):
+    """
+    Claim and render tasks until stopped.
+
+    Args:
+        queue_path (str): The job queue on shared storage.
+        worker (str): Worker name recorded on its leases (default: host:pid).
+        lease_seconds (float): How long a lease lasts without renewal; a
+            crashed worker's task is handed out again after this long.
+        poll_seconds (float): Wait between claims when there is no work.
+        exit_when_idle (bool): Return once no task is pending or leased.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(queue_path)
+    contexts = {}
+    rendered = 0
+    try:
+        while True:
+            task = queue.claim(worker, lease_seconds)
+            if task is None:
+                if exit_when_idle and not queue.unfinished():
+                    break
+                time.sleep(poll_seconds)
+                continue
+            job_id = task["job_id"]
+            spec = queue.spec(job_id)
+            try:
+                if job_id not in contexts:
+                    contexts = {job_id: load_job_context(spec)}  # Keep only the current job's assets
+                partial_path = render_task(queue_path, task, worker, contexts[job_id], spec, lease_seconds)
+            except Exception:
+                print(f"{worker} failed task {task['task_index']} of {job_id} (attempt {task['attempts']})")
+                queue.fail(task, worker, traceback.format_exc())
+                count("farm_tasks_failed")
+                continue
+            final_path = segment_path(spec, job_id, task["task_index"])
+            if queue.complete(task, worker, lambda: os.replace(partial_path, final_path)):
+                rendered += 1
+                count("farm_tasks_rendered")
+            elif os.path.exists(partial_path):
+                os.remove(partial_path)  # Another worker took the task over; its copy wins
+    finally:
+        queue.close()
+    print(f"{worker} rendered {rendered} tasks.")
+    return rendered
+
+def run_coordinator(spec, queue_path, poll_seconds=2.0):
+    """Queue a clip, wait for the workers to render it and concatenate the result."""
+    queue = JobQueue(queue_path)
+    try:
+        job_id = submit_job(queue, spec)
+        wait_for_job(queue, job_id, poll_seconds)
+        return finalize_job(queue, job_id)
+    finally:
+        queue.close()
+
+def render_local_farm(spec, queue_path, workers=None, lease_seconds=LEASE_SECONDS, poll_seconds=0.5):
+    """
+    Run a coordinator and several worker processes on this machine.
+
+    The same queue, leases and concat as a multi-node farm, which makes it
+    the way to try a farm setup on one box.
+    """
+    workers = workers or os.cpu_count()
+    queue = JobQueue(queue_path)
+    try:
+        job_id = submit_job(queue, spec)
+    finally:
+        queue.close()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(queue_path, f"{socket.gethostname()}:local{index}"),
+                                kwargs={"lease_seconds": lease_seconds, "poll_seconds": poll_seconds, "exit_when_idle": True})
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        queue = JobQueue(queue_path)
+        try:
+            wait_for_job(queue, job_id, poll_seconds)
+            output_video = finalize_job(queue, job_id)
+        finally:
+            queue.close()
+    finally:
+        for process in processes:
+            process.join(timeout=poll_seconds * 4)
+            if process.is_alive():
+                process.terminate()
+    return output_video
+
+if __name__ == "__main__":
+    farm_dir = "/Users/nervous/Documents/GitHub/speech-aligner/farm"
+    queue_path = os.path.join(farm_dir, QUEUE_NAME)
+    spec = make_job_spec(
+        viseme_data="/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data_smoothed.npz",
+        image_directory="/Users/nervous/Documents/GitHub/speech-aligner/assets/new_visemes",
+        output_video="/Users/nervous/Documents/GitHub/speech-aligner/output/farm_output_with_audio.mp4",
+        fps=30,
+        resolution=(1080, 1920),
+        head_image_path="/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_body.png",
+        blink_image_path="/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_blink.png",
+        pose_folder="/Users/nervous/Documents/GitHub/speech-aligner/assets/pose",
+        pose_data="/Users/nervous/Documents/GitHub/speech-aligner/output/pose_data.npz",
+        background_path="/Users/nervous/Documents/GitHub/speech-aligner/assets/background/background.png",
+        audio_file="/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav",
+        farm_dir=farm_dir,
+    )
+
+    # Coordinator and four workers on this machine; on a real farm run
+    # run_coordinator(spec, queue_path) on one node and run_worker(queue_path) on the others
+    render_local_farm(spec, queue_path, workers=4)
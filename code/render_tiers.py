@@ -0,0 +1,101 @@
+import hashlib
+import os
+
+import pygame
+from instrumentation import traced, count
+
+# Output resolution of the final render; every tier is a fraction of it
+BASE_RESOLUTION = (1320, 2868)
+
+RENDER_TIERS = {
+    # Quarter resolution drafts for checking timing and poses
+    "proxy": {"scale": 0.25, "encoder_profile": "draft"},
+    "final": {"scale": 1.0, "encoder_profile": "final"},
+}
+
+def tier_resolution(tier, base_resolution=BASE_RESOLUTION):
+    """Return the frame size for a tier, rounded down to even numbers for yuv420p."""
+    scale = RENDER_TIERS[tier]["scale"]
+    return tuple(max(2, int(side * scale) // 2 * 2) for side in base_resolution)
+
+def scale_image(image, size=None, scale=1.0):
+    """Scale a surface to `size` if given, otherwise by the `scale` factor."""
+    if size is None:
+        size = (max(1, round(image.get_width() * scale)), max(1, round(image.get_height() * scale)))
+    if image.get_size() == size:
+        return image
+    if image.get_bitsize() >= 24:
+        return pygame.transform.smoothscale(image, size)
+    return pygame.transform.scale(image, size)  # smoothscale needs 24/32-bit images
+
+def cache_scaled_image(source_path, output_path, size=None, scale=1.0):
+    """
+    Scale an image and save it, unless a fresh copy already exists.
+
+    The image is scaled to `size` if given, otherwise by the `scale` factor.
+    A cached file is considered fresh when it is newer than its source.
+    """
+    if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(source_path):
+        count("tier_cache_hits")
+        return output_path
+    count("tier_cache_misses")
+    image = scale_image(pygame.image.load(source_path), size, scale)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    pygame.image.save(image, output_path)
+    return output_path
+
+def _cache_subdir(cache_dir, tier, resolution, source_path):
+    """Return the cache directory for one source file or folder."""
+    source_key = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:10]
+    return os.path.join(cache_dir, f"{tier}-{resolution[0]}x{resolution[1]}", source_key)
+
+@traced()
+def prepare_tier_assets(tier, cache_dir, image_directory, pose_folder, head_image_path, blink_image_path, background_path, base_resolution=BASE_RESOLUTION):
+    """
+    Pre-scale every asset for a render tier once and cache the results on disk.
+
+    The background is scaled to the tier's frame size. Sprites keep their size
+    relative to the final render, so they are scaled by the tier's factor.
+    Folders (visemes, poses) are mirrored file by file so renderers can keep
+    looking images up by name.
+
+    Returns:
+        dict: Asset paths to pass to the renderer ("image_directory",
+            "pose_folder", "head_image_path", "blink_image_path",
+            "background_path") plus the tier's "resolution".
+    """
+    resolution = tier_resolution(tier, base_resolution)
+    scale = resolution[0] / base_resolution[0]
+    assets = {"resolution": resolution, "background_path": None}
+    if background_path:  # None for alpha renders, which have no background to scale
+        background_dir = _cache_subdir(cache_dir, tier, resolution, background_path)
+        assets["background_path"] = cache_scaled_image(
+            background_path, os.path.join(background_dir, os.path.basename(background_path)), resolution
+        )
+
+    if scale == 1.0:
+        # Sprites are drawn at native size in the final tier, so there is nothing to cache
+        assets.update({
+            "image_directory": image_directory,
+            "pose_folder": pose_folder,
+            "head_image_path": head_image_path,
+            "blink_image_path": blink_image_path,
+        })
+        return assets
+
+    for key, image_path in (("head_image_path", head_image_path), ("blink_image_path", blink_image_path)):
+        output_dir = _cache_subdir(cache_dir, tier, resolution, image_path)
+        assets[key] = cache_scaled_image(
+            image_path, os.path.join(output_dir, os.path.basename(image_path)), scale=scale
+        )
+
+    for key, folder in (("image_directory", image_directory), ("pose_folder", pose_folder)):
+        output_dir = _cache_subdir(cache_dir, tier, resolution, folder)
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(".png"):
+                source_path = os.path.join(folder, name)
+                cache_scaled_image(source_path, os.path.join(output_dir, name), scale=scale)
+        assets[key] = output_dir
+
+    print(f"Assets for the '{tier}' tier ({resolution[0]}x{resolution[1]}) are cached in {cache_dir}")
+    return assets
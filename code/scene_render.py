@@ -0,0 +1,280 @@
+import os
+import random
+
+import numpy as np
+import pygame
+from tqdm import tqdm
+
+from animate_poses import generate_blinks
+from compositor import DirtyRectCompositor
+from encoder_profiles import get_encoder_profile, build_encode_command, open_encoder, close_encoder
+from frame_grid import frame_count, event_index_per_frame
+from instrumentation import span, traced, count, profile_block
+from render_tiers import BASE_RESOLUTION
+from texture_atlas import TextureAtlas
+from timeline_store import as_timeline, load_timeline
+
+# Per-character layers, drawn in this order (the same order as the single-character renderer)
+CHARACTER_LAYERS = ["mouth", "pose", "blink"]
+
+def _load_character_timeline(data, kind):
+    """Accept a timeline path, a Timeline or the list-of-dicts format."""
+    if data is None:
+        return None
+    if isinstance(data, str):
+        return load_timeline(data, kind)
+    return as_timeline(data, kind)
+
+def _queue_folder(atlas, folder, scale):
+    """Queue every PNG in a folder; return {file name: atlas key}."""
+    if not folder or not os.path.isdir(folder):
+        return {}
+    return {
+        name: atlas.add(os.path.join(folder, name), scale)
+        for name in sorted(os.listdir(folder)) if name.lower().endswith(".png")
+    }
+
+@traced()
+def build_scene_assets(characters, background_path, resolution, base_resolution=BASE_RESOLUTION):
+    """
+    Load every character's sprites into one atlas and draw the base frame.
+
+    Args:
+        characters (list): Character definitions, each a dict with
+            "name", "body", "blink", "viseme_dir", optional "pose_dir",
+            "position" (top-left of the body at base resolution), optional
+            "scale", optional "viseme_aliases" ({mouth shape: file name}
+            for rigs whose files are named differently) and optional
+            "layer_offsets" ({"mouth" or "pose": (dx, dy)} at base
+            resolution, for rigs whose mouth is not at the body's center).
+        background_path (str): Background image, scaled to the frame size.
+        resolution (tuple): Output frame size.
+        base_resolution (tuple): Resolution the character positions are given in.
+
+    Returns:
+        dict: "atlas", "base_frame" and per-character "characters" entries
+            with their sprite keys and anchor positions.
+    """
+    pygame.init()
+    frame_scale = resolution[0] / base_resolution[0]
+    atlas = TextureAtlas()
+
+    queued = []
+    for character in characters:
+        scale = character.get("scale", 1.0) * frame_scale
+        visemes = _queue_folder(atlas, character["viseme_dir"], scale)
+        for mouth_shape, file_name in character.get("viseme_aliases", {}).items():
+            if file_name in visemes:
+                visemes[mouth_shape] = visemes[file_name]
+        if "neutral.png" in visemes:
+            visemes.setdefault("neutral", visemes["neutral.png"])
+        if "neutral" not in visemes:
+            raise FileNotFoundError(f"Neutral viseme ('neutral.png') not found for character '{character['name']}'")
+        poses = _queue_folder(atlas, character.get("pose_dir"), scale)
+        position = tuple(round(value * frame_scale) for value in character["position"])
+        if "neutralpose.png" in poses:
+            poses["neutralpose"] = poses["neutralpose.png"]
+        queued.append({
+            "name": character["name"],
+            "body": atlas.add(character["body"], scale),
+            "blink": atlas.add(character["blink"], scale),
+            "visemes": visemes,
+            "poses": poses,
+            "position": position,
+            "anchors": {
+                layer: (position[0] + round(dx * frame_scale), position[1] + round(dy * frame_scale))
+                for layer, (dx, dy) in {"mouth": (0, 0), "pose": (0, 0), **character.get("layer_offsets", {})}.items()
+            },
+        })
+    atlas.pack()
+
+    base_frame = pygame.Surface(resolution)
+    background = pygame.image.load(background_path)
+    if background.get_size() != resolution:
+        background = pygame.transform.scale(background, resolution)
+    base_frame.blit(background, (0, 0))
+    for character in queued:
+        body = atlas.regions[character["body"]]
+        offset = body["offset"]
+        base_frame.blit(atlas.surface, (character["position"][0] + offset[0], character["position"][1] + offset[1]), area=body["area"])
+
+    return {"atlas": atlas, "base_frame": base_frame, "characters": queued}
+
+class SpriteTable:
+    """
+    Scene-wide sprite index.
+
+    Every (character, layer, sprite) placement gets one integer ID, so the
+    per-frame state of every layer is a plain int32 array and layer changes
+    can be found with vectorized comparisons.
+    """
+
+    def __init__(self, atlas):
+        self.atlas = atlas
+        self.layers = []  # sprite ID -> (atlas surface, position, area)
+        self._ids = {}
+
+    def sprite_id(self, key, anchor, centered_on=None):
+        """Return the ID of an atlas sprite drawn at `anchor` (or centered on the `centered_on` sprite there)."""
+        cache_key = (key, anchor, centered_on)
+        if cache_key not in self._ids:
+            region = self.atlas.regions[key]
+            x, y = anchor
+            if centered_on is not None:
+                body_size = self.atlas.regions[centered_on]["size"]
+                x += body_size[0] // 2 - region["size"][0] // 2
+                y += body_size[1] // 2 - region["size"][1] // 2
+            position = (x + region["offset"][0], y + region["offset"][1])
+            self._ids[cache_key] = len(self.layers)
+            self.layers.append((self.atlas.surface, position, region["area"]))
+        return self._ids[cache_key]
+
+def timeline_frame_states(timeline, total_frames, fps, symbol_sprite_ids, default_id=-1):
+    """
+    Resolve a timeline to the sprite shown on every frame, without a per-frame Python loop.
+
+    Args:
+        timeline (Timeline): Viseme or pose timeline.
+        symbol_sprite_ids (np.ndarray): Sprite ID for each of the timeline's symbol IDs (-1 to fall back to default).
+        default_id (int): Sprite shown between events (-1 hides the layer).
+
+    Returns:
+        np.ndarray: int32 sprite ID per frame.
+    """
+    if timeline is None or not len(timeline):
+        return np.full(total_frames, default_id, dtype=np.int32)
+    index = event_index_per_frame(timeline.start, timeline.end, total_frames, fps)
+    states = np.where(index >= 0, symbol_sprite_ids[timeline.symbol_ids[np.maximum(index, 0)]], -1).astype(np.int32)
+    states[states < 0] = default_id
+    return states
+
+def change_events(slot_states):
+    """
+    Merge the per-frame states of every layer slot into one sorted list of changes.
+
+    Args:
+        slot_states (list): int32 state array per slot, all the same length.
+
+    Returns:
+        tuple: (frames, slots, sprite IDs) arrays sorted by frame, holding
+            only the frames where a slot's sprite changes (plus frame 0).
+    """
+    frames, slots, sprites = [], [], []
+    for slot, states in enumerate(slot_states):
+        changed = np.concatenate(([0], np.nonzero(states[1:] != states[:-1])[0] + 1)) if len(states) else np.empty(0, dtype=np.int64)
+        frames.append(changed)
+        slots.append(np.full(len(changed), slot, dtype=np.int32))
+        sprites.append(states[changed])
+    frames = np.concatenate(frames)
+    order = np.argsort(frames, kind="stable")
+    return frames[order], np.concatenate(slots)[order], np.concatenate(sprites)[order]
+
+def render_scene(characters, background_path, output_video, fps, resolution, audio_file=None, encoder_profile="balanced", base_resolution=BASE_RESOLUTION, seed=None):
+    """
+    Render a dialogue scene with several lip-synced characters.
+
+    Each character dict (see build_scene_assets) also gives its own
+    "viseme_data" and optional "pose_data" (paths, Timelines or lists of
+    dicts), e.g. one speaker-separated track per character. All timelines are
+    resolved to per-frame sprite states up front; the render loop then only
+    visits the layers that change on each frame, so a quiet character costs
+    nothing.
+    """
+    assets = build_scene_assets(characters, background_path, resolution, base_resolution)
+    sprites = SpriteTable(assets["atlas"])
+    rng = random.Random(seed)
+
+    timelines = [
+        (_load_character_timeline(character["viseme_data"], "viseme"), _load_character_timeline(character.get("pose_data"), "pose"))
+        for character in characters
+    ]
+    total_duration = max(viseme_timeline.end_time for viseme_timeline, _ in timelines)
+    total_frames = frame_count(total_duration, fps)
+
+    layer_order = []
+    slot_states = []
+    with span("resolve_frame_states", characters=len(characters), frames=total_frames):
+        for character, (viseme_timeline, pose_timeline) in zip(assets["characters"], timelines):
+            anchors = character["anchors"]
+            body = character["body"]
+
+            def sprite_lookup(symbols, images, anchor):
+                ids = [sprites.sprite_id(images[symbol], anchor, centered_on=body) if symbol in images else -1 for symbol in symbols]
+                return np.array(ids + [-1], dtype=np.int32)  # Never empty, so indexing works for empty timelines
+
+            visemes = character["visemes"]
+            mouth_default = sprites.sprite_id(visemes["neutral"], anchors["mouth"], centered_on=body)
+            mouth_ids = sprite_lookup(viseme_timeline.symbols, visemes, anchors["mouth"])
+            mouth = timeline_frame_states(viseme_timeline, total_frames, fps, mouth_ids, mouth_default)
+
+            poses = character["poses"]
+            pose_default = sprites.sprite_id(poses["neutralpose"], anchors["pose"], centered_on=body) if "neutralpose" in poses else -1
+            pose_ids = sprite_lookup(pose_timeline.symbols if pose_timeline is not None else [], poses, anchors["pose"])
+            pose = timeline_frame_states(pose_timeline, total_frames, fps, pose_ids, pose_default)
+
+            # Each character blinks on its own schedule
+            blink_times = np.array(generate_blinks(total_duration, rng), dtype=np.float64).reshape(-1, 2)
+            blinking = event_index_per_frame(blink_times[:, 0], blink_times[:, 1], total_frames, fps) >= 0
+            blink = np.where(blinking, sprites.sprite_id(character["blink"], character["position"]), -1).astype(np.int32)
+
+            for name, states in zip(CHARACTER_LAYERS, (mouth, pose, blink)):
+                layer_order.append(f"{character['name']}.{name}")
+                slot_states.append(states)
+
+        event_frames, event_slots, event_sprites = change_events(slot_states)
+    print(f"{len(event_frames)} layer changes across {total_frames} frames and {len(characters)} characters")
+
+    profile = get_encoder_profile(encoder_profile)
+    ffmpeg_command = build_encode_command(profile, fps, resolution, output_video, audio_file)
+    encoder = open_encoder(ffmpeg_command)
+    compositor = DirtyRectCompositor(assets["base_frame"], layer_order)
+    # Where each frame's changes start in the sorted event arrays
+    frame_offsets = np.searchsorted(event_frames, np.arange(total_frames + 1))
+
+    with span("render_scene_frames", frames=total_frames, layers=len(layer_order)), profile_block("scene_render_loop"):
+        for frame_number in tqdm(range(total_frames), desc="Rendering Scene"):
+            first, last = frame_offsets[frame_number], frame_offsets[frame_number + 1]
+            changes = {
+                layer_order[slot]: sprites.layers[sprite] if sprite >= 0 else None
+                for slot, sprite in zip(event_slots[first:last].tolist(), event_sprites[first:last].tolist())
+            }
+            compositor.apply(changes)
+            try:
+                encoder.stdin.write(compositor.raw_frame())
+            except BrokenPipeError:
+                break  # ffmpeg exited early; close_encoder reports the error
+    close_encoder(encoder, ffmpeg_command)
+    count("frames_rendered", compositor.frames_composited)
+    count("dirty_pixels", compositor.dirty_pixels)
+    print(f"Redrew {compositor.dirty_fraction():.1%} of each frame on average.")
+    print(f"Video saved to {output_video}")
+    return compositor
+
+if __name__ == "__main__":
+    assets_dir = "/Users/nervous/Documents/GitHub/speech-aligner/assets"
+    output_dir = "/Users/nervous/Documents/GitHub/speech-aligner/output"
+    characters = [
+        {
+            "name": "norris",
+            "body": os.path.join(assets_dir, "other/norris_body.png"),
+            "blink": os.path.join(assets_dir, "other/norris_blink.png"),
+            "viseme_dir": os.path.join(assets_dir, "new_visemes"),
+            "pose_dir": os.path.join(assets_dir, "pose"),
+            "position": (30, 1900),
+            "viseme_data": os.path.join(output_dir, "speaker_0/viseme_data_smoothed.npz"),
+            "pose_data": os.path.join(output_dir, "pose_data.npz"),
+        },
+        {
+            "name": "other",
+            "body": os.path.join(assets_dir, "other/body.png"),
+            "blink": os.path.join(assets_dir, "other/blink.png"),
+            "viseme_dir": os.path.join(assets_dir, "visemes"),
+            "position": (780, 1850),
+            "viseme_data": os.path.join(output_dir, "speaker_1/viseme_data_smoothed.npz"),
+        },
+    ]
+    background_path = os.path.join(assets_dir, "background/background.png")
+    audio_file = os.path.join(output_dir, "output_audio.wav")
+    output_video = os.path.join(output_dir, "scene_output_with_audio.mp4")
+    fps = 30
+    render_scene(characters, background_path, output_video, fps, BASE_RESOLUTION, audio_file=audio_file, encoder_profile="final")
@@ -0,0 +1,477 @@
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+# Only the standard library is imported up here. Every stage module (and with it
+# numpy, pygame, pydub, torch or whisper) is imported inside its subcommand, so
+# `--help` and the light stages never pay for the heavy ones.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR = os.path.join(REPO_DIR, "output")
+ASSETS_DIR = os.path.join(REPO_DIR, "assets")
+
+# Modules each subcommand imports; `startup` and --import-only use the same table
+STAGE_MODULES = {
+    "convert": ["audio_conversion"],
+    "transcribe": ["transcript-from-wav"],
+    "words": ["create-word-data"],
+    "backends": ["transcription_backends"],
+    "diarize": ["diarization"],
+    "phonemes": ["phoneme_mapping"],
+    "visemes": ["viseme_mapping"],
+    "smooth": ["viseme_smoothing"],
+    "poses": ["pose_data"],
+    "render": ["animate_poses"],
+    "pipeline": ["streaming_pipeline"],
+    "farm": ["render_farm"],
+    "bundle": ["asset_bundle"],
+    "trace": ["instrumentation"],
+}
+# Stages that load an ML model or pygame, or do their signal processing in numpy,
+# and are not held to the startup budget
+HEAVY_STAGES = {"transcribe", "words", "backends", "diarize", "smooth", "render", "pipeline", "farm", "bundle"}
+STARTUP_BUDGET_MS = 100
+
+def stage(name):
+    """Import a stage module on first use (works for the hyphenated script names too)."""
+    return importlib.import_module(name)
+
+def output_path(filename):
+    return os.path.join(OUTPUT_DIR, filename)
+
+def default_visemes():
+    """The smoothed viseme timeline when `smooth` has been run, otherwise the raw one."""
+    smoothed = output_path("viseme_data_smoothed.npz")
+    return smoothed if os.path.exists(smoothed) else output_path("viseme_data.npz")
+
+def default_cmu_dict():
+    """The CMU dictionary shipped with pocketsphinx."""
+    from pocketsphinx import get_model_path
+    return os.path.join(get_model_path(), "en-us", "cmudict-en-us.dict")
+
+def cmd_convert(args):
+    stage("audio_conversion").convert_to_wav(args.input, args.output)
+
+def cmd_transcribe(args):
+    stage("transcript-from-wav").transcribe_and_save(args.audio, model_name=args.model, transcript_file=args.output,
+                                                     backend=args.backend, threads=args.threads)
+
+def cmd_words(args):
+    stage("create-word-data").create_word_data(args.audio, args.output, args.json, model_name=args.model,
+                                               backend=args.backend, threads=args.threads, beam_size=args.beam_size)
+
+def cmd_backends(args):
+    transcription_backends = stage("transcription_backends")
+    backends = args.backend or ["whisper-int8", "faster-whisper"]
+    report = transcription_backends.compare_backends(args.clips or transcription_backends.input_clips(), args.model,
+                                                     backends, threads=args.threads, beam_size=args.beam_size)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Comparison saved to {args.output}")
+
+def cmd_diarize(args):
+    diarization = stage("diarization")
+    timeline_store = stage("timeline_store")
+    word_timeline = diarization.diarize_words(args.audio, timeline_store.load_timeline(args.words, kind="word"),
+                                              args.speakers, args.max_speakers)
+    timeline_store.save_timeline(word_timeline, args.output or args.words)
+    if args.json:
+        timeline_store.export_json(word_timeline, args.json)
+
+def cmd_phonemes(args):
+    phoneme_mapping = stage("phoneme_mapping")
+    timeline_store = stage("timeline_store")
+    cmu_dict = phoneme_mapping.load_cmu_dict(args.cmu_dict or default_cmu_dict())
+    word_data = timeline_store.load_timeline(args.words, kind="word").to_records()
+    phoneme_data = phoneme_mapping.map_words_to_phonemes(word_data, cmu_dict)
+    phoneme_timeline = timeline_store.Timeline.from_records(phoneme_data, "phoneme")
+    timeline_store.save_timeline(phoneme_timeline, args.output)
+    if args.json:
+        timeline_store.export_json(phoneme_timeline, args.json)
+
+def cmd_visemes(args):
+    viseme_mapping = stage("viseme_mapping")
+    timeline_store = stage("timeline_store")
+    phoneme_data = timeline_store.load_timeline(args.phonemes, kind="phoneme").to_records()
+    viseme_data = viseme_mapping.map_phonemes_to_visemes(phoneme_data)
+    viseme_timeline = timeline_store.Timeline.from_records(viseme_data, "viseme")
+    timeline_store.save_timeline(viseme_timeline, args.output)
+    if args.json:
+        timeline_store.export_json(viseme_timeline, args.json)
+    viseme_mapping.save_speaker_timelines(viseme_timeline, os.path.dirname(os.path.abspath(args.output)))
+
+def cmd_smooth(args):
+    viseme_smoothing = stage("viseme_smoothing")
+    timeline_store = stage("timeline_store")
+    viseme_timeline = viseme_smoothing.smooth_visemes(timeline_store.load_timeline(args.visemes, kind="viseme"),
+                                                      args.fps, args.min_hold, args.blend)
+    timeline_store.save_timeline(viseme_timeline, args.output)
+    if args.json:
+        timeline_store.export_json(viseme_timeline, args.json)
+    stage("viseme_mapping").save_speaker_timelines(viseme_timeline, os.path.dirname(os.path.abspath(args.output)),
+                                                   os.path.basename(args.output))
+
+def cmd_poses(args):
+    pose_data_module = stage("pose_data")
+    transcript = pose_data_module.load_file(args.transcript)
+    words_timing = pose_data_module.load_file(args.words)
+    pose_data = pose_data_module.parse_transcript_with_poses(transcript, words_timing)
+    pose_data_module.save_pose_data(pose_data, args.output)
+    if args.json:
+        pose_data_module.save_pose_data(pose_data, args.json)
+
+def tier_or_bundle_assets(args, alpha):
+    """Asset paths and resolution for a render: from --bundle when given, otherwise the tier's pre-scaled images."""
+    if args.bundle:
+        resolution = stage("asset_bundle").AssetBundle(args.bundle).resolution
+        return {"resolution": resolution, "image_directory": None, "pose_folder": None, "head_image_path": None,
+                "blink_image_path": None, "background_path": None}
+    return stage("render_tiers").prepare_tier_assets(args.tier, args.tier_cache_dir, args.visemes_dir, args.pose_folder,
+                                                     args.head_image, args.blink_image, None if alpha else args.background)
+
+def cmd_render(args):
+    animate_poses = stage("animate_poses")
+    encoder_profile = args.profile or animate_poses.RENDER_TIERS[args.tier]["encoder_profile"]
+    alpha = animate_poses.get_encoder_profile(encoder_profile).get("alpha", False)
+    assets = tier_or_bundle_assets(args, alpha)
+    viseme_data = animate_poses.load_viseme_data(args.visemes)
+    pose_data = animate_poses.load_pose_data(args.poses)
+    animate_poses.render_animation_to_video(
+        viseme_data, assets["image_directory"], args.output, args.fps, assets["resolution"], args.temp_dir,
+        assets["head_image_path"], assets["blink_image_path"], assets["pose_folder"], pose_data, assets["background_path"],
+        audio_file=args.audio, encoder_profile=encoder_profile, checkpoint_dir=args.checkpoint_dir, captions=args.captions,
+        motion=args.motion, bundle=args.bundle,
+    )
+
+def cmd_pipeline(args):
+    streaming_pipeline = stage("streaming_pipeline")
+    render_tiers = stage("render_tiers")
+    encoder_profile = args.profile or render_tiers.RENDER_TIERS[args.tier]["encoder_profile"]
+    alpha = stage("encoder_profiles").get_encoder_profile(encoder_profile).get("alpha", False)
+    assets = render_tiers.prepare_tier_assets(args.tier, args.tier_cache_dir, args.visemes_dir, args.pose_folder,
+                                              args.head_image, args.blink_image, None if alpha else args.background)
+    streaming_pipeline.run_pipeline(
+        args.audio, args.output, args.cmu_dict or default_cmu_dict(), assets["image_directory"], assets["head_image_path"],
+        assets["blink_image_path"], assets["pose_folder"], assets["background_path"], assets["resolution"], args.fps,
+        pose_data=args.poses, model_name=args.model, backend=args.backend, threads=args.threads, beam_size=args.beam_size,
+        encoder_profile=encoder_profile, work_dir=args.work_dir, output_dir=OUTPUT_DIR, chunk_seconds=args.chunk_seconds,
+    )
+
+def cmd_farm(args):
+    render_farm = stage("render_farm")
+    queue_path = args.queue or os.path.join(args.farm_dir, render_farm.QUEUE_NAME)
+    if args.role == "worker":
+        render_farm.run_worker(queue_path, worker=args.worker_name, lease_seconds=args.lease_seconds, exit_when_idle=args.exit_when_idle)
+        return
+    encoder_profile = args.profile or stage("render_tiers").RENDER_TIERS[args.tier]["encoder_profile"]
+    alpha = stage("encoder_profiles").get_encoder_profile(encoder_profile).get("alpha", False)
+    assets = tier_or_bundle_assets(args, alpha)
+    spec = render_farm.make_job_spec(
+        args.visemes, assets["image_directory"], args.output, args.fps, assets["resolution"], assets["head_image_path"],
+        assets["blink_image_path"], assets["pose_folder"], args.poses, assets["background_path"], audio_file=args.audio,
+        encoder_profile=encoder_profile, captions=args.captions, motion=args.motion, bundle=args.bundle,
+        segment_frames=args.segment_frames,
+        farm_dir=args.farm_dir,
+    )
+    if args.role == "local":
+        render_farm.render_local_farm(spec, queue_path, workers=args.workers, lease_seconds=args.lease_seconds)
+    else:
+        render_farm.run_coordinator(spec, queue_path)
+
+def cmd_bundle(args):
+    asset_bundle = stage("asset_bundle")
+    if args.check:
+        import pygame
+        pygame.init()
+        errors, warnings, _ = asset_bundle.validate_character(asset_bundle.load_character(args.character))
+        for warning in warnings:
+            print(f"Warning: {warning}")
+        for error in errors:
+            print(f"Error: {error}")
+        if errors:
+            sys.exit(1)
+        print("Character is valid.")
+        return
+    try:
+        asset_bundle.compile_bundle(args.character, args.tier, args.output, force=args.force)
+    except ValueError as e:
+        sys.exit(str(e))
+
+def cmd_trace(args):
+    instrumentation = stage("instrumentation")
+    output_file = args.output or os.path.join(args.trace_dir, "chrome_trace.json")
+    print(instrumentation.summary_table(instrumentation.merge_traces(args.trace_dir, output_file)))
+
+def _time_command(command, runs):
+    """Return the best wall time of a command in milliseconds, or None if it fails (e.g. a missing dependency)."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        if subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _startup_runs(work_dir):
+    """
+    Write tiny inputs for the light stages and return the arguments of one real run of each.
+
+    Each run reads and writes actual files, so it pays every import the stage
+    needs (numpy for the timelines, pydub for convert) but almost no work.
+    """
+    audio_path = os.path.join(work_dir, "input.wav")
+    with wave.open(audio_path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\0\0" * 1600)
+    words_path = os.path.join(work_dir, "word_data.json")
+    phonemes_path = os.path.join(work_dir, "phoneme_data.json")
+    cmu_dict_path = os.path.join(work_dir, "cmudict.dict")
+    transcript_path = os.path.join(work_dir, "transcript_poses.txt")
+    with open(words_path, "w", encoding="utf-8") as f:
+        json.dump([{"word": "hi", "start_time": 0.0, "end_time": 0.1}], f)
+    with open(phonemes_path, "w", encoding="utf-8") as f:
+        json.dump([{"phoneme": "HH", "start_time": 0.0, "end_time": 0.05}, {"phoneme": "AY", "start_time": 0.05, "end_time": 0.1}], f)
+    with open(cmu_dict_path, "w", encoding="utf-8") as f:
+        f.write("hi HH AY1\n")
+    with open(transcript_path, "w", encoding="utf-8") as f:
+        f.write("hi\n")
+    output = lambda name: os.path.join(work_dir, name)
+    return {
+        "convert": ["convert", audio_path, "--output", output("converted.wav")],
+        "phonemes": ["phonemes", "--cmu-dict", cmu_dict_path, "--words", words_path, "--output", output("phoneme_data.npz")],
+        "visemes": ["visemes", "--phonemes", phonemes_path, "--output", output("viseme_data.npz")],
+        "poses": ["poses", "--transcript", transcript_path, "--words", words_path, "--output", output("pose_data.npz")],
+        "trace": ["trace", work_dir, "--output", output("chrome_trace.json")],
+    }
+
+def cmd_startup(args):
+    """
+    Measure startup time of every subcommand.
+
+    "cli" is the time to start Python, parse the arguments and reach the
+    subcommand (`<stage> --help`); "imports" adds importing the stage's
+    modules (`--import-only <stage>`). The light stages are held to
+    STARTUP_BUDGET_MS on "run": a real invocation on a tiny input, which
+    pays every import the stage needs. A stage that fails is reported as
+    failed.
+    """
+    script = os.path.abspath(__file__)
+    interpreter = _time_command([sys.executable, "-c", "pass"], args.runs)
+    print(f"Bare interpreter: {interpreter:.0f} ms (best of {args.runs})")
+    print(f"{'stage':<12}{'cli ms':>10}{'imports ms':>12}{'run ms':>10}  budget")
+    over_budget = []
+    format_ms = lambda ms, width: f"{ms:>{width}.0f}" if ms is not None else f"{'failed':>{width}}"
+    with tempfile.TemporaryDirectory() as work_dir:
+        runs = _startup_runs(work_dir)
+        for name in STAGE_MODULES:
+            cli_ms = _time_command([sys.executable, script, name, "--help"], args.runs)
+            import_ms = _time_command([sys.executable, script, "--import-only", name], args.runs)
+            if name in HEAVY_STAGES:
+                run_column, verdict = f"{'':>10}", "n/a (heavy)"
+            else:
+                run_ms = _time_command([sys.executable, script, *runs[name]], args.runs)
+                run_column = format_ms(run_ms, 10)
+                if run_ms is None:
+                    verdict = "failed"
+                elif run_ms <= args.budget_ms:
+                    verdict = "ok"
+                else:
+                    verdict = "OVER"
+                    over_budget.append(name)
+            print(f"{name:<12}{format_ms(cli_ms, 10)}{format_ms(import_ms, 12)}{run_column}  {verdict}")
+    if over_budget:
+        print(f"Over the {args.budget_ms} ms startup budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", default="whisper",
+                        help="Inference backend: whisper (reference), whisper-int8 or faster-whisper (int8 CTranslate2)")
+    parser.add_argument("--threads", type=int, help="CPU threads for inference")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="speech-aligner", description="Run the speech aligner pipeline one stage at a time.")
+    parser.add_argument("--import-only", metavar="STAGE", choices=sorted(STAGE_MODULES), help=argparse.SUPPRESS)
+    subparsers = parser.add_subparsers(dest="command")
+
+    convert = subparsers.add_parser("convert", help="Convert an input audio file to 16 kHz mono WAV")
+    convert.add_argument("input")
+    convert.add_argument("--output", default=output_path("output_audio.wav"))
+    convert.set_defaults(func=cmd_convert)
+
+    transcribe = subparsers.add_parser("transcribe", help="Transcribe the audio to transcript.txt with Whisper")
+    transcribe.add_argument("--audio", default=output_path("output_audio.wav"))
+    transcribe.add_argument("--model", default="base")
+    transcribe.add_argument("--output", default=output_path("transcript.txt"))
+    add_backend_arguments(transcribe)
+    transcribe.set_defaults(func=cmd_transcribe)
+
+    words = subparsers.add_parser("words", help="Transcribe with word timestamps to a word timeline")
+    words.add_argument("--audio", default=output_path("output_audio.wav"))
+    words.add_argument("--model", default="medium")
+    words.add_argument("--output", default=output_path("word_data.npz"))
+    words.add_argument("--json", help="Also export the words as JSON for debugging")
+    add_backend_arguments(words)
+    words.add_argument("--beam-size", type=int, help="Beam search width (default: greedy decoding)")
+    words.set_defaults(func=cmd_words)
+
+    backends = subparsers.add_parser("backends", help="Compare transcription backends for speed and accuracy on the clips in inputs/")
+    backends.add_argument("clips", nargs="*", help="Audio files (default: everything in inputs/)")
+    backends.add_argument("--model", default="medium")
+    backends.add_argument("--backend", action="append", default=None,
+                          help="Backend to compare against reference whisper (repeatable; default: whisper-int8 and faster-whisper)")
+    backends.add_argument("--threads", type=int)
+    backends.add_argument("--beam-size", type=int)
+    backends.add_argument("--output", default=output_path("backend_comparison.json"))
+    backends.set_defaults(func=cmd_backends)
+
+    diarize = subparsers.add_parser("diarize", help="Tag each word with a speaker ID for multi-character scenes")
+    diarize.add_argument("--audio", default=output_path("output_audio.wav"))
+    diarize.add_argument("--words", default=output_path("word_data.npz"))
+    diarize.add_argument("--output", help="Tagged word timeline (default: overwrite --words)")
+    diarize.add_argument("--speakers", type=int, help="Number of speakers (default: estimate)")
+    diarize.add_argument("--max-speakers", type=int, default=4)
+    diarize.add_argument("--json", help="Also export the tagged words as JSON for debugging")
+    diarize.set_defaults(func=cmd_diarize)
+
+    phonemes = subparsers.add_parser("phonemes", help="Map words to phonemes with the CMU dictionary")
+    phonemes.add_argument("--cmu-dict", help="Path to cmudict-en-us.dict (default: the one shipped with pocketsphinx)")
+    phonemes.add_argument("--words", default=output_path("word_data.npz"))
+    phonemes.add_argument("--output", default=output_path("phoneme_data.npz"))
+    phonemes.add_argument("--json", help="Also export the phonemes as JSON for debugging")
+    phonemes.set_defaults(func=cmd_phonemes)
+
+    visemes = subparsers.add_parser("visemes", help="Map phonemes to mouth shapes")
+    visemes.add_argument("--phonemes", default=output_path("phoneme_data.npz"))
+    visemes.add_argument("--output", default=output_path("viseme_data.npz"))
+    visemes.add_argument("--json", help="Also export the visemes as JSON for debugging")
+    visemes.set_defaults(func=cmd_visemes)
+
+    smooth = subparsers.add_parser("smooth", help="Remove mouth-shape flicker and add coarticulation")
+    smooth.add_argument("--visemes", default=output_path("viseme_data.npz"))
+    smooth.add_argument("--output", default=output_path("viseme_data_smoothed.npz"),
+                        help="Smoothed viseme timeline (kept separate so smoothing always starts from the raw visemes)")
+    smooth.add_argument("--fps", type=int, default=30)
+    smooth.add_argument("--min-hold", type=float, default=0.07, help="Shortest time a mouth shape stays on screen, in seconds")
+    smooth.add_argument("--blend", type=float, default=0.0, help="Cross-fade length between mouth shapes, in seconds (0 = off)")
+    smooth.add_argument("--json", help="Also export the smoothed visemes as JSON for debugging")
+    smooth.set_defaults(func=cmd_smooth)
+
+    poses = subparsers.add_parser("poses", help="Turn <pose> tags in the edited transcript into a pose timeline")
+    poses.add_argument("--transcript", default=output_path("transcript_poses.txt"))
+    poses.add_argument("--words", default=output_path("word_data.npz"))
+    poses.add_argument("--output", default=output_path("pose_data.npz"))
+    poses.add_argument("--json", help="Also export the poses as JSON for debugging")
+    poses.set_defaults(func=cmd_poses)
+
+    render = subparsers.add_parser("render", help="Render the animation and encode it with the audio")
+    render.add_argument("--visemes", default=default_visemes())
+    render.add_argument("--poses", default=output_path("pose_data.npz"))
+    render.add_argument("--audio", default=output_path("output_audio.wav"))
+    render.add_argument("--output", default=output_path("poses_animate_final_output_with_audio.mp4"))
+    render.add_argument("--tier", default="final", help="Render tier, e.g. proxy or final")
+    render.add_argument("--profile", help="Encoder profile (default: the tier's); prores_alpha or vp9_alpha for a transparent, cropped video")
+    render.add_argument("--fps", type=int, default=30)
+    render.add_argument("--checkpoint-dir", help="Render in resumable segments under this directory")
+    render.add_argument("--captions", help="Word timeline (e.g. output/word_data.npz) to burn in as karaoke-style captions")
+    render.add_argument("--motion", action="store_true", help="Cross-fade pose changes and add idle breathing")
+    render.add_argument("--bundle", help="Compiled asset bundle to render from (replaces --tier and the asset paths)")
+    render.add_argument("--temp-dir", default=os.path.join(REPO_DIR, "tmp_frames", "frames"))
+    render.add_argument("--tier-cache-dir", default=os.path.join(REPO_DIR, "cache", "tiers"))
+    render.add_argument("--visemes-dir", default=os.path.join(ASSETS_DIR, "new_visemes"))
+    render.add_argument("--pose-folder", default=os.path.join(ASSETS_DIR, "pose"))
+    render.add_argument("--head-image", default=os.path.join(ASSETS_DIR, "other", "norris_body.png"))
+    render.add_argument("--blink-image", default=os.path.join(ASSETS_DIR, "other", "norris_blink.png"))
+    render.add_argument("--background", default=os.path.join(ASSETS_DIR, "background", "background.png"))
+    render.set_defaults(func=cmd_render)
+
+    pipeline = subparsers.add_parser("pipeline", help="Transcribe, map and render at the same time, chunk by chunk")
+    pipeline.add_argument("--audio", default=output_path("output_audio.wav"))
+    pipeline.add_argument("--output", default=output_path("pipeline_output_with_audio.mp4"))
+    pipeline.add_argument("--model", default="medium")
+    add_backend_arguments(pipeline)
+    pipeline.add_argument("--beam-size", type=int, help="Beam search width (default: greedy decoding)")
+    pipeline.add_argument("--cmu-dict", help="Path to cmudict-en-us.dict (default: the one shipped with pocketsphinx)")
+    pipeline.add_argument("--poses", help="Pose timeline from an earlier run (default: neutral pose)")
+    pipeline.add_argument("--chunk-seconds", type=float, default=30.0)
+    pipeline.add_argument("--tier", default="final", help="Render tier, e.g. proxy or final")
+    pipeline.add_argument("--profile", help="Encoder profile (default: the tier's); prores_alpha or vp9_alpha for a transparent, cropped video")
+    pipeline.add_argument("--fps", type=int, default=30)
+    pipeline.add_argument("--work-dir", default=os.path.join(REPO_DIR, "tmp_frames", "pipeline"))
+    pipeline.add_argument("--tier-cache-dir", default=os.path.join(REPO_DIR, "cache", "tiers"))
+    pipeline.add_argument("--visemes-dir", default=os.path.join(ASSETS_DIR, "new_visemes"))
+    pipeline.add_argument("--pose-folder", default=os.path.join(ASSETS_DIR, "pose"))
+    pipeline.add_argument("--head-image", default=os.path.join(ASSETS_DIR, "other", "norris_body.png"))
+    pipeline.add_argument("--blink-image", default=os.path.join(ASSETS_DIR, "other", "norris_blink.png"))
+    pipeline.add_argument("--background", default=os.path.join(ASSETS_DIR, "background", "background.png"))
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    farm = subparsers.add_parser("farm", help="Render across worker processes or nodes that share a job queue")
+    farm.add_argument("role", choices=["coordinator", "worker", "local"],
+                      help="coordinator: queue a clip and concatenate it when done; worker: render queued tasks; local: both, with --workers processes")
+    farm.add_argument("--farm-dir", default=os.path.join(REPO_DIR, "farm"), help="Shared directory for the queue and segments")
+    farm.add_argument("--queue", help="Job queue database (default: <farm-dir>/queue.sqlite)")
+    farm.add_argument("--workers", type=int, help="Local worker processes (default: one per CPU)")
+    farm.add_argument("--worker-name", help="Name on a worker's leases (default: host:pid)")
+    farm.add_argument("--exit-when-idle", action="store_true", help="Stop a worker once the queue is empty")
+    farm.add_argument("--lease-seconds", type=float, default=120.0)
+    farm.add_argument("--segment-frames", type=int, default=300, help="Frames per task")
+    farm.add_argument("--visemes", default=default_visemes())
+    farm.add_argument("--poses", default=output_path("pose_data.npz"))
+    farm.add_argument("--audio", default=output_path("output_audio.wav"))
+    farm.add_argument("--captions", help="Word timeline to burn in as karaoke-style captions")
+    farm.add_argument("--motion", action="store_true", help="Cross-fade pose changes and add idle breathing")
+    farm.add_argument("--bundle", help="Compiled asset bundle to render from (replaces --tier and the asset paths)")
+    farm.add_argument("--output", default=output_path("farm_output_with_audio.mp4"))
+    farm.add_argument("--tier", default="final", help="Render tier, e.g. proxy or final")
+    farm.add_argument("--profile", help="Encoder profile for the final encode (default: the tier's)")
+    farm.add_argument("--fps", type=int, default=30)
+    farm.add_argument("--tier-cache-dir", default=os.path.join(REPO_DIR, "cache", "tiers"))
+    farm.add_argument("--visemes-dir", default=os.path.join(ASSETS_DIR, "new_visemes"))
+    farm.add_argument("--pose-folder", default=os.path.join(ASSETS_DIR, "pose"))
+    farm.add_argument("--head-image", default=os.path.join(ASSETS_DIR, "other", "norris_body.png"))
+    farm.add_argument("--blink-image", default=os.path.join(ASSETS_DIR, "other", "norris_blink.png"))
+    farm.add_argument("--background", default=os.path.join(ASSETS_DIR, "background", "background.png"))
+    farm.set_defaults(func=cmd_farm)
+
+    bundle = subparsers.add_parser("bundle", help="Validate a character and compile it into a pre-scaled asset bundle")
+    bundle.add_argument("--character", default=os.path.join(ASSETS_DIR, "characters", "norris.json"), help="Character definition (JSON)")
+    bundle.add_argument("--tier", default="final", help="Render tier to scale for, e.g. proxy or final")
+    bundle.add_argument("--output", help="Bundle path (default: cache/bundles/<name>-<tier>-<size>.bundle)")
+    bundle.add_argument("--check", action="store_true", help="Only validate the character")
+    bundle.add_argument("--force", action="store_true", help="Rebuild even if the bundle is up to date")
+    bundle.set_defaults(func=cmd_bundle)
+
+    trace = subparsers.add_parser("trace", help="Merge the stage traces of a run and print a summary")
+    trace.add_argument("trace_dir")
+    trace.add_argument("--output", help="Chrome trace file (default: <trace_dir>/chrome_trace.json)")
+    trace.set_defaults(func=cmd_trace)
+
+    startup = subparsers.add_parser("startup", help="Measure the startup time of every subcommand")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    startup.set_defaults(func=cmd_startup)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.import_only:
+        for name in STAGE_MODULES[args.import_only]:
+            stage(name)
+        return
+    if not args.command:
+        parser.print_help()
+        return
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import argparse
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pygame
+from pocketsphinx import Pocketsphinx, get_model_path
+
+from animate_poses import head_position, centered_on_head
+from viseme_mapping import map_phonemes_to_visemes
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # 16-bit mono PCM, same as output_audio.wav
+FRAMES_PER_SECOND = 100  # Pocketsphinx reports segment times in 10 ms frames
+
+def iter_pcm_blocks(source, block_ms=50, idle_timeout=2.0):
+    """
+    Yield raw 16 kHz 16-bit mono PCM blocks from a live source.
+
+    Args:
+        source (str): "-" for stdin (pipe), "tcp://host:port" to listen for one
+            socket connection, or the path of a file that is still being written.
+            Files are read no faster than real time, as a live source would
+            deliver them, so latency and the live renderer stay meaningful.
+        block_ms (int): Block size in milliseconds. Smaller blocks lower latency.
+        idle_timeout (float): For growing files, stop after the file has not grown
+            for this many seconds.
+    """
+    block_size = int(SAMPLE_RATE * block_ms / 1000) * SAMPLE_WIDTH
+
+    if source == "-":
+        stream = sys.stdin.buffer
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                return
+            yield block
+
+    elif source.startswith("tcp://"):
+        host, port = source[len("tcp://"):].rsplit(":", 1)
+        with socket.create_server((host, int(port))) as server:
+            print(f"Waiting for PCM stream on {host}:{port}...")
+            conn, address = server.accept()
+            print(f"Streaming audio from {address[0]}:{address[1]}")
+            with conn:
+                pending = b""
+                while True:
+                    data = conn.recv(block_size)
+                    if not data:
+                        break
+                    pending += data
+                    while len(pending) >= block_size:
+                        yield pending[:block_size]
+                        pending = pending[block_size:]
+                if pending:
+                    yield pending
+
+    else:
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"Audio source not found: {source}")
+        with open(source, "rb") as f:
+            if source.endswith(".wav"):
+                f.seek(44)  # Skip the canonical WAV header
+            started = last_data = time.monotonic()
+            sent = 0
+            while True:
+                block = f.read(block_size)
+                if block:
+                    # Hand out a block only once its audio would have been captured
+                    sent += len(block)
+                    delay = started + sent / (SAMPLE_RATE * SAMPLE_WIDTH) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    last_data = time.monotonic()
+                    yield block
+                elif time.monotonic() - last_data > idle_timeout:
+                    return
+                else:
+                    time.sleep(block_ms / 1000)
+
+class StreamingPhonemeRecognizer:
+    """Incremental phoneme recognition with pocketsphinx in all-phone mode."""
+
+    def __init__(self, hold_back_frames=5):
+        model_path = get_model_path()
+        config = {
+            'verbose': False,
+            'hmm': os.path.join(model_path, 'en-us', 'en-us'),
+            'allphone': os.path.join(model_path, 'en-us', 'en-us-phone.lm.bin'),
+            'lm': False,
+            'lw': 2.0,
+            'beam': 1e-10,
+            'pbeam': 1e-10,
+        }
+        self.decoder = Pocketsphinx(**config)
+        # Segments ending this close to the decoder's current frame may still change
+        self.hold_back_frames = hold_back_frames
+        self.samples_seen = 0
+        self.utterance_offset = 0.0
+        self.emitted_until = 0
+        self.in_utterance = False
+
+    def _new_segments(self, final):
+        """Return phoneme entries that became stable since the last call."""
+        segments = [seg for seg in self.decoder.seg()]
+        current_frame = int((self.samples_seen / SAMPLE_RATE - self.utterance_offset) * FRAMES_PER_SECOND)
+        phonemes = []
+        for seg in segments:
+            if seg.end_frame < self.emitted_until:
+                continue
+            if not final and seg.end_frame > current_frame - self.hold_back_frames:
+                break
+            phoneme = seg.word
+            if phoneme.startswith("+") or phoneme.startswith("<"):
+                phoneme = "SIL"  # Noise and filler tokens keep the mouth closed
+            phonemes.append({
+                'phoneme': phoneme,
+                'start_time': self.utterance_offset + seg.start_frame / FRAMES_PER_SECOND,
+                'end_time': self.utterance_offset + (seg.end_frame + 1) / FRAMES_PER_SECOND,
+            })
+            self.emitted_until = seg.end_frame + 1
+        return phonemes
+
+    def process(self, block):
+        """Feed one PCM block and return the phonemes that are now stable."""
+        if not self.in_utterance:
+            self.decoder.start_utt()
+            self.in_utterance = True
+            self.utterance_offset = self.samples_seen / SAMPLE_RATE
+            self.emitted_until = 0
+        self.decoder.process_raw(block, False, False)
+        self.samples_seen += len(block) // SAMPLE_WIDTH
+        return self._new_segments(final=False)
+
+    def finish(self):
+        """Close the current utterance and return its remaining phonemes."""
+        if not self.in_utterance:
+            return []
+        self.decoder.end_utt()
+        self.in_utterance = False
+        return self._new_segments(final=True)
+
+def recognize_stream(blocks, events, utterance_seconds=10.0):
+    """
+    Run incremental recognition over PCM blocks and push viseme events to a queue.
+
+    Each event is a viseme entry (mouth_shape, start_time, end_time) plus the
+    wall-clock time it was emitted, so consumers can measure latency. A None
+    event marks the end of the stream. Latency is measured against the
+    stream's wall-clock start, so it assumes the blocks arrive in real time
+    (live sources, and files, which iter_pcm_blocks paces); audio piped to
+    stdin faster than that gives meaningless numbers.
+    """
+    recognizer = StreamingPhonemeRecognizer()
+    stream_start = time.monotonic()
+    latencies = []
+
+    def emit(phonemes):
+        for phoneme, viseme in zip(phonemes, map_phonemes_to_visemes(phonemes)):
+            if phoneme['phoneme'] == "SIL":
+                viseme["mouth_shape"] = "neutral.png"
+            viseme["emitted_at"] = time.monotonic()
+            latencies.append(viseme["emitted_at"] - (stream_start + viseme["end_time"]))
+            events.put(viseme)
+
+    for block in blocks:
+        emit(recognizer.process(block))
+        # Restart the utterance periodically so the search stays small
+        if recognizer.samples_seen / SAMPLE_RATE - recognizer.utterance_offset > utterance_seconds \
+                and not recognizer.decoder.get_in_speech():
+            emit(recognizer.finish())
+    emit(recognizer.finish())
+    events.put(None)
+
+    if latencies:
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        print(f"Viseme latency: p50 {p50:.0f} ms, p95 {p95:.0f} ms over {len(latencies)} events")
+
+class LiveRenderer:
+    """Render viseme events in real time to a local window or an ffmpeg output."""
+
+    def __init__(self, image_directory, head_image_path, blink_image_path, resolution, fps, output=None, background_path=None):
+        pygame.init()
+        self.resolution = resolution
+        self.fps = fps
+        self.output = output
+        if output is None:
+            self.screen = pygame.display.set_mode(resolution)
+            pygame.display.set_caption("speech-aligner live")
+        else:
+            self.screen = pygame.Surface(resolution)
+
+        if not os.path.exists(head_image_path):
+            raise FileNotFoundError(f"Head image not found: {head_image_path}")
+        if not os.path.exists(blink_image_path):
+            raise FileNotFoundError(f"Blink image not found: {blink_image_path}")
+        self.head_image = pygame.image.load(head_image_path)
+        self.blink_image = pygame.image.load(blink_image_path)
+        self.head_pos = head_position(resolution, self.head_image)
+        self.bg_image = None
+        if background_path:
+            self.bg_image = pygame.transform.scale(pygame.image.load(background_path), resolution)
+
+        self.viseme_images = {}
+        for name in os.listdir(image_directory):
+            if name.endswith(".png"):
+                self.viseme_images[name] = pygame.image.load(os.path.join(image_directory, name))
+        if "neutral.png" not in self.viseme_images:
+            raise FileNotFoundError("Neutral viseme ('neutral.png') not found in the viseme directory.")
+
+        self.ffmpeg = None
+        if output is not None:
+            self.ffmpeg = subprocess.Popen([
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{resolution[0]}x{resolution[1]}",
+                "-r", str(fps), "-i", "-",
+                "-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency",
+                "-pix_fmt", "yuv420p", "-g", str(fps * 2),
+                "-f", "flv" if output.startswith("rtmp://") else "mpegts", output,
+            ], stdin=subprocess.PIPE)
+
+    def draw(self, mouth_shape, blinking):
+        """Draw one frame and send it to the window or ffmpeg."""
+        if self.bg_image is not None:
+            self.screen.blit(self.bg_image, (0, 0))
+        else:
+            self.screen.fill((0, 0, 0))
+        self.screen.blit(self.head_image, self.head_pos)
+        mouth_image = self.viseme_images.get(mouth_shape, self.viseme_images["neutral.png"])
+        self.screen.blit(mouth_image, centered_on_head(self.head_pos, self.head_image, mouth_image))
+        if blinking:
+            self.screen.blit(self.blink_image, self.head_pos)
+
+        if self.ffmpeg is not None:
+            self.ffmpeg.stdin.write(pygame.image.tostring(self.screen, "RGB"))
+        else:
+            pygame.display.flip()
+            pygame.event.pump()
+
+    def run(self, events, hold_time=0.25):
+        """Consume viseme events until the end-of-stream marker, drawing at a fixed frame rate."""
+        frame_time = 1 / self.fps
+        mouth_shape = "neutral.png"
+        shape_until = 0.0
+        next_blink = time.monotonic() + random.uniform(2, 10)
+        next_frame = time.monotonic()
+        finished = False
+
+        while not finished:
+            # Take every event that arrived since the last frame; the newest one wins
+            while True:
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    finished = True
+                    break
+                mouth_shape = event["mouth_shape"]
+                shape_until = time.monotonic() + max(event["end_time"] - event["start_time"], hold_time)
+
+            now = time.monotonic()
+            if now > shape_until:
+                mouth_shape = "neutral.png"
+            blinking = next_blink <= now < next_blink + 0.2
+            if now >= next_blink + 0.2:
+                next_blink = now + random.uniform(2, 10)
+
+            self.draw(mouth_shape, blinking)
+
+            next_frame += frame_time
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame = time.monotonic()  # Drop behind frames instead of bursting
+
+        if self.ffmpeg is not None:
+            self.ffmpeg.stdin.close()
+            self.ffmpeg.wait()
+        pygame.quit()
+
+def run_live(source, renderer, block_ms=50):
+    """Recognize the source on a worker thread while the renderer draws on this one."""
+    events = queue.Queue()
+    worker = threading.Thread(
+        target=recognize_stream,
+        args=(iter_pcm_blocks(source, block_ms=block_ms), events),
+        daemon=True,
+    )
+    worker.start()
+    renderer.run(events)
+    worker.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live lip-sync from a PCM stream (16 kHz, 16-bit mono).")
+    parser.add_argument("source", help='"-" for stdin, "tcp://host:port", or a WAV/PCM file being written')
+    parser.add_argument("--output", help="rtmp:// URL or file/pipe for ffmpeg output (default: local window)")
+    parser.add_argument("--block-ms", type=int, default=50, help="PCM block size in milliseconds")
+    parser.add_argument("--fps", type=int, default=30)
+    args = parser.parse_args()
+
+    image_directory = "/Users/nervous/Documents/GitHub/speech-aligner/assets/new_visemes"
+    head_image_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_body.png"
+    blink_image_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_blink.png"
+    background_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/background/background.png"
+    resolution = (660, 1434)  # Half of the offline render, to keep up in real time
+
+    renderer = LiveRenderer(image_directory, head_image_path, blink_image_path, resolution, args.fps,
+                            output=args.output, background_path=background_path)
+    run_live(args.source, renderer, block_ms=args.block_ms)
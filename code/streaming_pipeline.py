@@ -0,0 +1,263 @@
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+from animate_poses import load_render_assets, load_pose_data, generate_blinks, resolve_frame_states, render_frame_range
+from audio_access import open_audio, detect_silence
+from encoder_profiles import get_encoder_profile, build_encode_command, build_lossless_command, open_encoder, close_encoder, x264_args
+from frame_grid import first_frame_at
+from instrumentation import span, count
+from phoneme_mapping import load_cmu_dict, map_words_to_phonemes
+from render_checkpoints import concat_segments
+from timeline_store import Timeline, save_timeline
+from transcription_backends import DEFAULT_BACKEND, SAMPLE_RATE, cache_model_name, load_transcriber
+from transcription_cache import TranscriptionCache, audio_fingerprint, compact_result
+from viseme_mapping import map_phonemes_to_visemes
+from viseme_smoothing import ANTICIPATION, smooth_visemes
+
+def plan_chunks(audio, chunk_seconds=30.0, search_seconds=8.0):
+    """
+    Split the audio into chunks of about chunk_seconds, cutting in the middle of a silence.
+
+    A cut looks for the silence closest to the target within search_seconds;
+    with none there, it cuts at the target. Cutting in silences keeps words
+    from being split between chunks, so each chunk can be transcribed and
+    mapped on its own.
+
+    Returns:
+        list of tuples: Consecutive (start_time, end_time) covering the whole file.
+    """
+    duration = audio.duration
+    midpoints = np.array([(start + end) / 2 for start, end in detect_silence(audio)])
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds + search_seconds:
+        target = cuts[-1] + chunk_seconds
+        nearby = midpoints[np.abs(midpoints - target) <= search_seconds] if len(midpoints) else midpoints
+        cuts.append(float(nearby[np.argmin(np.abs(nearby - target))]) if len(nearby) else target)
+    cuts.append(duration)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def _offset_words(result, offset):
+    """Word records (the word_data format) of a chunk's Whisper result, moved to file time."""
+    return [
+        {"word": word["word"], "start_time": word["start"] + offset, "end_time": word["end"] + offset}
+        for segment in result["segments"]
+        for word in segment.get("words", [])
+    ]
+
+def _run_stage(name, work, errors, downstream):
+    """Thread body: run one stage, record its error and always tell the next stage it is done."""
+    try:
+        with span(f"pipeline_{name}"):
+            work()
+    except Exception as e:
+        errors.append((name, e))
+    finally:
+        downstream.put(None)
+
+def run_pipeline(audio_file, output_video, cmu_dict_path, image_directory, head_image_path, blink_image_path, pose_folder, background_path,
+                 resolution, fps=30, pose_data=None, model_name="medium", backend=DEFAULT_BACKEND, threads=None, beam_size=None,
+                 encoder_profile="balanced", work_dir="tmp_frames/pipeline", output_dir=None, chunk_seconds=30.0, smooth=True, queue_size=4):
+    """
+    Transcribe, map and render a clip with the stages running at the same time.
+
+    The audio is cut into chunks at silences (plan_chunks). A transcription
+    thread emits the words of each chunk as soon as Whisper has decoded it; a
+    mapping thread turns them into phonemes and (smoothed) visemes; the main
+    thread renders the chunk's frames and encodes them to a segment file
+    right away. The segments are joined with the audio at the end, so the
+    wall time approaches the slowest stage instead of the sum of all stages.
+
+    Chunks are transcribed independently, so words can differ slightly from a
+    whole-file transcription. A cached transcription of the file is reused
+    instead of running Whisper: a whole-file one from the words stage first,
+    then a chunked one from an earlier run. Chunked results are cached under
+    their own key (with chunk_seconds), so the words stage never picks them up.
+
+    Args:
+        audio_file (str): 16 kHz WAV from the convert stage.
+        pose_data: Optional pose timeline (path or data); without one the neutral pose is shown.
+        backend, threads, beam_size: Transcription settings (see transcription_backends.py).
+        work_dir (str): Directory for the encoded segments.
+        output_dir (str): If given, also save transcript.txt, word_data.npz and viseme_data.npz there.
+        queue_size (int): Chunks allowed to wait between two stages.
+
+    Returns:
+        dict: Busy seconds per stage plus the total wall time.
+    """
+    wall_start = time.perf_counter()
+    audio = open_audio(audio_file)
+    if audio.sample_rate != SAMPLE_RATE:
+        raise ValueError(f"{audio_file} is {audio.sample_rate} Hz; convert it to {SAMPLE_RATE} Hz mono WAV first")
+    chunks = plan_chunks(audio, chunk_seconds)
+    print(f"Streaming {audio.duration:.1f} s of audio in {len(chunks)} chunks")
+
+    word_queue = queue.Queue(maxsize=queue_size)
+    viseme_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    busy = {"transcribe": 0.0, "map": 0.0, "render": 0.0}
+    all_words = []
+    all_visemes = []
+
+    options = {"word_timestamps": True}
+    if beam_size and beam_size > 1:
+        options["beam_size"] = beam_size
+    chunked_options = {**options, "chunk_seconds": chunk_seconds}
+    cache_name = cache_model_name(backend, model_name)
+
+    def transcribe_chunks():
+        cache = TranscriptionCache()  # sqlite connections stay on the thread that opened them
+        fingerprint = audio_fingerprint(audio_file)
+        cached = cache.get(fingerprint, cache_name, options) or cache.get(fingerprint, cache_name, chunked_options)
+        if cached is not None:
+            print(f"Using cached {cache_name} transcription for {audio_file}")
+            words = _offset_words(cached, 0.0)
+            for chunk_start, chunk_end in chunks:
+                word_queue.put((chunk_start, chunk_end, [w for w in words if chunk_start <= w["start_time"] < chunk_end]))
+            return
+
+        transcribe = load_transcriber(backend, model_name, threads)
+        segments = []
+        text = []
+        language = None
+        for chunk_start, chunk_end in chunks:
+            started = time.perf_counter()
+            with span("transcribe_chunk", start=round(chunk_start, 2)):
+                result = transcribe(audio.window_float32(chunk_start, chunk_end), beam_size=beam_size, word_timestamps=True)
+            busy["transcribe"] += time.perf_counter() - started
+            language = language or result.get("language")
+            text.append(result.get("text", "").strip())
+            for segment in result["segments"]:
+                segments.append({**segment, "start": segment["start"] + chunk_start, "end": segment["end"] + chunk_start,
+                                 "words": [{**w, "start": w["start"] + chunk_start, "end": w["end"] + chunk_start} for w in segment.get("words", [])]})
+            count("pipeline_chunks_transcribed")
+            word_queue.put((chunk_start, chunk_end, _offset_words(result, chunk_start)))
+        # Keep the stitched result for later runs with the same chunking
+        cache.put(fingerprint, cache_name, chunked_options, compact_result({"text": " ".join(text), "language": language, "segments": segments}))
+
+    def map_chunks():
+        cmu_dict = load_cmu_dict(cmu_dict_path)
+        while (item := word_queue.get()) is not None:
+            chunk_start, chunk_end, words = item
+            started = time.perf_counter()
+            visemes = map_phonemes_to_visemes(map_words_to_phonemes(words, cmu_dict)) if words else []
+            viseme_timeline = Timeline.from_records(visemes, "viseme")
+            if smooth and len(viseme_timeline):
+                viseme_timeline = smooth_visemes(viseme_timeline, fps)
+            busy["map"] += time.perf_counter() - started
+            all_words.extend(words)
+            viseme_queue.put((chunk_start, chunk_end, viseme_timeline))
+
+    stage_threads = [
+        threading.Thread(target=_run_stage, args=("transcribe", transcribe_chunks, errors, word_queue), daemon=True),
+        threading.Thread(target=_run_stage, args=("map", map_chunks, errors, viseme_queue), daemon=True),
+    ]
+    for thread in stage_threads:
+        thread.start()
+
+    # Rendering stays on the main thread (pygame); its setup overlaps with loading the Whisper model
+    mouth_shapes = sorted(name for name in os.listdir(image_directory) if name.endswith(".png"))
+    all_mouths = Timeline("viseme", np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int16), mouth_shapes)
+    pose_timeline = load_pose_data(pose_data) if isinstance(pose_data, str) else Timeline.from_records(pose_data or [], "pose")
+    profile = get_encoder_profile(encoder_profile)
+    assets = load_render_assets(all_mouths, image_directory, head_image_path, blink_image_path, pose_folder, pose_timeline, background_path,
+                                resolution, alpha=profile.get("alpha", False))
+    frame_size = assets["base_frame"].get_size()
+    blinks = generate_blinks(audio.duration, random.Random(0))
+    extension = ".mkv" if profile["lossless_intermediate"] else profile.get("extension", ".mp4")
+    os.makedirs(work_dir, exist_ok=True)
+
+    # Visemes whose frames are not all rendered yet. Smoothing can stretch a
+    # chunk's last shapes past its end, so they carry over into the next chunk,
+    # and anticipation can start the next chunk's first shapes up to hold_back
+    # seconds before the cut, so frames that close to it wait for that chunk.
+    hold_back = max(ANTICIPATION.values()) if smooth else 0.0
+    pending = []
+    segment_files = []
+    rendered_frames = 0
+
+    def render_until(end_frame, desc):
+        nonlocal pending, rendered_frames
+        if end_frame <= rendered_frames:
+            return
+        started = time.perf_counter()
+        viseme_timeline = Timeline.from_records(pending, "viseme")
+        segment_path = os.path.join(work_dir, f"segment_{len(segment_files):05d}{extension}")
+        if profile["lossless_intermediate"]:
+            ffmpeg_command = build_lossless_command(fps, frame_size, segment_path)
+        else:
+            ffmpeg_command = build_encode_command(profile, fps, frame_size, segment_path)
+        encoder = open_encoder(ffmpeg_command)
+        states = resolve_frame_states(viseme_timeline, pose_timeline, blinks, end_frame, fps, start_frame=rendered_frames)
+        render_frame_range(rendered_frames, end_frame, fps, viseme_timeline, pose_timeline, blinks, assets, encoder, desc=desc, states=states)
+        close_encoder(encoder, ffmpeg_command)
+        busy["render"] += time.perf_counter() - started
+        segment_files.append(segment_path)
+        rendered_frames = end_frame
+        finished = [int(first_frame_at(viseme["end_time"], fps)) <= end_frame for viseme in pending]
+        all_visemes.extend(viseme for viseme, done in zip(pending, finished) if done)
+        pending = [viseme for viseme, done in zip(pending, finished) if not done]
+
+    last_end = chunks[-1][1]
+    while (item := viseme_queue.get()) is not None:
+        chunk_start, chunk_end, viseme_timeline = item
+        visemes = viseme_timeline.to_records()
+        if visemes:
+            # Where the chunks meet, the new chunk's shapes win over the held ones
+            cut = visemes[0]["start_time"]
+            for viseme in pending:
+                viseme["end_time"] = min(viseme["end_time"], cut)
+            pending = [viseme for viseme in pending if viseme["end_time"] > viseme["start_time"]] + visemes
+        render_until(int(first_frame_at(chunk_end - (hold_back if chunk_end < last_end else 0.0), fps)),
+                     f"Chunk {chunk_start:.0f}-{chunk_end:.0f} s")
+    all_visemes.extend(pending)  # Whatever runs past the end of the audio
+
+    if not errors:  # After a failure an upstream thread may be stuck on a full queue; it is a daemon
+        for thread in stage_threads:
+            thread.join()
+    if errors:
+        name, error = errors[0]
+        raise RuntimeError(f"Pipeline stage '{name}' failed: {error}") from error
+
+    concat_segments(segment_files, output_video, audio_file,
+                    transcode_args=x264_args(profile) if profile["lossless_intermediate"] else None,
+                    audio_codec=profile.get("audio_codec", "aac"))
+    if output_dir:
+        with open(os.path.join(output_dir, "transcript.txt"), "w", encoding="utf-8") as f:
+            f.write(" ".join(word["word"].strip() for word in all_words))
+        save_timeline(Timeline.from_records(all_words, "word"), os.path.join(output_dir, "word_data.npz"))
+        save_timeline(Timeline.from_records(all_visemes, "viseme"), os.path.join(output_dir, "viseme_data.npz"))
+
+    busy["wall"] = time.perf_counter() - wall_start
+    print(f"Video saved to {output_video}")
+    print(f"Busy time: transcribe {busy['transcribe']:.1f} s, map {busy['map']:.1f} s, render {busy['render']:.1f} s; "
+          f"wall {busy['wall']:.1f} s (sequential would be about {busy['transcribe'] + busy['map'] + busy['render']:.1f} s)")
+    return busy
+
+if __name__ == "__main__":
+    from pocketsphinx import get_model_path
+    from render_tiers import RENDER_TIERS, prepare_tier_assets
+
+    audio_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav"
+    output_dir = "/Users/nervous/Documents/GitHub/speech-aligner/output"
+    final_output = "/Users/nervous/Documents/GitHub/speech-aligner/output/pipeline_output_with_audio.mp4"
+    work_dir = "/Users/nervous/Documents/GitHub/speech-aligner/tmp_frames/pipeline"
+    cmu_dict_path = os.path.join(get_model_path(), "en-us", "cmudict-en-us.dict")
+    image_directory = "/Users/nervous/Documents/GitHub/speech-aligner/assets/new_visemes"
+    head_image_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_body.png"
+    blink_image_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/other/norris_blink.png"
+    pose_folder = "/Users/nervous/Documents/GitHub/speech-aligner/assets/pose/"
+    background_path = "/Users/nervous/Documents/GitHub/speech-aligner/assets/background/background.png"
+    tier_cache_dir = "/Users/nervous/Documents/GitHub/speech-aligner/cache/tiers"
+    pose_data = None  # e.g. ".../output/pose_data.npz" from an earlier run; poses need the edited transcript
+    fps = 30
+    tier = "final"
+
+    assets = prepare_tier_assets(tier, tier_cache_dir, image_directory, pose_folder, head_image_path, blink_image_path, background_path)
+    run_pipeline(audio_file, final_output, cmu_dict_path, assets["image_directory"], assets["head_image_path"], assets["blink_image_path"],
+                 assets["pose_folder"], assets["background_path"], assets["resolution"], fps, pose_data=pose_data, backend="whisper",
+                 encoder_profile=RENDER_TIERS[tier]["encoder_profile"], work_dir=work_dir, output_dir=output_dir)
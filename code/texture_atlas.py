@@ -0,0 +1,75 @@
+import os
+
+import pygame
+from instrumentation import traced, count
+
+class TextureAtlas:
+    """
+    Many sprites packed into one surface.
+
+    Sprites are trimmed to their visible pixels and packed in shelves (rows
+    of sprites sorted by height). Each file is loaded and scaled once, even
+    when several characters share it, and layers refer to their sprite by
+    its area of the atlas.
+    """
+
+    def __init__(self, max_width=4096, padding=1):
+        self.max_width = max_width
+        self.padding = padding
+        self.surface = None
+        self.regions = {}  # key -> {"area": pygame.Rect, "offset": (x, y), "size": (w, h)}
+        self._pending = {}
+
+    def add(self, image_path, scale=1.0):
+        """Queue an image for packing and return its key. Loading the same file twice is a no-op."""
+        key = (os.path.abspath(image_path), round(scale, 4))
+        if key in self.regions or key in self._pending:
+            return key
+        image = pygame.image.load(image_path)
+        if scale != 1.0:
+            size = (max(1, round(image.get_width() * scale)), max(1, round(image.get_height() * scale)))
+            if image.get_bitsize() >= 24:
+                image = pygame.transform.smoothscale(image, size)
+            else:
+                image = pygame.transform.scale(image, size)  # smoothscale needs 24/32-bit images
+        self._pending[key] = image
+        return key
+
+    def add_surface(self, key, surface):
+        """Queue an already drawn surface (e.g. rendered text) under any hashable key."""
+        if key not in self.regions:
+            self._pending[key] = surface
+        return key
+
+    @traced("pack_atlas")
+    def pack(self):
+        """Pack the queued images into the atlas surface."""
+        trimmed = {}
+        for key, image in self._pending.items():
+            visible = image.get_bounding_rect()
+            if not visible.width or not visible.height:
+                visible = pygame.Rect(0, 0, 1, 1)  # Fully transparent sprite
+            trimmed[key] = (image, visible)
+
+        widest = max([visible.width for _, visible in trimmed.values()] + [1])
+        width = max(widest, min(self.max_width, widest * 2))
+        placements = {}
+        x = y = shelf_height = 0
+        for key, (image, visible) in sorted(trimmed.items(), key=lambda item: -item[1][1].height):
+            if x + visible.width > width:
+                x = 0
+                y += shelf_height + self.padding
+                shelf_height = 0
+            placements[key] = pygame.Rect(x, y, visible.width, visible.height)
+            x += visible.width + self.padding
+            shelf_height = max(shelf_height, visible.height)
+
+        self.surface = pygame.Surface((width, max(1, y + shelf_height)), pygame.SRCALPHA)
+        for key, (image, visible) in trimmed.items():
+            area = placements[key]
+            self.surface.blit(image, area.topleft, area=visible)
+            self.regions[key] = {"area": area, "offset": visible.topleft, "size": image.get_size()}
+        self._pending = {}
+        count("atlas_sprites", len(self.regions))
+        print(f"Packed {len(self.regions)} sprites into a {width}x{self.surface.get_height()} atlas")
+        return self.surface
@@ -0,0 +1,176 @@
+import json
+import os
+
+import numpy as np
+
+# Record layout of every timeline the pipeline writes: (symbol key, start key, end key)
+TIMELINE_KINDS = {
+    "word": ("word", "start_time", "end_time"),
+    "phoneme": ("phoneme", "start_time", "end_time"),
+    "viseme": ("mouth_shape", "start_time", "end_time"),
+    "pose": ("pose_image", "pose_start_time", "pose_end_time"),
+}
+
+class Timeline:
+    """
+    Columnar event timeline.
+
+    Events are stored as parallel arrays: float64 start and end times in
+    seconds (float32 would be coarser than frame_grid's microsecond ticks
+    after a few minutes) and an int16 index into a symbol table (words,
+    phonemes, mouth shapes or pose images). Extra per-event columns (e.g.
+    speaker IDs) are kept in `extra`.
+    """
+
+    def __init__(self, kind, start, end, symbol_ids, symbols, extra=None):
+        if kind not in TIMELINE_KINDS:
+            raise ValueError(f"Unknown timeline kind '{kind}'. Expected one of: {', '.join(TIMELINE_KINDS)}")
+        self.kind = kind
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.symbol_ids = np.asarray(symbol_ids, dtype=np.int16)
+        self.symbols = list(symbols)
+        self.extra = {name: np.asarray(column) for name, column in (extra or {}).items()}
+        if not (len(self.start) == len(self.end) == len(self.symbol_ids)):
+            raise ValueError("Timeline columns must all have the same length")
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def end_time(self):
+        """End of the last event, in seconds."""
+        return float(self.end.max()) if len(self) else 0.0
+
+    @classmethod
+    def from_records(cls, records, kind, extra_keys=None):
+        """
+        Build a timeline from the list-of-dicts format used by the JSON files.
+
+        Any other keys of the first record (e.g. "speaker") become extra
+        columns, unless extra_keys names the ones to keep.
+        """
+        symbol_key, start_key, end_key = TIMELINE_KINDS[kind]
+        if extra_keys is None:
+            extra_keys = [key for key in (records[0] if records else {}) if key not in (symbol_key, start_key, end_key)]
+        symbols = []
+        symbol_index = {}
+        symbol_ids = np.empty(len(records), dtype=np.int16)
+        for i, entry in enumerate(records):
+            symbol = entry[symbol_key]
+            if symbol not in symbol_index:
+                if len(symbols) > np.iinfo(np.int16).max:
+                    raise ValueError(f"Too many distinct symbols for an int16 {kind} timeline")
+                symbol_index[symbol] = len(symbols)
+                symbols.append(symbol)
+            symbol_ids[i] = symbol_index[symbol]
+        start = np.fromiter((entry[start_key] for entry in records), dtype=np.float64, count=len(records))
+        end = np.fromiter((entry[end_key] for entry in records), dtype=np.float64, count=len(records))
+        extra = {key: np.array([entry.get(key, -1) for entry in records]) for key in extra_keys}
+        return cls(kind, start, end, symbol_ids, symbols, extra)
+
+    def to_records(self):
+        """Convert back to the list-of-dicts format, e.g. for the JSON debug export."""
+        symbol_key, start_key, end_key = TIMELINE_KINDS[self.kind]
+        records = []
+        starts = self.start.tolist()
+        ends = self.end.tolist()
+        extra = {name: column.tolist() for name, column in self.extra.items()}
+        for i, symbol_id in enumerate(self.symbol_ids.tolist()):
+            entry = {symbol_key: self.symbols[symbol_id], start_key: starts[i], end_key: ends[i]}
+            for name, column in extra.items():
+                entry[name] = column[i]
+            records.append(entry)
+        return records
+
+    def index_at(self, time):
+        """Return the index of the event active at `time` (start <= time < end), or -1."""
+        i = int(np.searchsorted(self.start, time, side="right")) - 1
+        if i >= 0 and time < self.end[i]:
+            return i
+        return -1
+
+    def symbol_at(self, time, default=None):
+        """Return the symbol active at `time`, or `default`."""
+        i = self.index_at(time)
+        return self.symbols[self.symbol_ids[i]] if i >= 0 else default
+
+    def overlapping(self, start_time, end_time):
+        """Return the indices of events that overlap [start_time, end_time)."""
+        return np.nonzero((self.start < end_time) & (self.end > start_time))[0]
+
+def as_timeline(data, kind):
+    """Accept either a Timeline or the list-of-dicts format and return a Timeline."""
+    if isinstance(data, Timeline):
+        return data
+    return Timeline.from_records(data, kind)
+
+def split_timeline(timeline, column):
+    """
+    Split a timeline by the values of an extra column, e.g. one timeline per speaker.
+
+    Returns:
+        dict: Column value -> Timeline holding only that value's events.
+    """
+    values = timeline.extra[column]
+    parts = {}
+    for value in np.unique(values).tolist():
+        mask = values == value
+        extra = {name: data[mask] for name, data in timeline.extra.items()}
+        parts[value] = Timeline(timeline.kind, timeline.start[mask], timeline.end[mask], timeline.symbol_ids[mask], timeline.symbols, extra)
+    return parts
+
+def save_timeline(timeline, path):
+    """
+    Save a timeline.
+
+    Paths ending in .npz are written as one uncompressed NumPy archive. Any
+    other path is written as a directory of .npy files plus meta.json, which
+    load_timeline memory-maps instead of reading.
+    """
+    meta = {"kind": timeline.kind, "symbols": timeline.symbols, "extra": sorted(timeline.extra)}
+    columns = {"start": timeline.start, "end": timeline.end, "symbol_ids": timeline.symbol_ids}
+    columns.update({f"extra_{name}": column for name, column in timeline.extra.items()})
+
+    if path.endswith(".npz"):
+        np.savez(path, meta=np.array(json.dumps(meta, ensure_ascii=False)), **columns)
+    else:
+        os.makedirs(path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+    print(f"Saved {len(timeline)} {timeline.kind} events to {path}")
+
+def load_timeline(path, kind=None):
+    """
+    Load a timeline saved by save_timeline, or convert a list-of-dicts JSON file.
+
+    Args:
+        path (str): .npz archive, timeline directory or .json file.
+        kind (str): Timeline kind; only needed for .json files.
+    """
+    if path.endswith(".json"):
+        if kind is None:
+            raise ValueError(f"A timeline kind is needed to load {path}")
+        with open(path, "r", encoding="utf-8") as f:
+            return Timeline.from_records(json.load(f), kind)
+
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as archive:
+            meta = json.loads(str(archive["meta"]))
+            columns = {name: archive[name] for name in archive.files if name != "meta"}
+    else:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        names = ["start", "end", "symbol_ids"] + [f"extra_{name}" for name in meta["extra"]]
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in names}
+
+    extra = {name[len("extra_"):]: column for name, column in columns.items() if name.startswith("extra_")}
+    return Timeline(meta["kind"], columns["start"], columns["end"], columns["symbol_ids"], meta["symbols"], extra)
+
+def export_json(timeline, path):
+    """Write a timeline in the original indent=4 list-of-dicts format, for debugging."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(timeline.to_records(), f, indent=4, ensure_ascii=False)
+    print(f"JSON export saved to {path}")
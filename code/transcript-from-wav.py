@@ -1,19 +1,22 @@
-import whisper
+from transcription_backends import DEFAULT_BACKEND, cache_model_name, transcribe_file
+from transcription_cache import transcribe_with_cache
 
-def transcribe_and_save(audio_file, model_name="base", transcript_file="transcript.txt"):
+def transcribe_and_save(audio_file, model_name="base", transcript_file="transcript.txt", backend=DEFAULT_BACKEND, threads=None):
     """
     Transcribe an audio file using Whisper and save the transcription as a text file.
 
     :param audio_file: Path to the audio file to transcribe.
     :param model_name: Whisper model to use (e.g., "base", "small", "medium", "large").
     :param transcript_file: Path to save the transcription as a text file.
+    :param backend: Inference backend from transcription_backends.BACKENDS.
+    :param threads: CPU threads for inference.
     """
-    # Load Whisper model
-    model = whisper.load_model(model_name)
+    def run_backend(path, _cache_name, **options):
+        return transcribe_file(path, model_name, backend, threads, **options)
 
-    # Transcribe audio
+    # Transcribe audio, reusing a cached result for the same audio, model and backend
     print("Transcribing audio...")
-    result = model.transcribe(audio_file)
+    result = transcribe_with_cache(audio_file, cache_model_name(backend, model_name), run_backend)
 
     # Extract transcription text
     transcription = result.get("text", "").strip()
@@ -26,7 +29,8 @@ def transcribe_and_save(audio_file, model_name="base", transcript_file="transcri
     except Exception as e:
         print(f"Error saving transcription:{e}")
 
-# Example usage
-audio_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav"  # Path to your audio file
-output_text_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/transcript.txt"  # Path to save the transcription
-transcribe_and_save(audio_path, transcript_file=output_text_file)
+if __name__ == "__main__":
+    # Example usage
+    audio_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/output_audio.wav"  # Path to your audio file
+    output_text_file = "/Users/nervous/Documents/GitHub/speech-aligner/output/transcript.txt"  # Path to save the transcription
+    transcribe_and_save(audio_path, transcript_file=output_text_file)
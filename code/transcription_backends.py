@@ -0,0 +1,250 @@
+import difflib
+import json
+import os
+import re
+import subprocess
+import time
+
+import numpy as np
+
+from audio_access import open_audio
+from instrumentation import span, count
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 16000
+
+# Every backend returns a Whisper-style result ({"text", "language", "segments": [{..., "words": [...]}]}),
+# so extract_word_data and the transcription cache work the same for all of them
+BACKENDS = {
+    "whisper": "openai-whisper as shipped, fp16 on a GPU when available (the reference)",
+    "whisper-int8": "openai-whisper with its Linear layers dynamically quantized to int8 (needs only torch)",
+    "faster-whisper": "CTranslate2 int8 engine (pip install faster-whisper)",
+}
+DEFAULT_BACKEND = "whisper"
+
+def cache_model_name(backend, model_name):
+    """
+    Name the model in transcription cache keys.
+
+    The reference backend keeps the plain model name so existing cache
+    entries stay valid; the others are prefixed, e.g. "whisper-int8/medium".
+    """
+    return model_name if backend == DEFAULT_BACKEND else f"{backend}/{model_name}"
+
+def _plain_linears(module):
+    """
+    Replace Whisper's Linear subclass with torch.nn.Linear layers sharing the same weights.
+
+    quantize_dynamic only swaps modules whose type is exactly nn.Linear.
+    Whisper's subclass differs only in casting its weights to the input dtype,
+    which is a no-op for the fp32 CPU model being quantized.
+    """
+    import torch
+
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.weight = child.weight
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _plain_linears(child)
+    return module
+
+def _load_whisper(model_name, threads, quantize):
+    import torch
+    import whisper  # Imported here so cache hits never load torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if not quantize:
+        # The reference runs as Whisper ships: on the GPU in fp16 when there is one
+        model = whisper.load_model(model_name)
+    else:
+        # int8 kernels are CPU-only. Only the Linear layers become int8;
+        # convolutions, embeddings and layer norms stay fp32.
+        model = _plain_linears(whisper.load_model(model_name, device="cpu"))
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    def transcribe(audio, beam_size=None, **options):
+        if beam_size and beam_size > 1:
+            options["beam_size"] = beam_size
+        if quantize:
+            options["fp16"] = False
+        return model.transcribe(audio, **options)
+
+    return transcribe
+
+def _load_faster_whisper(model_name, threads):
+    from faster_whisper import WhisperModel
+
+    model = WhisperModel(model_name, device="cpu", compute_type="int8", cpu_threads=threads or 0)
+
+    def transcribe(audio, beam_size=None, word_timestamps=False, **options):
+        segments, info = model.transcribe(audio, beam_size=beam_size or 1, word_timestamps=word_timestamps, **options)
+        result = {"text": "", "language": info.language, "segments": []}
+        for segment in segments:  # A generator: decoding happens while iterating
+            result["text"] += segment.text
+            result["segments"].append({
+                "id": segment.id,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "words": [
+                    {"word": word.word, "start": word.start, "end": word.end, "probability": word.probability}
+                    for word in segment.words or []
+                ],
+            })
+        return result
+
+    return transcribe
+
+def load_transcriber(backend=DEFAULT_BACKEND, model_name="medium", threads=None):
+    """
+    Load a transcription model once and return transcribe(audio, beam_size=None, **options).
+
+    Args:
+        backend (str): A name from BACKENDS.
+        model_name (str): Whisper model size ("base", "medium", ...).
+        threads (int): CPU threads for inference (default: the library's choice).
+
+    The returned function takes a file path or 16 kHz float32 samples, plus
+    beam_size (None or 1 for greedy decoding) and Whisper transcribe options
+    such as word_timestamps=True.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
+    with span("load_transcription_model", backend=backend, model=model_name):
+        if backend == "faster-whisper":
+            return _load_faster_whisper(model_name, threads)
+        return _load_whisper(model_name, threads, quantize=backend == "whisper-int8")
+
+def audio_input(audio_file):
+    """Return 16 kHz WAVs as float32 samples from the shared memory-mapped reader, anything else as a path."""
+    try:
+        audio = open_audio(audio_file)
+    except ValueError:
+        return audio_file
+    return audio.window_float32() if audio.sample_rate == SAMPLE_RATE else audio_file
+
+def transcribe_file(audio_file, model_name, backend=DEFAULT_BACKEND, threads=None, **options):
+    """Load a backend and transcribe one audio file. Only called on a transcription cache miss."""
+    transcribe = load_transcriber(backend, model_name, threads)
+    with span("transcribe", backend=backend, model=model_name):
+        return transcribe(audio_input(audio_file), **options)
+
+def load_clip(path):
+    """Decode any audio file to 16 kHz mono float32 with ffmpeg, as Whisper does internally."""
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path, "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"]
+    return np.frombuffer(subprocess.run(command, capture_output=True, check=True).stdout, dtype=np.float32)
+
+def normalize_words(result):
+    """Lower-case words with punctuation stripped, with their start and end times."""
+    words = []
+    for segment in result["segments"]:
+        for word in segment.get("words", []):
+            text = re.sub(r"[^\w']", "", word["word"].lower())
+            if text:
+                words.append((text, word["start"], word["end"]))
+    return words
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance divided by the reference length."""
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1] / len(reference)
+
+def timing_offset(reference_words, words):
+    """Mean absolute start/end difference in seconds over the words both transcripts agree on."""
+    matcher = difflib.SequenceMatcher(None, [w[0] for w in reference_words], [w[0] for w in words], autojunk=False)
+    offsets = []
+    for block in matcher.get_matching_blocks():
+        for k in range(block.size):
+            ref, hyp = reference_words[block.a + k], words[block.b + k]
+            offsets.append((abs(ref[1] - hyp[1]) + abs(ref[2] - hyp[2])) / 2)
+    return float(np.mean(offsets)) if offsets else None
+
+def compare_backends(clip_paths, model_name="medium", backends=("whisper", "whisper-int8", "faster-whisper"), reference=DEFAULT_BACKEND, threads=None, beam_size=None):
+    """
+    Transcribe each clip with every backend and compare speed and accuracy to the reference.
+
+    Clips are decoded once up front so only inference is timed. Model loading
+    is timed separately. Accuracy is the word error rate against the
+    reference transcript and the mean word timing offset (both 0 for the
+    reference itself). Backends whose library is not installed are skipped.
+
+    Returns:
+        dict: {"model", "threads", "beam_size", "backends": {backend: summary}, "clips": [per-clip rows]}
+    """
+    backends = [reference] + [b for b in backends if b != reference]
+    clips = {path: load_clip(path) for path in clip_paths}
+    results = {}
+    summaries = {}
+    for backend in backends:
+        try:
+            started = time.perf_counter()
+            transcribe = load_transcriber(backend, model_name, threads)
+            load_seconds = time.perf_counter() - started
+        except ImportError as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+        audio_seconds = inference_seconds = 0.0
+        for path, samples in clips.items():
+            started = time.perf_counter()
+            results[backend, path] = transcribe(samples, beam_size=beam_size, word_timestamps=True)
+            inference_seconds += time.perf_counter() - started
+            audio_seconds += len(samples) / SAMPLE_RATE
+            count("backend_clips_transcribed")
+        summaries[backend] = {
+            "load_seconds": round(load_seconds, 2),
+            "inference_seconds": round(inference_seconds, 2),
+            "real_time_factor": round(inference_seconds / max(audio_seconds, 1e-9), 3),
+        }
+    if reference not in summaries:
+        raise RuntimeError(f"The reference backend '{reference}' could not be loaded")
+
+    rows = []
+    for backend in summaries:
+        errors, offsets = [], []
+        for path in clips:
+            reference_words = normalize_words(results[reference, path])
+            words = normalize_words(results[backend, path])
+            wer = word_error_rate([w[0] for w in reference_words], [w[0] for w in words])
+            offset = timing_offset(reference_words, words)
+            rows.append({"clip": os.path.basename(path), "backend": backend, "words": len(words),
+                         "wer": round(wer, 4), "timing_offset": None if offset is None else round(offset, 4)})
+            errors.append(wer)
+            if offset is not None:
+                offsets.append(offset)
+        summaries[backend]["mean_wer"] = round(float(np.mean(errors)), 4) if errors else None
+        summaries[backend]["mean_timing_offset"] = round(float(np.mean(offsets)), 4) if offsets else None
+        summaries[backend]["speedup"] = round(summaries[reference]["inference_seconds"] / max(summaries[backend]["inference_seconds"], 1e-9), 2)
+
+    print(f"{'backend':<16}{'load s':>8}{'RTF':>8}{'speedup':>9}{'WER':>8}{'timing s':>10}")
+    for backend, summary in summaries.items():
+        offset = summary["mean_timing_offset"]
+        print(f"{backend:<16}{summary['load_seconds']:>8.2f}{summary['real_time_factor']:>8.3f}{summary['speedup']:>8.2f}x"
+              f"{summary['mean_wer']:>8.1%}{'-' if offset is None else f'{offset:.3f}':>10}")
+    return {"model": model_name, "threads": threads, "beam_size": beam_size, "backends": summaries, "clips": rows}
+
+def input_clips(inputs_dir=os.path.join(REPO_DIR, "inputs")):
+    """Audio files in inputs/, sorted by name."""
+    return sorted(os.path.join(inputs_dir, name) for name in os.listdir(inputs_dir) if not name.startswith("."))
+
+if __name__ == "__main__":
+    report_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/backend_comparison.json"
+    model_name = "medium"
+    threads = None  # e.g. os.cpu_count() on a dedicated render box
+    beam_size = None  # Greedy decoding; e.g. 5 for beam search
+
+    # Compare every backend against reference Whisper on the clips in inputs/
+    report = compare_backends(input_clips(), model_name, threads=threads, beam_size=beam_size)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Comparison saved to {report_path}")
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from audio_access import open_audio
+from instrumentation import span, count
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "transcriptions.sqlite")
+
+def audio_fingerprint(audio_path, chunk_bytes=8 * 1024 * 1024):
+    """
+    Hash the audio content of a file.
+
+    For WAV files only the PCM data is hashed, so re-exporting the same audio
+    with a different header still hits the cache.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        audio = open_audio(audio_path)
+        data = audio.raw_bytes()  # Zero-copy view of the mapped data chunk
+        digest.update(f"{audio.sample_rate}:{audio.channels}:".encode("ascii"))
+        for offset in range(0, len(data), chunk_bytes):
+            digest.update(data[offset:offset + chunk_bytes])
+    except ValueError:
+        # Not a 16-bit PCM WAV; hash the file as it is
+        with open(audio_path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_bytes), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def compact_result(result):
+    """Keep only the parts of a Whisper result the pipeline uses: text, language, segments and word timings."""
+    segments = []
+    for segment in result.get("segments", []):
+        compact_segment = {"start": segment["start"], "end": segment["end"], "text": segment["text"]}
+        if "words" in segment:
+            compact_segment["words"] = [
+                {"word": word["word"], "start": word["start"], "end": word["end"], "probability": word.get("probability")}
+                for word in segment["words"]
+            ]
+        segments.append(compact_segment)
+    return {"text": result.get("text", ""), "language": result.get("language"), "segments": segments}
+
+class TranscriptionCache:
+    """
+    Persistent cache of Whisper results keyed by (audio fingerprint, model, options).
+
+    Results are stored zlib-compressed in a single SQLite file. When the
+    stored size passes max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS transcriptions (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                options TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                result BLOB NOT NULL
+            )"""
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key(fingerprint, model_name, options):
+        """Return the cache key for an audio fingerprint, model and transcription options."""
+        return f"{fingerprint}:{model_name}:{json.dumps(options, sort_keys=True)}"
+
+    def get(self, fingerprint, model_name, options):
+        """Return the cached result, or None."""
+        key = self.key(fingerprint, model_name, options)
+        row = self.connection.execute("SELECT result FROM transcriptions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            count("transcription_cache_misses")
+            return None
+        self.connection.execute("UPDATE transcriptions SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.connection.commit()
+        count("transcription_cache_hits")
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, fingerprint, model_name, options, result):
+        """Store a result and evict least recently used entries past the size limit."""
+        key = self.key(fingerprint, model_name, options)
+        blob = zlib.compress(json.dumps(compact_result(result), ensure_ascii=False).encode("utf-8"), 9)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO transcriptions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, fingerprint, model_name,
+             json.dumps(options, sort_keys=True), len(blob), time.time(), blob),
+        )
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+        if total > self.max_bytes:
+            # Oldest first, never the entry just stored
+            rows = self.connection.execute("SELECT key, size FROM transcriptions WHERE key != ? ORDER BY last_used", (key,)).fetchall()
+            for old_key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM transcriptions WHERE key = ?", (old_key,))
+                total -= size
+        self.connection.commit()
+
+def transcribe_with_cache(audio_path, model_name, transcribe, cache=None, **options):
+    """
+    Return a cached Whisper result for the audio, or transcribe and cache it.
+
+    Args:
+        audio_path (str): Audio file to transcribe.
+        model_name (str): Whisper model name, part of the cache key.
+        transcribe (callable): transcribe(audio_path, model_name, **options) that
+            loads the model and returns a Whisper result. Only called on a miss,
+            so the model is never loaded when the cache has the answer.
+        cache (TranscriptionCache): Cache to use (default: cache/transcriptions.sqlite).
+        **options: Transcription options, part of the cache key.
+    """
+    cache = cache or TranscriptionCache()
+    with span("audio_fingerprint"):
+        fingerprint = audio_fingerprint(audio_path)
+    result = cache.get(fingerprint, model_name, options)
+    if result is not None:
+        print(f"Using cached {model_name} transcription for {audio_path}")
+        return result
+    result = transcribe(audio_path, model_name, **options)
+    cache.put(fingerprint, model_name, options, result)
+    return result
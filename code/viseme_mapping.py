@@ -1,48 +1,81 @@
-import json
+import os
+from instrumentation import traced
+from timeline_store import Timeline, load_timeline, save_timeline, export_json, split_timeline
 
+# Mouth image for each CMU phoneme; anything else gets DEFAULT_MOUTH_SHAPE
+PHONEME_TO_MOUTH_SHAPE = {
+    "AA": "aei.png", "AE": "aei.png", "AH": "aei.png", "AO": "o.png",
+    "EH": "aei.png", "IH": "aei.png", "IY": "ee.png", "UH": "o.png", "UW": "o.png",
+    "AY": "aei.png", "EY": "ee.png", "OW": "o.png", "OY": "o.png",
+    "F": "fv.png", "V": "fv.png", "B": "bmp.png", "M": "bmp.png", "P": "bmp.png",
+    "C": "cdgknstxyz.png", "D": "cdgknstxyz.png", "G": "cdgknstxyz.png",
+    "K": "cdgknstxyz.png", "N": "cdgknstxyz.png", "S": "cdgknstxyz.png",
+    "T": "cdgknstxyz.png", "X": "cdgknstxyz.png", "Y": "cdgknstxyz.png", "Z": "cdgknstxyz.png",
+    "L": "l.png", "R": "r.png", "W": "qw.png", "Q": "qw.png",
+    "SH": "shch.png", "CH": "shch.png", "JH": "shch.png",
+    "TH": "th.png", "DH": "th.png", "SIL": "aei.png"
+}
+DEFAULT_MOUTH_SHAPE = "aei.png"
+
+def mouth_shapes():
+    """Every mouth image the mapping can produce, plus the neutral mouth the renderer falls back to."""
+    return sorted(set(PHONEME_TO_MOUTH_SHAPE.values()) | {DEFAULT_MOUTH_SHAPE, "neutral.png"})
+
+@traced()
 def map_phonemes_to_visemes(phoneme_data):
     """
     Map phoneme data to viseme data using the updated phoneme-to-image mappings.
     """
-    phoneme_to_mouth_shape = {
-        "AA": "aei.png", "AE": "aei.png", "AH": "aei.png", "AO": "o.png",
-        "EH": "aei.png", "IH": "aei.png", "IY": "ee.png", "UH": "o.png", "UW": "o.png",
-        "AY": "aei.png", "EY": "ee.png", "OW": "o.png", "OY": "o.png",
-        "F": "fv.png", "V": "fv.png", "B": "bmp.png", "M": "bmp.png", "P": "bmp.png",
-        "C": "cdgknstxyz.png", "D": "cdgknstxyz.png", "G": "cdgknstxyz.png",
-        "K": "cdgknstxyz.png", "N": "cdgknstxyz.png", "S": "cdgknstxyz.png",
-        "T": "cdgknstxyz.png", "X": "cdgknstxyz.png", "Y": "cdgknstxyz.png", "Z": "cdgknstxyz.png",
-        "L": "l.png", "R": "r.png", "W": "qw.png", "Q": "qw.png",
-        "SH": "shch.png", "CH": "shch.png", "JH": "shch.png",
-        "TH": "th.png", "DH": "th.png", "SIL": "aei.png"
-    }
-
     viseme_list = []
     for entry in phoneme_data:
         phoneme = entry['phoneme']
-        mouth_shape = phoneme_to_mouth_shape.get(phoneme, "aei.png")  # Default to "aei.png"
+        mouth_shape = PHONEME_TO_MOUTH_SHAPE.get(phoneme, DEFAULT_MOUTH_SHAPE)
 
-        viseme_list.append({
+        viseme_entry = {
             "mouth_shape": mouth_shape,
             "start_time": entry['start_time'],
             "end_time": entry['end_time']
-        })
+        }
+        if 'speaker' in entry:  # Set by the diarization stage
+            viseme_entry["speaker"] = entry['speaker']
+        viseme_list.append(viseme_entry)
 
     return viseme_list
 
+def save_speaker_timelines(viseme_timeline, output_dir, filename="viseme_data.npz"):
+    """
+    Save one viseme timeline per speaker (output_dir/speaker_<id>/<filename>) for multi-character scenes.
+
+    Returns:
+        dict: Speaker ID -> saved path. Empty when the visemes carry no speaker column.
+    """
+    if "speaker" not in viseme_timeline.extra:
+        return {}
+    paths = {}
+    for speaker, speaker_timeline in split_timeline(viseme_timeline, "speaker").items():
+        paths[speaker] = os.path.join(output_dir, f"speaker_{speaker}", filename)
+        os.makedirs(os.path.dirname(paths[speaker]), exist_ok=True)
+        save_timeline(speaker_timeline, paths[speaker])
+    return paths
+
 
 if __name__ == "__main__":
-    # Load phoneme data from the JSON file
-    phoneme_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/phoneme_data.json"  # Replace with the actual file path
-    with open(phoneme_data_path, "r", encoding="utf-8") as json_file:
-        phoneme_data = json.load(json_file)
+    # Load the phoneme timeline (.npz, or a phoneme_data.json from older runs)
+    phoneme_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/phoneme_data.npz"  # Replace with the actual file path
+    phoneme_data = load_timeline(phoneme_data_path, kind="phoneme").to_records()
 
     # Map phonemes to visemes
     viseme_data = map_phonemes_to_visemes(phoneme_data)
 
-    # Save viseme data to a new JSON file
-    viseme_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data.json"
-    with open(viseme_data_path, "w", encoding="utf-8") as json_file:
-        json.dump(viseme_data, json_file, indent=4)
+    # Save the viseme data as a columnar timeline (plus JSON for debugging)
+    viseme_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data.npz"
+    json_output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data.json"  # Set to None to skip
+    viseme_timeline = Timeline.from_records(viseme_data, "viseme")
+    save_timeline(viseme_timeline, viseme_data_path)
+    if json_output_path:
+        export_json(viseme_timeline, json_output_path)
+
+    # With diarized words, also write one timeline per speaker for scene_render.py
+    save_speaker_timelines(viseme_timeline, os.path.dirname(viseme_data_path))
 
     print(f"Viseme data has been exported to {viseme_data_path}")
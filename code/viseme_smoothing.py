@@ -0,0 +1,253 @@
+import os
+
+import numpy as np
+
+from frame_grid import event_index_per_frame, frame_times
+from instrumentation import traced, count
+from timeline_store import Timeline, load_timeline, save_timeline, export_json, split_timeline
+
+# Shapes that must stay on screen even when they are short: skipping a lip
+# closure or lip-teeth contact reads as a lip-sync error
+PRIORITY_SHAPES = {"bmp.png", "fv.png"}
+
+# Look-ahead coarticulation: seconds a shape starts early, taking the time from
+# the shape before it (lips close before a b/m/p and round before o/w)
+ANTICIPATION = {"bmp.png": 0.04, "fv.png": 0.03, "o.png": 0.05, "qw.png": 0.05}
+
+def _check_sequential(start, end, tolerance, advice):
+    """Raise ValueError if sorted events overlap, which the whole-array steps cannot handle."""
+    overlapping = np.flatnonzero(start[1:] < end[:-1] - tolerance)
+    if len(overlapping):
+        i = overlapping[0]
+        raise ValueError(f"Visemes overlap ({start[i]:.3f}-{end[i]:.3f}s and {start[i + 1]:.3f}-{end[i + 1]:.3f}s); {advice}")
+
+def _runs(start, end, tolerance):
+    """Return a run ID per event; events in one run touch each other (gaps of at most `tolerance`)."""
+    breaks = start[1:] - end[:-1] > tolerance
+    return np.concatenate(([0], np.cumsum(breaks)))
+
+def _symbol_table(symbols, values, default):
+    """Per-symbol-ID lookup array built from a {symbol: value} dict."""
+    return np.array([values.get(symbol, default) for symbol in symbols] + [default])
+
+def merge_repeats(start, end, ids, tolerance):
+    """Merge back-to-back events that show the same shape."""
+    if len(start) == 0:
+        return start, end, ids
+    runs = _runs(start, end, tolerance)
+    first = np.ones(len(start), dtype=bool)
+    first[1:] = (ids[1:] != ids[:-1]) | (runs[1:] != runs[:-1])
+    group_starts = np.nonzero(first)[0]
+    return start[first], np.maximum.reduceat(end, group_starts), ids[first]
+
+def anticipate(start, end, ids, lead_seconds, min_hold, tolerance):
+    """Start shapes early by their lead time, never shrinking the previous shape below min_hold."""
+    if len(start) < 2:
+        return start, end
+    start, end = start.copy(), end.copy()
+    touching = start[1:] - end[:-1] <= tolerance
+    room = np.maximum(0.0, (end[:-1] - start[:-1]) - min_hold)
+    shift = np.where(touching, np.minimum(lead_seconds[ids[1:]], room), 0.0)
+    start[1:] -= shift
+    end[:-1] -= shift
+    return start, end
+
+def extend_priority(start, end, ids, is_priority, min_hold, tolerance):
+    """Grow short priority shapes to min_hold, taking the time from their neighbours."""
+    if len(start) == 0:
+        return start, end
+    start, end = start.copy(), end.copy()
+    deficit = np.where(is_priority[ids], np.maximum(0.0, min_hold - (end - start)), 0.0)
+    if not deficit.any():
+        return start, end
+    touching_prev = np.concatenate(([False], start[1:] - end[:-1] <= tolerance))
+    touching_next = np.concatenate((end[:-1] - start[1:] >= -tolerance, [False]))
+    new_start = start - deficit / 2
+    new_end = end + deficit / 2
+    # Stay inside the neighbours' spans so a neighbour can shrink to nothing but not past it
+    new_start = np.where(touching_prev, np.maximum(new_start, np.concatenate(([0.0], start[:-1]))), new_start)
+    new_end = np.where(touching_next, np.minimum(new_end, np.concatenate((end[1:], [0.0]))), new_end)
+    new_start = np.maximum(new_start, 0.0)
+    # Time that could not be taken on the left comes from the right
+    new_end = np.where(touching_next, np.minimum(np.maximum(new_end, new_start + min_hold), np.concatenate((end[1:], [0.0]))),
+                       np.maximum(new_end, new_start + min_hold))
+    end[:-1] = np.where(touching_next[:-1] & (deficit[1:] > 0), new_start[1:], end[:-1])
+    start[1:] = np.where(touching_prev[1:] & (deficit[:-1] > 0), new_end[:-1], start[1:])
+    grow = deficit > 0
+    start[grow] = new_start[grow]
+    end[grow] = new_end[grow]
+    # Two short priority shapes in a row can grow into each other; they meet halfway
+    overlap = touching_next[:-1] & (end[:-1] > start[1:])
+    middle = (end[:-1] + start[1:]) / 2
+    end[:-1] = np.where(overlap, middle, end[:-1])
+    start[1:] = np.where(overlap, middle, start[1:])
+    return start, end
+
+def drop_short(start, end, ids, is_priority, min_hold, tolerance):
+    """
+    Remove shapes shorter than min_hold and give their time to the shapes around them.
+
+    Priority shapes are never removed. In a run of touching shapes that are
+    all short, the longest one is kept so the mouth still moves.
+    """
+    if len(start) == 0:
+        return start, end, ids
+    duration = end - start
+    runs = _runs(start, end, tolerance)
+    keep = (duration >= min_hold) | is_priority[ids]
+    run_starts = np.nonzero(np.concatenate(([True], runs[1:] != runs[:-1])))[0]
+    run_has_keeper = np.maximum.reduceat(keep.astype(np.int8), run_starts).astype(bool)
+    run_longest = np.maximum.reduceat(duration, run_starts)
+    keep |= ~run_has_keeper[runs] & (duration == run_longest[runs])
+    count("visemes_dropped", int((~keep).sum()))
+
+    run_begin = np.minimum.reduceat(start, run_starts)[runs]
+    run_finish = np.maximum.reduceat(end, run_starts)[runs]
+    kept = np.nonzero(keep)[0]
+    start, end, ids, runs = start[kept], end[kept], ids[kept], runs[kept]
+    run_begin, run_finish = run_begin[kept], run_finish[kept]
+
+    # Close the holes: neighbours in a run meet halfway, and the run keeps its outer edges
+    same_run = runs[1:] == runs[:-1]
+    middle = (end[:-1] + start[1:]) / 2
+    end[:-1] = np.where(same_run, middle, end[:-1])
+    start[1:] = np.where(same_run, middle, start[1:])
+    first_in_run = np.concatenate(([True], ~same_run))
+    last_in_run = np.concatenate((~same_run, [True]))
+    start = np.where(first_in_run, run_begin, start)
+    end = np.where(last_in_run, run_finish, end)
+    return start, end, ids
+
+def blend_in_times(start, end, blend_seconds, tolerance):
+    """Cross-fade length into each shape from the one before it (0 after a pause)."""
+    blend = np.minimum(blend_seconds, (end - start) / 2)
+    touching_prev = np.concatenate(([False], start[1:] - end[:-1] <= tolerance))
+    return np.where(touching_prev, blend, 0.0).astype(np.float32)
+
+def _smooth_part(timeline, fps, min_hold, blend_seconds, anticipation, priority_shapes, tolerance):
+    order = np.argsort(timeline.start, kind="stable")
+    start = timeline.start[order].astype(np.float64)
+    end = timeline.end[order].astype(np.float64)
+    ids = timeline.symbol_ids[order].astype(np.int64)
+    _check_sequential(start, end, tolerance, "a timeline with several speakers needs its \"speaker\" column so each is smoothed separately")
+    lead_seconds = _symbol_table(timeline.symbols, anticipation, 0.0)
+    is_priority = _symbol_table(timeline.symbols, dict.fromkeys(priority_shapes, True), False).astype(bool)
+    min_hold = max(min_hold, 1.0 / fps)  # Nothing shorter than a frame can ever be seen
+
+    start, end, ids = merge_repeats(start, end, ids, tolerance)
+    start, end = anticipate(start, end, ids, lead_seconds, min_hold, tolerance)
+    start, end = extend_priority(start, end, ids, is_priority, min_hold, tolerance)
+    start, end, ids = drop_short(start, end, ids, is_priority, min_hold, tolerance)
+    start, end, ids = merge_repeats(start, end, ids, tolerance)
+    extra = {}
+    if blend_seconds > 0:
+        extra["blend_in"] = blend_in_times(start, end, blend_seconds, tolerance)
+    return start, end, ids, extra
+
+@traced()
+def smooth_visemes(viseme_timeline, fps=30, min_hold=0.07, blend_seconds=0.0, anticipation=ANTICIPATION, priority_shapes=PRIORITY_SHAPES, tolerance=1e-3):
+    """
+    Remove mouth-shape flicker and add coarticulation to a viseme timeline.
+
+    Steps, each over whole arrays:
+    1. merge back-to-back repeats of the same shape,
+    2. start shapes in `anticipation` early (e.g. lips close before b/m/p),
+    3. hold priority shapes (bmp, fv) for min_hold where the neighbours leave room,
+    4. drop every other shape shorter than min_hold (and anything under one
+       frame), giving its time to its neighbours,
+    5. merge repeats created by the drops.
+
+    Args:
+        viseme_timeline (Timeline): Output of viseme mapping. Speakers (if
+            tagged by diarization) are smoothed separately; within each, the
+            visemes must not overlap.
+        fps (int): Output frame rate.
+        min_hold (float): Shortest time a shape stays on screen, in seconds.
+        blend_seconds (float): If > 0, add a "blend_in" column with the
+            cross-fade length into each shape, for the renderer.
+
+    Raises:
+        ValueError: If visemes of one speaker (or of an untagged timeline) overlap.
+
+    Returns:
+        Timeline: The smoothed visemes.
+    """
+    if "speaker" in viseme_timeline.extra:
+        parts = split_timeline(viseme_timeline, "speaker")
+    else:
+        parts = {None: viseme_timeline}
+
+    columns = {"start": [], "end": [], "ids": [], "speaker": [], "blend_in": []}
+    for speaker, part in parts.items():
+        start, end, ids, extra = _smooth_part(part, fps, min_hold, blend_seconds, anticipation, priority_shapes, tolerance)
+        columns["start"].append(start)
+        columns["end"].append(end)
+        columns["ids"].append(ids)
+        columns["speaker"].append(np.full(len(start), -1 if speaker is None else speaker, dtype=np.int16))
+        if "blend_in" in extra:
+            columns["blend_in"].append(extra["blend_in"])
+
+    start = np.concatenate(columns["start"])
+    order = np.argsort(start, kind="stable")
+    extra = {}
+    if "speaker" in viseme_timeline.extra:
+        extra["speaker"] = np.concatenate(columns["speaker"])[order]
+    if columns["blend_in"]:
+        extra["blend_in"] = np.concatenate(columns["blend_in"])[order]
+    smoothed = Timeline("viseme", start[order], np.concatenate(columns["end"])[order],
+                        np.concatenate(columns["ids"])[order], viseme_timeline.symbols, extra)
+    print(f"Smoothed {len(viseme_timeline)} visemes down to {len(smoothed)}")
+    return smoothed
+
+def frame_blend_weights(viseme_timeline, total_frames, fps, start_frame=0, tolerance=1e-3):
+    """
+    Resolve the cross-fades of a smoothed timeline for frames [start_frame, total_frames).
+
+    The timeline drives one mouth, so its visemes must be sorted and must not
+    overlap. Scenes with several speakers render each speaker's own timeline
+    (speaker_<id>/viseme_data_smoothed.npz, from save_speaker_timelines).
+
+    Raises:
+        ValueError: If visemes overlap, e.g. the combined timeline of several speakers.
+
+    Returns:
+        tuple: (current, previous, weight) arrays — the symbol ID shown (-1
+            for none), the symbol ID fading out (-1 for none) and the weight
+            of the current shape (1.0 outside cross-fades).
+    """
+    if np.any(np.diff(viseme_timeline.start) < 0):
+        raise ValueError("Visemes must be sorted by start time")
+    _check_sequential(viseme_timeline.start, viseme_timeline.end, tolerance,
+                      "render each speaker's speaker_<id>/viseme_data_smoothed.npz instead of the combined timeline")
+    index = event_index_per_frame(viseme_timeline.start, viseme_timeline.end, total_frames, fps, start_frame)
+    clamped = np.maximum(index, 0)
+    active = index >= 0
+    current = np.where(active, viseme_timeline.symbol_ids[clamped], -1).astype(np.int32) if len(viseme_timeline) else index.astype(np.int32)
+
+    blend_in = viseme_timeline.extra.get("blend_in")
+    if blend_in is None or not len(viseme_timeline):
+        return current, np.full(len(index), -1, dtype=np.int32), np.ones(len(index), dtype=np.float32)
+    # Progress is measured from the event's true start, not from its first frame
+    times = frame_times(start_frame, total_frames, fps)
+    progress = (times - viseme_timeline.start[clamped]) / np.maximum(blend_in[clamped], 1e-6)
+    fading = active & (index > 0) & (blend_in[clamped] > 0) & (progress < 1.0)
+    previous = np.where(fading, viseme_timeline.symbol_ids[np.maximum(index - 1, 0)], -1).astype(np.int32)
+    weight = np.where(fading, np.clip(progress, 0.0, 1.0), 1.0).astype(np.float32)
+    return current, previous, weight
+
+if __name__ == "__main__":
+    from viseme_mapping import save_speaker_timelines
+
+    viseme_data_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data.npz"
+    smoothed_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data_smoothed.npz"
+    json_output_path = "/Users/nervous/Documents/GitHub/speech-aligner/output/viseme_data_smoothed.json"  # Set to None to skip
+    fps = 30
+    min_hold = 0.07  # About two frames at 30 fps
+    blend_seconds = 0.0  # e.g. 0.05 to cross-fade between mouth shapes
+
+    # Smooth the raw viseme timeline from viseme_mapping.py into a separate file, so re-running starts from the same input
+    viseme_timeline = smooth_visemes(load_timeline(viseme_data_path, kind="viseme"), fps, min_hold, blend_seconds)
+    save_timeline(viseme_timeline, smoothed_path)
+    if json_output_path:
+        export_json(viseme_timeline, json_output_path)
+    save_speaker_timelines(viseme_timeline, os.path.dirname(smoothed_path), os.path.basename(smoothed_path))
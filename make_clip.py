@@ -1,6 +1,7 @@
 import subprocess
 import os
 import shutil
+import sys
 
 def duplicate_transcript(original_path, duplicate_path):
     """Duplicate the transcript file."""
@@ -37,10 +38,17 @@ def main():
         "create-word-data.py",
         "phoneme_mapping.py",
         "viseme_mapping.py",
+        "viseme_smoothing.py",
         "pose_data.py",
         "animate_poses.py"
     ]
 
+    # With --overlapped, one pipeline transcribes, maps and renders chunk by chunk (no pose editing step)
+    if "--overlapped" in sys.argv:
+        run_script(os.path.join(script_dir, "audio_conversion.py"))
+        run_script(os.path.join(script_dir, "streaming_pipeline.py"))
+        return
+
     # Run the first set of scripts
     for script in scripts:
         script_path = os.path.join(script_dir, script)
@@ -65,5 +73,10 @@ def main():
         else:
             print(f"Script not found: {script_path}")
 
+    # Step 4: Combine the stage traces (when run with SPEECH_ALIGNER_TRACE=<dir>)
+    trace_dir = os.environ.get("SPEECH_ALIGNER_TRACE")
+    if trace_dir:
+        run_script(os.path.join(script_dir, "instrumentation.py"), trace_dir)
+
 if __name__ == "__main__":
     main()